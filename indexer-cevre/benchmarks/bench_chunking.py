@@ -0,0 +1,86 @@
+"""
+Micro-benchmark of the parent and child chunking: the langchain RecursiveCharacterTextSplitter pair built on every
+call (10000/2000 characters) against the reusable TokenChunker pair of utils.utils (CHUNKING_CONFIG tokens).
+
+The corpus is made of the distinct parent and child texts of a chunk dump (a JSON list of chunks, or a JSONL file
+written with CHUNK_DUMP_ENABLED), joined into one document and repeated to get a measurable size. Run it from the
+service directory:
+
+    python benchmarks/bench_chunking.py --corpus chunks_output.json --repeat 200
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from config import CHUNKING_CONFIG
+from utils.utils import parent_chunker, child_chunker, count_tokens
+
+# The input limit of text-embedding-ada-002
+EMBEDDING_TOKEN_LIMIT = 8191
+
+
+def load_corpus(corpus_path, repeat):
+    with open(corpus_path, encoding="utf-8") as f:
+        if corpus_path.endswith(".jsonl"):
+            chunks = [json.loads(line) for line in f if line.strip()]
+        else:
+            chunks = json.load(f)
+    texts = []
+    for chunk in chunks:
+        for key in ("parent_chunk", "chunk"):
+            if chunk.get(key) and chunk[key] not in texts:
+                texts.append(chunk[key])
+    return "\n\n".join(texts * repeat)
+
+
+def split_with_langchain(text):
+    parent_splitter = RecursiveCharacterTextSplitter(chunk_size=10000)
+    child_splitter = RecursiveCharacterTextSplitter(chunk_size=2000)
+    parents = parent_splitter.split_text(text)
+    return parents, [child for parent in parents for child in child_splitter.split_text(parent)]
+
+
+def split_with_token_chunker(text):
+    parents = [chunk.text for chunk in parent_chunker.split(text)]
+    return parents, [chunk.text for parent in parents for chunk in child_chunker.split(parent)]
+
+
+def measure(split, text, rounds):
+    timings = []
+    for _ in range(rounds):
+        started_at = time.perf_counter()
+        parents, children = split(text)
+        timings.append(time.perf_counter() - started_at)
+    child_tokens = [count_tokens(child) for child in children]
+    return {
+        "best_seconds": round(min(timings), 4),
+        "mb_per_second": round(len(text) / min(timings) / 1e6, 2),
+        "parents": len(parents),
+        "children": len(children),
+        "max_child_tokens": max(child_tokens, default=0),
+        "children_over_budget": sum(1 for tokens in child_tokens if tokens > CHUNKING_CONFIG["child_chunk_tokens"]),
+        "children_over_model_limit": sum(1 for tokens in child_tokens if tokens > EMBEDDING_TOKEN_LIMIT),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default="chunks_output.json", help="The chunk dump to build the corpus from.")
+    parser.add_argument("--repeat", type=int, default=200, help="How many times the corpus texts are repeated.")
+    parser.add_argument("--rounds", type=int, default=5, help="How many times each splitter is timed.")
+    args = parser.parse_args()
+
+    text = load_corpus(args.corpus, args.repeat)
+    print(f"Corpus: {len(text)} characters, {count_tokens(text)} tokens")
+    for name, split in (("langchain", split_with_langchain), ("token_chunker", split_with_token_chunker)):
+        print(name, json.dumps(measure(split, text, args.rounds)))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,13 +6,20 @@ load_dotenv()
 
 # Chatbot Configuration
 EMBEDDING_DIMENSION = 1536
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 16))
 AUTHORIZATION_TOKEN = os.environ['AUTHORIZATION_TOKEN']
 
 # Secret Keys
 COGNITIVE_SEARCH_CONFIG = {
     'api_key': os.environ['COGNITIVE_SEARCH_API_KEY'],
     'endpoint': os.environ['COGNITIVE_SEARCH_ENDPOINT'],
-    'index_name': os.environ['COGNITIVE_SEARCH_INDEX_NAME']
+    'index_name': os.environ['COGNITIVE_SEARCH_INDEX_NAME'],
+    # The parent chunks are stored once in their own index instead of in every child chunk
+    'parent_index_name': os.environ.get('COGNITIVE_SEARCH_PARENT_INDEX_NAME',
+                                        os.environ['COGNITIVE_SEARCH_INDEX_NAME'] + '-parents'),
+    # One row per indexed document, for the metadata queries that do not need the chunks
+    'catalog_index_name': os.environ.get('COGNITIVE_SEARCH_CATALOG_INDEX_NAME',
+                                         os.environ['COGNITIVE_SEARCH_INDEX_NAME'] + '-catalog')
 }
 
 ADA_CONFIG = {
@@ -36,11 +43,114 @@ BLOB_STORAGE_CONFIG = {
     'container_name': os.environ['BLOB_STORAGE_CONTAINER_NAME']
 }
 
+# OpenAI Client Settings
+OPENAI_CLIENT_CONFIG = {
+    'max_connections': int(os.environ.get('OPENAI_MAX_CONNECTIONS', 100)),
+    'max_keepalive_connections': int(os.environ.get('OPENAI_MAX_KEEPALIVE_CONNECTIONS', 20)),
+    'keepalive_expiry': float(os.environ.get('OPENAI_KEEPALIVE_EXPIRY', 30)),
+    'http2': os.environ.get('OPENAI_HTTP2', 'true').lower() == 'true'
+}
+
+# Azure OpenAI quota of the deployments, enforced on the client side. The quota is assigned to each deployment
+# in Azure OpenAI Studio and depends on the model, the region and the subscription, so it has no default
+RATE_LIMIT_CONFIG = {
+    'embedding': {
+        'requests_per_minute': int(os.environ['ADA_REQUESTS_PER_MINUTE']),
+        'tokens_per_minute': int(os.environ['ADA_TOKENS_PER_MINUTE'])
+    },
+    'completion': {
+        'requests_per_minute': int(os.environ['GPT_REQUESTS_PER_MINUTE']),
+        'tokens_per_minute': int(os.environ['GPT_TOKENS_PER_MINUTE'])
+    },
+    'max_retries': int(os.environ.get('OPENAI_MAX_RETRIES', 6))
+}
+
+# Local State Settings, the ingestion ledger, the vector snapshot, the embedding cache and the chunk dumps are kept
+# in this directory, which must be a persistent volume when the service runs in a container (see the dockerfile)
+DATA_DIR = os.environ.get('DATA_DIR', '.')
+
+# Embedding Cache Settings
+EMBEDDING_CACHE_CONFIG = {
+    'enabled': os.environ.get('EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true',
+    'path': os.environ.get('EMBEDDING_CACHE_PATH', os.path.join(DATA_DIR, 'embedding_cache.db')),
+    'max_size_mb': int(os.environ.get('EMBEDDING_CACHE_MAX_SIZE_MB', 2048))
+}
+
+# In-process cache of the query embeddings of the search path, with an optional disk tier shared by the processes
+QUERY_EMBEDDING_CACHE_CONFIG = {
+    'enabled': os.environ.get('QUERY_EMBEDDING_CACHE_ENABLED', 'true').lower() == 'true',
+    'max_entries': int(os.environ.get('QUERY_EMBEDDING_CACHE_MAX_ENTRIES', 10000)),
+    'max_size_mb': int(os.environ.get('QUERY_EMBEDDING_CACHE_MAX_SIZE_MB', 64)),
+    'ttl_seconds': int(os.environ.get('QUERY_EMBEDDING_CACHE_TTL_SECONDS', 3600)),
+    'disk_enabled': os.environ.get('QUERY_EMBEDDING_CACHE_DISK_ENABLED', 'false').lower() == 'true',
+    # The SQLite file of the disk tier, separate from the embedding cache of the ingestion
+    'disk_path': os.environ.get('QUERY_EMBEDDING_CACHE_DISK_PATH', os.path.join(DATA_DIR, 'query_embedding_cache.db')),
+    'disk_max_size_mb': int(os.environ.get('QUERY_EMBEDDING_CACHE_DISK_MAX_SIZE_MB', 256))
+}
+
 # API Settings
 PORT = "8000"
 HOST = "0.0.0.0"
 CONCURRENCY_LIMIT = 50
 
+# Ingestion Pipeline Settings
+PIPELINE_CONFIG = {
+    'queue_size': int(os.environ.get('PIPELINE_QUEUE_SIZE', 8)),
+    'download_workers': int(os.environ.get('PIPELINE_DOWNLOAD_WORKERS', 4)),
+    'parse_workers': int(os.environ.get('PIPELINE_PARSE_WORKERS', 2)),
+    'chunk_workers': int(os.environ.get('PIPELINE_CHUNK_WORKERS', 1)),
+    'embed_workers': int(os.environ.get('PIPELINE_EMBED_WORKERS', 4)),
+    'upload_workers': int(os.environ.get('PIPELINE_UPLOAD_WORKERS', 2))
+}
+LEDGER_PATH = os.environ.get('INGESTION_LEDGER_PATH', os.path.join(DATA_DIR, 'ingestion_ledger.db'))
+# Replaced blobs of already indexed regulations are diffed against the index instead of being skipped
+UPDATE_MODE = os.environ.get('INGESTION_UPDATE_MODE', 'true').lower() == 'true'
+# Regulations flow through the pipeline in windows of this many parent chunks
+WINDOW_PARENT_CHUNKS = int(os.environ.get('INGESTION_WINDOW_PARENT_CHUNKS', 20))
+# Zips larger than this are spooled to disk while they are processed
+ZIP_SPOOL_MAX_SIZE = int(os.environ.get('ZIP_SPOOL_MAX_SIZE', 64 * 1024 * 1024))
+# Minimum number of bytes fetched by a ranged blob read
+ZIP_RANGE_BLOCK_SIZE = int(os.environ.get('ZIP_RANGE_BLOCK_SIZE', 64 * 1024))
+
+# Search Upload Settings
+SEARCH_UPLOAD_CONFIG = {
+    'initial_batch_action_count': int(os.environ.get('SEARCH_BATCH_ACTION_COUNT', 256)),
+    'auto_flush_interval': int(os.environ.get('SEARCH_AUTO_FLUSH_INTERVAL', 10)),
+    'upload_concurrency': int(os.environ.get('SEARCH_UPLOAD_CONCURRENCY', 4)),
+    'max_retries_per_action': int(os.environ.get('SEARCH_MAX_RETRIES_PER_ACTION', 3))
+}
+
+# Chunk Dump Settings, the ingested chunks are only written to disk when enabled
+CHUNK_DUMP_CONFIG = {
+    'enabled': os.environ.get('CHUNK_DUMP_ENABLED', 'false').lower() == 'true',
+    'directory': os.environ.get('CHUNK_DUMP_DIRECTORY', os.path.join(DATA_DIR, 'chunk_dumps')),
+    'format': os.environ.get('CHUNK_DUMP_FORMAT', 'jsonl'),  # jsonl or parquet
+    'max_file_size_mb': int(os.environ.get('CHUNK_DUMP_MAX_FILE_SIZE_MB', 256))
+}
+
+# Vector Snapshot Settings, the uploaded documents are kept locally to rebuild the indexes without embedding
+VECTOR_SNAPSHOT_CONFIG = {
+    'enabled': os.environ.get('VECTOR_SNAPSHOT_ENABLED', 'true').lower() == 'true',
+    'path': os.environ.get('VECTOR_SNAPSHOT_PATH', os.path.join(DATA_DIR, 'vector_snapshot.db')),
+    'vector_dtype': os.environ.get('VECTOR_SNAPSHOT_VECTOR_DTYPE', 'float32')  # float32 or float16
+}
+
+# Chunking Settings, in tokens of the embedding model
+CHUNKING_CONFIG = {
+    'parent_chunk_tokens': int(os.environ.get('PARENT_CHUNK_TOKENS', 2500)),
+    'child_chunk_tokens': int(os.environ.get('CHILD_CHUNK_TOKENS', 500)),
+    'chunk_overlap_tokens': int(os.environ.get('CHUNK_OVERLAP_TOKENS', 50)),
+    # Mean distance of the content-defined parent boundaries, which keep an edit from moving every later parent;
+    # 0 cuts the parents by size only
+    'parent_boundary_tokens': int(os.environ.get('PARENT_BOUNDARY_TOKENS', 5000))
+}
+
+# PDF Parsing Settings
+PDF_PARSE_CONFIG = {
+    'workers': int(os.environ.get('PDF_PARSE_WORKERS', 0)),  # 0 uses every CPU available to the container
+    'pages_per_task': int(os.environ.get('PDF_PAGES_PER_TASK', 50))
+}
+
 # Logging Configuration
 logger = logging.getLogger('PoC')
 formatter = logging.Formatter('%(asctime)s - %(levelname)s: %(message)s', "%Y-%m-%d %H:%M:%S")
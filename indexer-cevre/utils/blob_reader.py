@@ -0,0 +1,89 @@
+import io
+
+
+class BlobRangeReader(io.RawIOBase):
+    """
+    A read-only, seekable file over a blob that downloads only the byte ranges which are read, so that zipfile fetches
+    the central directory and the requested members instead of the whole archive. Reads are served from blocks of at
+    least block_size bytes, the last one aligned to the end of the blob.
+
+    Args:
+        blob_client (BlobClient): The client of the blob to read.
+        size (int): The size of the blob in bytes.
+        block_size (int): The minimum number of bytes fetched per request.
+    """
+
+    def __init__(self, blob_client, size, block_size=64 * 1024):
+        super().__init__()
+        self._blob_client = blob_client
+        self._size = size
+        self._block_size = block_size
+        self._position = 0
+        self._block = b""
+        self._block_start = 0
+        self.request_count = 0
+        self.downloaded_bytes = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError(f"Negative seek position: {position}")
+        self._position = position
+        return self._position
+
+    def readinto(self, buffer):
+        if self._position >= self._size:
+            return 0
+
+        end = min(self._position + len(buffer), self._size)
+        block_end = self._block_start + len(self._block)
+        if self._position < self._block_start or end > block_end:
+            self._fetch(self._position, end)
+
+        data = self._block[self._position - self._block_start:end - self._block_start]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def _fetch(self, start, end):
+        length = max(end - start, self._block_size)
+        # Align blocks near the end of the blob to its end, where the zip central directory is
+        start = max(0, min(start, self._size - length))
+        length = min(length, self._size - start)
+        self._block = self._blob_client.download_blob(offset=start, length=length).readall()
+        self._block_start = start
+        self.request_count += 1
+        self.downloaded_bytes += len(self._block)
+
+    def is_fully_buffered(self):
+        """
+        Checks whether the last fetched block holds the whole blob, e.g. because the blob is smaller than a block.
+
+        Returns:
+            bool: True if the whole blob is in memory, False otherwise.
+        """
+        return self._block_start == 0 and len(self._block) == self._size
+
+    def getvalue(self):
+        """
+        Returns the whole blob, only available when is_fully_buffered is True.
+        """
+        if not self.is_fully_buffered():
+            raise ValueError("The blob is not fully buffered.")
+        return self._block
@@ -0,0 +1,211 @@
+import collections
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from config import app_logger
+
+STATUS_IN_PROGRESS = "in_progress"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+STATUS_SKIPPED = "skipped"
+
+FINISHED_STATUSES = (STATUS_DONE, STATUS_SKIPPED)
+
+# The reason of the blobs skipped because their regulation was found in the search index, e.g. when it was indexed
+# before the ledger existed; such a blob counts as an indexed version, like a done one
+REASON_ALREADY_INDEXED = "already indexed"
+
+# The marker of the document catalog once it is filled with every document of the chunk index
+MARKER_CATALOG_BACKFILLED = "catalog_backfilled"
+
+
+class IngestionLedger:
+    """
+    A local SQLite record of the ingestion status of every blob, keyed by blob name, etag and content hash. Done and
+    skipped blobs are not processed again, failed and interrupted ones are; completed one-off tasks are recorded as
+    markers.
+
+    Args:
+        ledger_path (str): The file path of the SQLite database.
+    """
+
+    def __init__(self, ledger_path):
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(ledger_path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                blob_name TEXT NOT NULL,
+                etag TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                status TEXT NOT NULL,
+                reason TEXT,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (blob_name, etag, content_hash)
+            )
+        """)
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS markers (
+                name TEXT PRIMARY KEY,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        rows = self._connection.execute(
+            "SELECT blob_name, etag, content_hash FROM blobs WHERE status IN (?, ?)", FINISHED_STATUSES
+        ).fetchall()
+        self._finished = set(rows)
+        # The last status of every blob marked since the ledger was opened, i.e. in the current run
+        self._session_statuses = {}
+        app_logger.info(f"Ingestion ledger {ledger_path} is loaded with {len(self._finished)} finished blobs.")
+
+    def is_finished(self, blob_name, etag, content_hash):
+        """
+        Checks whether this version of the blob is already done or skipped.
+
+        Args:
+            blob_name (str): The name of the blob.
+            etag (str): The etag of the blob.
+            content_hash (str): The content hash of the blob.
+
+        Returns:
+            bool: True if the blob does not need to be processed again, False otherwise.
+        """
+        return (blob_name, etag, content_hash) in self._finished
+
+    def has_other_version(self, blob_name, etag, content_hash):
+        """
+        Checks whether another version of the blob is already indexed, i.e. done or skipped because it was found in
+        the search index, so the blob was replaced since it was indexed.
+
+        Args:
+            blob_name (str): The name of the blob.
+            etag (str): The etag of the current version of the blob.
+            content_hash (str): The content hash of the current version of the blob.
+
+        Returns:
+            bool: True if a different version of the blob is indexed, False otherwise.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM blobs WHERE blob_name = ? AND (status = ? OR (status = ? AND reason = ?)) "
+                "AND NOT (etag = ? AND content_hash = ?) LIMIT 1",
+                (blob_name, STATUS_DONE, STATUS_SKIPPED, REASON_ALREADY_INDEXED, etag, content_hash)
+            ).fetchone()
+        return row is not None
+
+    def mark(self, blob_name, etag, content_hash, status, reason=None):
+        """
+        Records the status of a blob, together with the reason for skipped and failed blobs.
+
+        Args:
+            blob_name (str): The name of the blob.
+            etag (str): The etag of the blob.
+            content_hash (str): The content hash of the blob.
+            status (str): One of in_progress, done, failed or skipped.
+            reason (str): Why the blob is skipped or failed.
+
+        Returns:
+            N/A
+        """
+        key = (blob_name, etag, content_hash)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO blobs (blob_name, etag, content_hash, status, reason, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, status, reason, datetime.now(timezone.utc).isoformat())
+            )
+            if status in FINISHED_STATUSES:
+                self._finished.add(key)
+            else:
+                self._finished.discard(key)
+            self._session_statuses[key] = status
+
+    def status_counts(self):
+        """
+        Counts the recorded blobs by their status.
+
+        Args:
+            N/A
+
+        Returns:
+            Dict: The number of blobs for every status.
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT status, COUNT(*) FROM blobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def session_status_counts(self):
+        """
+        Counts the blobs marked since the ledger was opened by their last status.
+
+        Args:
+            N/A
+
+        Returns:
+            Dict: The number of blobs for every status.
+        """
+        with self._lock:
+            return dict(collections.Counter(self._session_statuses.values()))
+
+    def has_marker(self, name):
+        """
+        Checks whether a marker is set.
+
+        Args:
+            name (str): The name of the marker, e.g. MARKER_CATALOG_BACKFILLED.
+
+        Returns:
+            bool: True if the marker is set, False otherwise.
+        """
+        with self._lock:
+            row = self._connection.execute("SELECT 1 FROM markers WHERE name = ?", (name,)).fetchone()
+        return row is not None
+
+    def set_marker(self, name, is_set=True):
+        """
+        Sets or clears a marker.
+
+        Args:
+            name (str): The name of the marker.
+            is_set (bool): Whether the marker is set or cleared.
+
+        Returns:
+            N/A
+        """
+        with self._lock:
+            if is_set:
+                self._connection.execute("INSERT OR REPLACE INTO markers (name, updated_at) VALUES (?, ?)",
+                                         (name, datetime.now(timezone.utc).isoformat()))
+            else:
+                self._connection.execute("DELETE FROM markers WHERE name = ?", (name,))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def read_marker(ledger_path, name):
+    """
+    Checks whether a marker is set, for the processes that do not own the ledger, e.g. the search. The ledger is
+    opened read-only, so it is never created or changed.
+
+    Args:
+        ledger_path (str): The file path of the SQLite database.
+        name (str): The name of the marker, e.g. MARKER_CATALOG_BACKFILLED.
+
+    Returns:
+        bool: True if the marker is set, False if it is not or the ledger cannot be read.
+    """
+    try:
+        connection = sqlite3.connect(f"file:{quote(os.path.abspath(ledger_path))}?mode=ro", uri=True)
+        try:
+            row = connection.execute("SELECT 1 FROM markers WHERE name = ?", (name,)).fetchone()
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        app_logger.info(f"Marker {name} could not be read from the ingestion ledger: {str(e)}")
+        return False
+    return row is not None
@@ -0,0 +1,414 @@
+import asyncio
+import collections
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+
+from config import app_logger
+
+
+class EmbeddingCache:
+    """
+    A persistent cache of embedding vectors in SQLite, keyed by the hash of the deployment, the model and the normalized
+    text. The least recently used vectors are evicted down to 90% of max_size_bytes.
+
+    Args:
+        cache_path (str): The file path of the SQLite database.
+        max_size_bytes (int): The maximum total size of the stored vectors.
+    """
+
+    def __init__(self, cache_path, max_size_bytes):
+        self.cache_path = cache_path
+        self.max_size_bytes = max_size_bytes
+        self._lock = threading.Lock()
+        self._connection = None
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get_connection(self):
+        # Must be called while holding the lock
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.cache_path, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL,
+                    created_at REAL NOT NULL DEFAULT 0
+                )
+            """)
+            columns = {row[1] for row in self._connection.execute("PRAGMA table_info(embeddings)")}
+            if "created_at" not in columns:
+                # The vectors of a cache created before are treated as stored at the epoch
+                self._connection.execute("ALTER TABLE embeddings ADD COLUMN created_at REAL NOT NULL DEFAULT 0")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+            app_logger.info(f"Embedding cache {self.cache_path} is loaded with {self._size} bytes of vectors.")
+        return self._connection
+
+    @staticmethod
+    def make_key(deployment_config, text):
+        """
+        Builds the cache key of a text embedded by the given deployment.
+
+        Args:
+            deployment_config (Dict): The configuration of the embedding deployment, e.g. ADA_CONFIG.
+            text (str): The text to embed.
+
+        Returns:
+            str: The hex SHA-256 digest of the deployment, the model and the normalized text.
+        """
+        normalized_text = " ".join(text.split())
+        content = f"{deployment_config['deployment_name']}\0{deployment_config['model']}\0{normalized_text}"
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get_entries(self, keys):
+        """
+        Looks up the vectors of the given keys with the time they were stored, and marks the found ones as recently
+        used.
+
+        Args:
+            keys (List[str]): The cache keys.
+
+        Returns:
+            Dict[str, Tuple[list, float]]: The found vectors and the times they were stored by their key.
+        """
+        keys = list(set(keys))
+        vectors = {}
+        with self._lock:
+            connection = self._get_connection()
+            # Stay below the SQLite limit of variables per statement
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = connection.execute(
+                    f"SELECT key, vector, created_at FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch
+                ).fetchall()
+                for key, blob, created_at in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    vectors[key] = (vector.tolist(), created_at)
+            if vectors:
+                now = time.time()
+                # One transaction for all hits, instead of a commit per updated row
+                connection.execute("BEGIN")
+                connection.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                       [(now, key) for key in vectors])
+                connection.execute("COMMIT")
+            self.hits += len(vectors)
+            self.misses += len(keys) - len(vectors)
+        return vectors
+
+    def get_many(self, keys):
+        """
+        Looks up the vectors of the given keys and marks the found ones as recently used.
+
+        Args:
+            keys (List[str]): The cache keys.
+
+        Returns:
+            Dict[str, list]: The found vectors by their key.
+        """
+        return {key: vector for key, (vector, _) in self.get_entries(keys).items()}
+
+    def get(self, key):
+        """
+        Looks up the vector of a single key.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            list or None: The vector, None if it is not cached.
+        """
+        return self.get_many([key]).get(key)
+
+    def put_many(self, vectors):
+        """
+        Stores vectors by their key and evicts the least recently used ones if the cache is full.
+
+        Args:
+            vectors (Dict[str, list]): The vectors to store by their key.
+
+        Returns:
+            N/A
+        """
+        if not vectors:
+            return
+        now = time.time()
+        rows = [(key, array("f", vector).tobytes(), now) for key, vector in vectors.items()]
+        with self._lock:
+            connection = self._get_connection()
+            connection.execute("BEGIN")
+            for key, blob, last_used in rows:
+                previous = connection.execute("SELECT size FROM embeddings WHERE key = ?", (key,)).fetchone()
+                connection.execute("INSERT OR REPLACE INTO embeddings (key, vector, size, last_used, created_at) "
+                                   "VALUES (?, ?, ?, ?, ?)", (key, blob, len(blob), last_used, last_used))
+                self._size += len(blob) - (previous[0] if previous else 0)
+            connection.execute("COMMIT")
+            if self._size > self.max_size_bytes:
+                self._evict(connection)
+
+    def put(self, key, vector):
+        """
+        Stores the vector of a single key.
+
+        Args:
+            key (str): The cache key.
+            vector (list): The embedding vector.
+
+        Returns:
+            N/A
+        """
+        self.put_many({key: vector})
+
+    def _evict(self, connection):
+        # Must be called while holding the lock
+        target_size = int(self.max_size_bytes * 0.9)
+        evicted_keys = []
+        for key, size in connection.execute("SELECT key, size FROM embeddings ORDER BY last_used ASC"):
+            if self._size <= target_size:
+                break
+            evicted_keys.append((key,))
+            self._size -= size
+        connection.executemany("DELETE FROM embeddings WHERE key = ?", evicted_keys)
+        self.evictions += len(evicted_keys)
+        app_logger.info(f"Embedding cache evicted {len(evicted_keys)} least recently used vectors.")
+
+    def stats(self):
+        """
+        Returns the hit and miss counters and the size of the cache.
+
+        Args:
+            N/A
+
+        Returns:
+            Dict: The number of hits, misses and evictions, the hit ratio and the stored bytes.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "size_bytes": self._size
+            }
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class QueryEmbeddingCache:
+    """
+    An in-process LRU cache of the embedding vectors of search queries, keyed by the query with normalized whitespace
+    and case; entries expire ttl_seconds after they are embedded. An optional EmbeddingCache is a disk tier shared by
+    the processes of the service.
+
+    Args:
+        max_entries (int): The maximum number of vectors kept in memory.
+        max_size_bytes (int): The maximum total size of the vectors kept in memory, stored as float32.
+        ttl_seconds (float): How long a vector is kept in memory.
+        disk_cache (EmbeddingCache): Optional disk tier.
+    """
+
+    def __init__(self, max_entries, max_size_bytes, ttl_seconds, disk_cache=None):
+        self.max_entries = max_entries
+        self.max_size_bytes = max_size_bytes
+        self.ttl_seconds = ttl_seconds
+        self.disk_cache = disk_cache
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(deployment_config, text):
+        """
+        Builds the cache key of a query embedded by the given deployment.
+
+        Args:
+            deployment_config (Dict): The configuration of the embedding deployment, e.g. ADA_CONFIG.
+            text (str): The query.
+
+        Returns:
+            str: The hex SHA-256 digest of the deployment, the model and the normalized query, in a namespace of
+                 their own, so it never matches the key of an ingested text.
+        """
+        normalized_text = " ".join(text.casefold().split())
+        content = f"query\0{deployment_config['deployment_name']}\0{deployment_config['model']}\0{normalized_text}"
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _get_from_memory(self, keys):
+        vectors = {}
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                vector, expires_at = entry
+                if expires_at <= now:
+                    self._remove(key)
+                    self.expirations += 1
+                    continue
+                self._entries.move_to_end(key)
+                vectors[key] = vector.tolist()
+        return vectors
+
+    def _put_in_memory(self, vectors, expiry_times=None):
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for key, vector in vectors.items():
+                if key in self._entries:
+                    self._remove(key)
+                vector = array("f", vector)
+                self._entries[key] = (vector, expiry_times[key] if expiry_times is not None else expires_at)
+                self._size += len(vector) * vector.itemsize
+            while self._entries and (len(self._entries) > self.max_entries or self._size > self.max_size_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        # Must be called while holding the lock
+        vector, _ = self._entries.pop(key)
+        self._size -= len(vector) * vector.itemsize
+
+    def _put_disk_entries_in_memory(self, entries):
+        # The vectors keep their expiry in memory, the disk tier stores the wall clock time they were embedded
+        now = time.time()
+        monotonic_now = time.monotonic()
+        vectors = {}
+        expiry_times = {}
+        for key, (vector, created_at) in entries.items():
+            remaining_seconds = created_at + self.ttl_seconds - now
+            if remaining_seconds > 0:
+                vectors[key] = vector
+                expiry_times[key] = monotonic_now + remaining_seconds
+        self._put_in_memory(vectors, expiry_times)
+        with self._lock:
+            self.expirations += len(entries) - len(vectors)
+        return vectors
+
+    def _count(self, keys, memory_vectors, disk_vectors):
+        with self._lock:
+            self.hits += len(memory_vectors)
+            self.disk_hits += len(disk_vectors)
+            self.misses += len(keys) - len(memory_vectors) - len(disk_vectors)
+
+    def get_many(self, keys):
+        """
+        Looks up the vectors of the given keys in memory, then the missing ones in the disk tier.
+
+        Args:
+            keys (List[str]): The cache keys.
+
+        Returns:
+            Dict[str, list]: The found vectors by their key.
+        """
+        keys = list(set(keys))
+        vectors = self._get_from_memory(keys)
+        disk_vectors = {}
+        missing_keys = [key for key in keys if key not in vectors]
+        if self.disk_cache is not None and missing_keys:
+            disk_vectors = self._put_disk_entries_in_memory(self.disk_cache.get_entries(missing_keys))
+        self._count(keys, vectors, disk_vectors)
+        vectors.update(disk_vectors)
+        return vectors
+
+    async def get_many_async(self, keys):
+        """
+        Asynchronous version of get_many, the disk tier is read off the event loop.
+
+        Args:
+            keys (List[str]): The cache keys.
+
+        Returns:
+            Dict[str, list]: The found vectors by their key.
+        """
+        keys = list(set(keys))
+        vectors = self._get_from_memory(keys)
+        disk_vectors = {}
+        missing_keys = [key for key in keys if key not in vectors]
+        if self.disk_cache is not None and missing_keys:
+            disk_vectors = self._put_disk_entries_in_memory(
+                await asyncio.to_thread(self.disk_cache.get_entries, missing_keys))
+        self._count(keys, vectors, disk_vectors)
+        vectors.update(disk_vectors)
+        return vectors
+
+    def put_many(self, vectors):
+        """
+        Stores vectors by their key in memory and in the disk tier.
+
+        Args:
+            vectors (Dict[str, list]): The vectors to store by their key.
+
+        Returns:
+            N/A
+        """
+        if not vectors:
+            return
+        self._put_in_memory(vectors)
+        if self.disk_cache is not None:
+            self.disk_cache.put_many(vectors)
+
+    async def put_many_async(self, vectors):
+        """
+        Asynchronous version of put_many, the disk tier is written off the event loop.
+
+        Args:
+            vectors (Dict[str, list]): The vectors to store by their key.
+
+        Returns:
+            N/A
+        """
+        if not vectors:
+            return
+        self._put_in_memory(vectors)
+        if self.disk_cache is not None:
+            await asyncio.to_thread(self.disk_cache.put_many, vectors)
+
+    def stats(self):
+        """
+        Returns the hit and miss counters and the size of the cache.
+
+        Args:
+            N/A
+
+        Returns:
+            Dict: The number of memory hits, disk hits, misses, expirations and evictions, the hit ratio of both
+                  tiers, and the number and size of the vectors in memory.
+        """
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "expirations": self.expirations,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "size_bytes": self._size
+            }
+
+    def close(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        if self.disk_cache is not None:
+            self.disk_cache.close()
@@ -0,0 +1,328 @@
+import threading
+
+from azure.core.credentials import AzureKeyCredential
+from azure.search.documents import SearchIndexingBufferedSender
+
+from config import COGNITIVE_SEARCH_CONFIG, app_logger
+
+
+class IngestionSink:
+    """
+    Upserts and deletes the chunks of all documents of a run through upload_concurrency long-lived
+    SearchIndexingBufferedSender, so that they are sent in large batches. Once all chunks of a document are indexed or
+    failed, its on_complete callback is called with the number of failed chunks.
+
+    Args:
+        index_name (str): The name of the search index.
+        initial_batch_action_count (int): The number of queued chunks that triggers a flush.
+        auto_flush_interval (int): The maximum number of seconds a chunk waits in the queue.
+        upload_concurrency (int): The number of senders uploading in parallel.
+        max_retries_per_action (int): How many times a failed chunk is retried.
+        key_field (str): The key field of the index.
+    """
+
+    def __init__(self, index_name, initial_batch_action_count=256, auto_flush_interval=10, upload_concurrency=4,
+                 max_retries_per_action=3, key_field="id"):
+        self.index_name = index_name
+        self.max_retries_per_action = max_retries_per_action
+        self.key_field = key_field
+        self._lock = threading.Lock()
+        # The pending chunks by (document_id, key), and the documents with a pending chunk by its key
+        self._pending = {}
+        self._pending_documents = {}
+        self._documents = {}
+        self._next_sender = 0
+        self.queued = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.requeued = 0
+        self._senders = []
+        for _ in range(max(1, int(upload_concurrency))):
+            sender = SearchIndexingBufferedSender(
+                COGNITIVE_SEARCH_CONFIG["endpoint"],
+                index_name,
+                AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]),
+                auto_flush=True,
+                auto_flush_interval=auto_flush_interval,
+                initial_batch_action_count=initial_batch_action_count,
+                max_retries_per_action=max_retries_per_action,
+                on_new=self._on_new,
+                on_progress=self._on_progress,
+                on_error=self._on_error
+            )
+            self._senders.append((sender, threading.Lock()))
+        self._requeue_interval = auto_flush_interval
+        self._closed = threading.Event()
+        self._requeue_thread = threading.Thread(target=self._requeue_periodically, name=f"sink-{index_name}",
+                                                daemon=True)
+        self._requeue_thread.start()
+
+    def add(self, document_id, chunks, on_complete=None, deleted_keys=()):
+        """
+        Queues the chunks of a document for upload, and the removed chunks of the document for deletion.
+
+        Args:
+            document_id (str): The identifier of the document, e.g. its blob name.
+            chunks (List[Dict]): The chunks of the document.
+            on_complete (Callable): Optional callback called with the number of failed chunks once every chunk of
+                                    the document is indexed or failed.
+            deleted_keys (Iterable[str]): The keys of the chunks to delete from the index.
+
+        Returns:
+            N/A
+        """
+        deleted_chunks = [{self.key_field: key} for key in deleted_keys]
+        queued_chunks = {"upload": [], "delete": []}
+        with self._lock:
+            sender_index = self._next_sender
+            self._next_sender = (self._next_sender + 1) % len(self._senders)
+            for action, action_chunks in (("upload", chunks), ("delete", deleted_chunks)):
+                for chunk in action_chunks:
+                    key = chunk[self.key_field]
+                    if (document_id, key) in self._pending:
+                        # A chunk given twice is indexed once
+                        continue
+                    if self._find_document(chunk) is not None:
+                        # The same chunk object is queued for another document, the callbacks must tell them apart
+                        chunk = dict(chunk)
+                    self._pending[(document_id, key)] = {"chunk": chunk, "action": action,
+                                                         "sender_index": sender_index, "attempts": 1,
+                                                         "is_missing": False}
+                    self._pending_documents.setdefault(key, set()).add(document_id)
+                    queued_chunks[action].append(chunk)
+            self._documents[document_id] = {"remaining": len(queued_chunks["upload"]) + len(queued_chunks["delete"]),
+                                            "failed": 0, "on_complete": on_complete}
+        chunks, deleted_chunks = queued_chunks["upload"], queued_chunks["delete"]
+        if not chunks and not deleted_chunks:
+            self._complete(document_id)
+            return
+
+        sender, sender_lock = self._senders[sender_index]
+        with sender_lock:
+            self._send(sender, chunks, deleted_chunks)
+
+    @staticmethod
+    def _send(sender, chunks, deleted_chunks):
+        if chunks:
+            # The chunk ids are deterministic, so re-ingested chunks overwrite their existing rows
+            sender.merge_or_upload_documents(documents=chunks)
+        if deleted_chunks:
+            sender.delete_documents(documents=deleted_chunks)
+
+    def _on_new(self, action):
+        with self._lock:
+            self.queued += 1
+
+    def _on_progress(self, action):
+        self._resolve(action.additional_properties, succeeded=True)
+
+    def _on_error(self, action):
+        self._resolve(action.additional_properties, succeeded=False)
+
+    def _find_document(self, chunk):
+        # The document whose pending chunk is this very chunk object, must be called with the lock held
+        key = chunk.get(self.key_field)
+        for document_id in self._pending_documents.get(key, ()):
+            if self._pending[(document_id, key)]["chunk"] is chunk:
+                return document_id
+        return None
+
+    def _resolve(self, chunk, succeeded):
+        with self._lock:
+            document_id = self._find_document(chunk)
+            if document_id is None:
+                # A chunk that was queued again and indexed twice
+                return
+            key = chunk[self.key_field]
+            del self._pending[(document_id, key)]
+            self._pending_documents[key].discard(document_id)
+            if not self._pending_documents[key]:
+                del self._pending_documents[key]
+            document = self._documents[document_id]
+            document["remaining"] -= 1
+            if succeeded:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+                document["failed"] += 1
+                app_logger.error(f"Chunk {key} of {document_id} could not be indexed.")
+            is_complete = document["remaining"] == 0
+        if is_complete:
+            self._complete(document_id)
+
+    def _complete(self, document_id):
+        with self._lock:
+            document = self._documents.pop(document_id)
+        if document["on_complete"] is not None:
+            try:
+                document["on_complete"](document["failed"])
+            except Exception as e:
+                app_logger.error(f"Completion callback of {document_id} failed: {str(e)}")
+
+    def _requeue_lost_chunks(self, sender_index, is_flushed=True):
+        # Chunks of this sender that are neither resolved nor queued anymore were dropped by a failed batch request.
+        # Unless the sender was just flushed, a chunk may also be in a request in flight, so it is only lost once it
+        # is missing at two checks in a row; a chunk queued again while in flight is indexed twice, which is harmless
+        sender, _ = self._senders[sender_index]
+        queued_chunks = {}
+        for action in sender.actions:
+            queued_chunks.setdefault(action.additional_properties.get(self.key_field), []).append(
+                action.additional_properties)
+        lost_chunks = []
+        lost_deleted_chunks = []
+        failed_chunks = []
+        with self._lock:
+            for (_, key), pending in self._pending.items():
+                if pending["sender_index"] != sender_index:
+                    continue
+                if any(chunk is pending["chunk"] for chunk in queued_chunks.get(key, ())):
+                    pending["is_missing"] = False
+                    continue
+                if not is_flushed and not pending["is_missing"]:
+                    pending["is_missing"] = True
+                    continue
+                pending["is_missing"] = False
+                if pending["attempts"] > self.max_retries_per_action:
+                    failed_chunks.append(pending["chunk"])
+                else:
+                    pending["attempts"] += 1
+                    if pending["action"] == "delete":
+                        lost_deleted_chunks.append(pending["chunk"])
+                    else:
+                        lost_chunks.append(pending["chunk"])
+            lost_count = len(lost_chunks) + len(lost_deleted_chunks)
+            self.requeued += lost_count
+        for chunk in failed_chunks:
+            self._resolve(chunk, succeeded=False)
+        if lost_count:
+            app_logger.info(f"{lost_count} chunks are queued again.")
+            self._send(sender, lost_chunks, lost_deleted_chunks)
+        return lost_count
+
+    def _requeue_periodically(self):
+        # The chunks dropped by the batches the senders flush on their own are queued again while the run goes on
+        while not self._closed.wait(self._requeue_interval):
+            for sender_index, (_, sender_lock) in enumerate(self._senders):
+                try:
+                    with sender_lock:
+                        self._requeue_lost_chunks(sender_index, is_flushed=False)
+                except Exception as e:
+                    app_logger.error(f"Lost chunks of {self.index_name} could not be queued again: {str(e)}")
+
+    def flush(self):
+        """
+        Uploads every queued chunk, queuing lost chunks again until all chunks are indexed or failed.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+        """
+        for sender_index, (sender, sender_lock) in enumerate(self._senders):
+            with sender_lock:
+                while True:
+                    sender.flush()
+                    if self._requeue_lost_chunks(sender_index) == 0:
+                        break
+
+    def close(self):
+        """
+        Flushes the queued chunks and closes the senders.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+        """
+        self._closed.set()
+        self._requeue_thread.join()
+        self.flush()
+        for sender, sender_lock in self._senders:
+            with sender_lock:
+                sender.close()
+
+    def stats(self):
+        """
+        Returns the upload counters of the sink.
+
+        Args:
+            N/A
+
+        Returns:
+            Dict: The number of queued, succeeded, failed and requeued chunks and of unfinished documents.
+        """
+        with self._lock:
+            return {"queued": self.queued, "succeeded": self.succeeded, "failed": self.failed,
+                    "requeued": self.requeued, "pending_documents": len(self._documents)}
+
+
+class DocumentProgress:
+    """
+    Tracks a document uploaded in several parts, e.g. the windows of a large document, and calls on_complete with the
+    number of failed chunks once every part is uploaded. Parts may complete before the part count is set; a failed
+    document never completes.
+
+    Args:
+        on_complete (Callable): The callback called with the number of failed chunks.
+    """
+
+    def __init__(self, on_complete):
+        self.on_complete = on_complete
+        self._lock = threading.Lock()
+        self._part_count = None
+        self._completed_parts = 0
+        self._failed_count = 0
+        self._is_failed = False
+        self._is_finished = False
+
+    def set_part_count(self, part_count):
+        """
+        Sets the number of parts of the document, once all of them are produced.
+
+        Args:
+            part_count (int): The number of parts.
+
+        Returns:
+            N/A
+        """
+        with self._lock:
+            self._part_count = part_count
+        self._complete_if_finished()
+
+    def complete_part(self, failed_count=0):
+        """
+        Records an uploaded part of the document.
+
+        Args:
+            failed_count (int): The number of chunks of the part that could not be indexed.
+
+        Returns:
+            N/A
+        """
+        with self._lock:
+            self._completed_parts += 1
+            self._failed_count += failed_count
+        self._complete_if_finished()
+
+    def fail(self):
+        """
+        Marks the document as failed, e.g. when one of its parts could not be processed.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+        """
+        with self._lock:
+            self._is_failed = True
+
+    def _complete_if_finished(self):
+        with self._lock:
+            if self._is_finished or self._is_failed or self._part_count is None \
+                    or self._completed_parts < self._part_count:
+                return
+            self._is_finished = True
+        self.on_complete(self._failed_count)
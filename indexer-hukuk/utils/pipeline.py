@@ -0,0 +1,153 @@
+import queue
+import threading
+import types
+
+from config import app_logger
+
+_STOP = object()
+
+
+class Stage:
+    """
+    A single step of the ingestion pipeline, executed by its own pool of worker threads.
+
+    Args:
+        name (str): The name of the stage, used in logs and statistics.
+        func (Callable): The function applied to every item received from the previous stage.
+                         Returning None drops the item, any other value is passed to the next stage. A generator
+                         function splits the item, e.g. a large document into windows, and every yielded item is
+                         passed to the next stage as soon as it is produced.
+        workers (int): The number of worker threads running this stage.
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.cancelled = 0
+        self._lock = threading.Lock()
+        self._running_workers = 0
+
+    def count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def stats(self):
+        return {"workers": self.workers, "processed": self.processed, "dropped": self.dropped, "failed": self.failed,
+                "cancelled": self.cancelled}
+
+
+class Pipeline:
+    """
+    Runs a list of stages concurrently, joined by bounded queues, so that the throughput is that of the slowest stage. A
+    cancelled pipeline stops reading the source and drops the waiting items.
+
+    Args:
+        stages (List[Stage]): The stages in processing order.
+        queue_size (int): The maximum number of items waiting in front of each stage.
+        on_error (Callable): Optional callback called with (stage_name, item, exception) when a stage fails.
+        cancel_event (threading.Event): Optional event cancelling the pipeline once set.
+    """
+
+    def __init__(self, stages, queue_size=8, on_error=None, cancel_event=None):
+        self.stages = stages
+        self.queue_size = max(1, int(queue_size))
+        self.on_error = on_error
+        self.listed = 0
+        self.listing_finished = False
+        self._cancel_event = cancel_event or threading.Event()
+
+    def cancel(self):
+        """
+        Cancels the pipeline, see the class description.
+        """
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def _worker(self, stage, in_queue, out_queue):
+        while True:
+            item = in_queue.get()
+            if item is _STOP:
+                # Let the sibling workers see the stop marker as well, the last one forwards it downstream
+                in_queue.put(_STOP)
+                with stage._lock:
+                    stage._running_workers -= 1
+                    is_last_worker = stage._running_workers == 0
+                if is_last_worker and out_queue is not None:
+                    out_queue.put(_STOP)
+                return
+
+            if self.cancelled:
+                stage.count("cancelled")
+                continue
+
+            forwarded = 0
+            try:
+                result = stage.func(item)
+                # The queue of the next stage is bounded, so a generator is only resumed once there is room
+                for output in (result if isinstance(result, types.GeneratorType) else [result]):
+                    if self.cancelled:
+                        break
+                    if output is None:
+                        continue
+                    forwarded += 1
+                    if out_queue is not None:
+                        out_queue.put(output)
+            except Exception as e:
+                stage.count("failed")
+                app_logger.error(f"Pipeline stage '{stage.name}' failed: {str(e)}")
+                if self.on_error is not None:
+                    try:
+                        self.on_error(stage.name, item, e)
+                    except Exception as callback_error:
+                        app_logger.error(f"Pipeline error callback failed: {str(callback_error)}")
+                continue
+
+            stage.count("processed" if forwarded else "dropped")
+
+    def run(self, source):
+        """
+        Feeds every item of the source into the first stage and blocks until all stages are drained.
+
+        Args:
+            source (Iterable): The items to process, e.g. the listed blobs.
+
+        Returns:
+            stats (Dict): Per stage counts of processed, dropped and failed items.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        threads = []
+        for position, stage in enumerate(self.stages):
+            out_queue = queues[position + 1] if position + 1 < len(self.stages) else None
+            stage._running_workers = stage.workers
+            for worker_index in range(stage.workers):
+                thread = threading.Thread(target=self._worker, args=(stage, queues[position], out_queue),
+                                          name=f"{stage.name}-{worker_index}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        try:
+            for item in source:
+                if self.cancelled:
+                    break
+                self.listed += 1
+                queues[0].put(item)
+            self.listing_finished = not self.cancelled
+        finally:
+            queues[0].put(_STOP)
+            for thread in threads:
+                thread.join()
+
+        return self.stats()
+
+    def stats(self):
+        stats = {"listed": self.listed}
+        for stage in self.stages:
+            stats[stage.name] = stage.stats()
+        return stats
@@ -1,15 +1,39 @@
 import pdfplumber
+import asyncio
+import bisect
+import collections
+import hashlib
 import io
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import itertools
+import math
+import multiprocessing
+import os
+import posixpath
+import re
+import importlib.util
+import threading
+import zlib
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from multiprocessing import shared_memory
 from uuid import uuid4
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI
 import openai
+import httpx
 from datetime import datetime
 from config import app_logger
-from typing import List, Optional, Sequence
-import uuid
+from typing import List, NamedTuple, Sequence
 from langchain.load import dumps, loads
-from config import ADA_CONFIG, GPT_CONFIG
+from config import ADA_CONFIG, GPT_CONFIG, EMBEDDING_BATCH_SIZE, PDF_PARSE_CONFIG, OPENAI_CLIENT_CONFIG, \
+    CONCURRENCY_LIMIT, RATE_LIMIT_CONFIG, EMBEDDING_CACHE_CONFIG, CHUNKING_CONFIG, QUERY_EMBEDDING_CACHE_CONFIG
+from utils.rate_limiter import RateLimiter
+from utils.embedding_cache import EmbeddingCache, QueryEmbeddingCache
+
+_pdf_process_pool = None
+_pdf_process_pool_lock = threading.Lock()
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
 
 
 def parse_pdf(file):
@@ -29,8 +53,9 @@ def parse_pdf(file):
         page_contents = []
         full_content = ""
         for page in pdf.pages:
-            page_contents.append(page.extract_text())
-            full_content += page.extract_text()
+            page_content = page.extract_text()
+            page_contents.append(page_content)
+            full_content += page_content
         pdf_dict["full_content"] = full_content
         pdf_dict["page_contents"] = page_contents
     app_logger.info("PDF parsed successfully!")
@@ -40,125 +65,551 @@ def parse_pdf(file):
 def parse_pdf_with_path(pdf_file_path):
     """
     Parses a PDF file located at the given file path and extracts the texts in the file together
-    with metadata like title and page count. If the PDF file has more than 200 pages, it is skipped.
+    with metadata like title and page count. The pages are parsed in the PDF parsing process pool.
 
     Args:
         pdf_file_path (str): The file path of the PDF file to parse.
 
     Returns:
-        pdf_dict (Dict or None): A dictionary containing the extracted metadata and content from the PDF file,
-                                 or None if the file is skipped.
+        pdf_dict (Dict): A dictionary containing the extracted metadata and content from the PDF file.
     """
     pdf_dict = {}
-    with pdfplumber.open(pdf_file_path) as pdf:
-        page_count = len(pdf.pages)
+    with open_pdf(pdf_file_path) as pdf:
+        pdf_dict["title"] = pdf.metadata.get("Title", "Title Not Found")
+        pdf_dict["page_count"] = len(pdf.pages)
+    page_contents = list(iter_pdf_pages(pdf_file_path, pdf_file_path))
+    pdf_dict["full_content"] = "".join(page_contents)
+    pdf_dict["page_contents"] = page_contents
+    return pdf_dict
+
+
+def get_available_cpu_count():
+    """
+    Returns the number of CPUs this process may use, honouring both its CPU affinity and the CPU quota
+    of the container (cgroup v2 or v1).
+
+    Args:
+        N/A
+
+    Returns:
+        int: The number of usable CPUs, at least 1.
+    """
+    try:
+        cpu_count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpu_count = os.cpu_count() or 1
+
+    cpu_quota = None
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpu_quota = int(quota) / int(period)
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = int(f.read())
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = int(f.read())
+            if quota > 0:
+                cpu_quota = quota / period
+        except (OSError, ValueError):
+            pass
+
+    if cpu_quota is not None:
+        cpu_count = min(cpu_count, max(1, math.floor(cpu_quota)))
+    return max(1, cpu_count)
+
+
+def get_pdf_process_pool():
+    """
+    Returns the process pool shared by all PDF parsing calls, creating it on first use. The worker count is
+    PDF_PARSE_CONFIG["workers"], or the number of CPUs available to the container if it is 0.
+
+    Args:
+        N/A
+
+    Returns:
+        ProcessPoolExecutor or None: The process pool, or None if PDFs should be parsed in the calling process.
+    """
+    global _pdf_process_pool
+    workers = PDF_PARSE_CONFIG["workers"] or get_available_cpu_count()
+    if workers <= 1:
+        return None
+
+    with _pdf_process_pool_lock:
+        if _pdf_process_pool is None:
+            # Worker processes are spawned instead of forked, as the ingestion pipeline runs many threads
+            _pdf_process_pool = ProcessPoolExecutor(max_workers=workers,
+                                                    mp_context=multiprocessing.get_context("spawn"))
+            app_logger.info(f"PDF parsing process pool is started with {workers} workers.")
+        return _pdf_process_pool
+
+
+def shutdown_pdf_process_pool():
+    """
+    Shuts down the PDF parsing process pool if it has been started.
+
+    Args:
+        N/A
+
+    Returns:
+        N/A
+    """
+    global _pdf_process_pool
+    with _pdf_process_pool_lock:
+        if _pdf_process_pool is not None:
+            _pdf_process_pool.shutdown(cancel_futures=True)
+            _pdf_process_pool = None
+
 
-        # Eğer sayfa sayısı 200'den fazla ise işlemi geç
-        if page_count > 450:
-            app_logger.info(f"PDF skipped because it has {page_count} pages (limit is 200).")
+class SharedPdfFile(NamedTuple):
+    """
+    The content of a PDF file in a shared memory block, which the parsing workers read instead of a pickled copy.
+    """
+    name: str
+    size: int
+
+    def read(self):
+        shared_content = shared_memory.SharedMemory(name=self.name)
+        try:
+            return bytes(shared_content.buf[:self.size])
+        finally:
+            shared_content.close()
+
+
+def share_pdf_content(pdf_content):
+    """
+    Copies the content of a PDF file into a new shared memory block. The caller closes and unlinks the block.
+
+    Args:
+        pdf_content (bytes): The content of the PDF file.
+
+    Returns:
+        SharedMemory: The shared memory block, or None if /dev/shm has not enough free space for the content.
+    """
+    try:
+        # Writing beyond the free space of /dev/shm would crash the process instead of raising an error
+        stats = os.statvfs("/dev/shm")
+        if len(pdf_content) == 0 or len(pdf_content) > stats.f_bavail * stats.f_frsize:
             return None
+        shared_content = shared_memory.SharedMemory(create=True, size=len(pdf_content))
+    except OSError:
+        return None
+    shared_content.buf[:len(pdf_content)] = pdf_content
+    return shared_content
 
-        pdf_dict["title"] = pdf.metadata.get("Title", "Title Not Found")
-        pdf_dict["page_count"] = page_count
-        page_contents = []
-        full_content = ""
-        for page in pdf.pages:
-            page_contents.append(page.extract_text())
-            full_content += page.extract_text()
-        pdf_dict["full_content"] = full_content
-        pdf_dict["page_contents"] = page_contents
 
-    app_logger.info("PDF parsed successfully!")
-    return pdf_dict
+def open_pdf(pdf_file, pages=None):
+    """
+    Opens a PDF file given either by its file path or by its content.
 
+    Args:
+        pdf_file (str or bytes): The file path or the content of the PDF file.
+        pages (Iterable[int]): The 1-based numbers of the pages to load, all pages if None.
 
-def split_pdf_to_chunks(pdf_dict):
+    Returns:
+        PDF: The opened pdfplumber document.
     """
-    Split a PDF into chunks of text and create a list of dictionaries with chunk information.
+    if isinstance(pdf_file, (bytes, bytearray)):
+        pdf_file = io.BytesIO(pdf_file)
+    return pdfplumber.open(pdf_file, pages=pages)
+
+
+def parse_pdf_pages(pdf_file, start_page, end_page):
+    """
+    Extracts the texts of a range of pages of a PDF file. This is the unit of work of the PDF parsing processes.
 
     Args:
-        pdf_dict (Dict): A dictionary containing the PDF content and metadata.
+        pdf_file (str, bytes or SharedPdfFile): The file path or the content of the PDF file.
+        start_page (int): The 0-based index of the first page to parse.
+        end_page (int): The 0-based index of the page after the last page to parse.
 
     Returns:
-        chunks (List): A list of dictionaries, each containing chunk information.
-    """
-    ids: Optional[List[str]] = None
-    add_to_docstore: bool = True
-    parent_splitter = RecursiveCharacterTextSplitter(chunk_size=10000)
-    child_splitter = RecursiveCharacterTextSplitter(chunk_size=2000)
-
-    if parent_splitter is not None:
-        pdf_content = parent_splitter.split_text(pdf_dict["full_content"])
-    if ids is None:
-        doc_ids = [str(uuid.uuid4()) for _ in pdf_content]
-        if not add_to_docstore:
-            raise ValueError(
-                "If ids are not passed in, `add_to_docstore` MUST be True"
-            )
+        page_contents (List[str]): The texts of the pages in the range.
+    """
+    if isinstance(pdf_file, SharedPdfFile):
+        pdf_file = pdf_file.read()
+    with open_pdf(pdf_file, pages=range(start_page + 1, end_page + 1)) as pdf:
+        return [page.extract_text() for page in pdf.pages]
+
+
+def _run_in_process(func, *args):
+    """
+    Runs the function in the calling process and wraps its outcome into a completed future.
+    """
+    future = Future()
+    try:
+        future.set_result(func(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def iter_pdf_pages(pdf_name, pdf_file):
+    """
+    Parses a PDF file in ranges of PDF_PARSE_CONFIG["pages_per_task"] pages in the PDF parsing process pool and yields
+    the texts of its pages in order, one range per worker ahead of the consumer. The workers read the content from
+    shared memory.
+
+    Args:
+        pdf_name (str): The name of the PDF file, used in logs.
+        pdf_file (str or bytes): The file path or the content of the PDF file.
+
+    Yields:
+        page_content (str): The text of the next page.
+
+    Raises:
+        RuntimeError: If the file or one of its ranges could not be parsed, so that a partly parsed file is never
+                      taken for the whole file.
+    """
+    process_pool = get_pdf_process_pool()
+    shared_content = None
+    task_file = pdf_file
+    if process_pool is not None and isinstance(pdf_file, (bytes, bytearray)):
+        # The content is sent with every range if it does not fit into shared memory
+        shared_content = share_pdf_content(pdf_file)
+        if shared_content is not None:
+            task_file = SharedPdfFile(shared_content.name, len(pdf_file))
+    try:
+        yield from _iter_pdf_page_ranges(pdf_name, pdf_file, task_file, process_pool)
+    finally:
+        if shared_content is not None:
+            shared_content.close()
+            shared_content.unlink()
+
+
+def _iter_pdf_page_ranges(pdf_name, pdf_file, task_file, process_pool):
+    """
+    Yields the texts of the pages of a PDF file, parsed range by range in the process pool, or in the calling
+    process if the pool is None. The tasks get task_file, the file itself or its shared content.
+    """
+    try:
+        with open_pdf(pdf_file) as pdf:
+            page_count = len(pdf.pages)
+    except Exception as e:
+        app_logger.error(f"Error parsing PDF file {pdf_name}: {str(e)}")
+        raise RuntimeError(f"PDF file {pdf_name} could not be parsed: {str(e)}") from e
+
+    if process_pool is not None:
+        submit = partial(process_pool.submit, parse_pdf_pages)
+        ranges_ahead = PDF_PARSE_CONFIG["workers"] or get_available_cpu_count()
     else:
-        if len(pdf_content) != len(ids):
-            raise ValueError(
-                "Got uneven list of documents and ids. "
-                "If `ids` is provided, should be same length as `documents`."
-            )
-        doc_ids = ids
+        submit = partial(_run_in_process, parse_pdf_pages)
+        ranges_ahead = 1
+    pages_per_task = max(1, PDF_PARSE_CONFIG["pages_per_task"])
 
-    parent_child_chunks = {}
-    for doc, _id in zip(pdf_content, doc_ids, strict=True):
-        sub_docs = child_splitter.split_text((doc))
-        parent_child_chunks[_id] = []
+    futures = collections.deque()
+    try:
+        for start_page in range(0, page_count, pages_per_task):
+            futures.append(submit(task_file, start_page, min(start_page + pages_per_task, page_count)))
+            if len(futures) >= ranges_ahead:
+                yield from futures.popleft().result()
+        while futures:
+            yield from futures.popleft().result()
+    except Exception as e:
+        app_logger.error(f"Error parsing PDF file {pdf_name}: {str(e)}")
+        if isinstance(e, BrokenProcessPool):
+            # A crashed worker breaks the whole pool, the next call starts a new one
+            shutdown_pdf_process_pool()
+        raise RuntimeError(f"PDF file {pdf_name} could not be parsed: {str(e)}") from e
+    finally:
+        for future in futures:
+            future.cancel()
+    app_logger.info(f"PDF parsed successfully! ({page_count} pages)")
 
-        for sub_doc in sub_docs:
-            chunk_info = {"id": str(uuid4()), 'parent_id': _id, 'parent_chunk': doc,
-                          'chunk': sub_doc}  # Create dictionary with chunk information
-            parent_child_chunks[_id].append(chunk_info)
 
-    app_logger.info(f"PDF splitted to {len(parent_child_chunks.keys())} parent chunks successfully!")
-    return parent_child_chunks
+def content_hash(text):
+    """
+    Computes the hash of a text, used to recognize unchanged chunks.
 
+    Args:
+        text (str): The text to hash.
 
-def split_text_to_chunks(text):
+    Returns:
+        str: The hex SHA-256 digest of the text.
     """
-    Split a text into chunks and create a list of dictionaries with chunk information.
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_chunk_id(*parts):
+    """
+    Builds a deterministic document key from the given parts, so that the same chunk of the same document always
+    gets the same id and re-ingesting it overwrites the existing row instead of adding a duplicate.
 
     Args:
-        text (str): The text to be split into chunks.
+        parts: The parts identifying the chunk, e.g. the source key and its content hash.
 
     Returns:
-        chunks (List): A list of dictionaries, each containing chunk information.
+        str: The hex SHA-256 digest of the parts, which is a valid search index key.
     """
+    return hashlib.sha256("\0".join(str(part) for part in parts).encode("utf-8")).hexdigest()
 
-    ids: Optional[List[str]] = None
-    add_to_docstore: bool = True
-    parent_splitter = RecursiveCharacterTextSplitter(chunk_size=10000)
-    child_splitter = RecursiveCharacterTextSplitter(chunk_size=2000)
 
-    if parent_splitter is not None:
-        text = parent_splitter.split_text(text)
-    if ids is None:
-        doc_ids = [str(uuid.uuid4()) for _ in text]
-        if not add_to_docstore:
-            raise ValueError(
-                "If ids are not passed in, `add_to_docstore` MUST be True"
-            )
+class TextChunk(NamedTuple):
+    """
+    A chunk of a text, with its character offsets in the text and its size in tokens.
+    """
+    text: str
+    start: int
+    end: int
+    token_count: int
+
+
+class TokenChunker:
+    """
+    Splits texts into chunks of at most chunk_size tokens of the embedding model, cut at paragraphs, then lines,
+    sentences and words, every chunk starting with up to chunk_overlap tokens of the previous one. With boundary_tokens,
+    chunks also end after content-defined pieces, about every boundary_tokens tokens, so an edit only changes the chunks
+    up to the next such piece.
+
+    Args:
+        chunk_size (int): The maximum number of tokens per chunk.
+        chunk_overlap (int): The maximum number of tokens repeated at the start of the next chunk.
+        tokenizer (tiktoken.Encoding): The tokenizer, the one of get_tokenizer if not given.
+        boundary_tokens (int): The mean number of tokens between content-defined cuts, 0 to cut by size only.
+    """
+
+    # From the most to the least preferred boundary: paragraphs, lines, sentences and words
+    SEPARATOR_PATTERNS = [
+        re.compile(r"\n[ \t]*\n\s*"),
+        re.compile(r"\n\s*"),
+        re.compile(r"(?<=[.!?;:])[ \t]+"),
+        re.compile(r"[ \t]+"),
+    ]
+
+    def __init__(self, chunk_size, chunk_overlap=0, tokenizer=None, boundary_tokens=0):
+        self.chunk_size = max(1, int(chunk_size))
+        self.chunk_overlap = max(0, min(int(chunk_overlap), self.chunk_size // 2))
+        self.tokenizer = tokenizer
+        self.boundary_tokens = max(0, int(boundary_tokens))
+
+    def split(self, text):
+        """
+        Splits a text into chunks.
+
+        Args:
+            text (str): The text to split.
+
+        Returns:
+            chunks (List[TextChunk]): The non-empty chunks in the order of the text.
+        """
+        return list(self._iter_chunks([text]))
+
+    def split_stream(self, texts):
+        """
+        Splits a text given as consecutive parts, e.g. the pages of a PDF file, without joining it. The chunks are the
+        same as those of split on the joined text.
+
+        Args:
+            texts (Iterable[str]): The consecutive parts of the text.
+
+        Yields:
+            chunk_text (str): The non-empty chunks in the order of the text.
+        """
+        for chunk in self._iter_chunks(texts):
+            yield chunk.text
+
+    def _iter_chunks(self, texts):
+        # Yields the chunks of the joined texts, with their offsets in the joined text
+        tokenizer = self.tokenizer or get_tokenizer()
+        paragraph_pattern = self.SEPARATOR_PATTERNS[0]
+        # The joined text from offset base on, which starts at the first queued piece
+        buffer = ""
+        base = 0
+        # The offset in the buffer up to which the paragraphs are cut into pieces
+        scanned = 0
+        pieces = collections.deque()
+        chunk_tokens = 0
+        # False while the queued pieces are only the overlap of the last chunk
+        has_new_pieces = False
+        for text in itertools.chain(texts, [None]):
+            if text is not None:
+                buffer += text
+                # A paragraph is complete once its separator is followed by text, the separator may still grow
+                paragraph_ends = [match.end() for match in paragraph_pattern.finditer(buffer, scanned)
+                                  if match.end() < len(buffer)]
+            else:
+                paragraph_ends = [match.end() for match in paragraph_pattern.finditer(buffer, scanned)]
+                paragraph_ends.append(len(buffer))
+
+            for paragraph_end in paragraph_ends:
+                if paragraph_end <= scanned:
+                    continue
+                for start, end, piece_tokens in self._iter_pieces_of_paragraph(tokenizer, buffer, scanned,
+                                                                               paragraph_end):
+                    if pieces and chunk_tokens + piece_tokens > self.chunk_size:
+                        if has_new_pieces:
+                            chunk = self._make_chunk(buffer, base, pieces, chunk_tokens)
+                            if chunk is not None:
+                                yield chunk
+                        # The next chunk starts with the trailing pieces that fit into the overlap
+                        while pieces and (chunk_tokens > self.chunk_overlap
+                                          or chunk_tokens + piece_tokens > self.chunk_size):
+                            chunk_tokens -= pieces.popleft()[2]
+                    pieces.append((base + start, base + end, piece_tokens))
+                    chunk_tokens += piece_tokens
+                    has_new_pieces = True
+                    if self._is_boundary(buffer[start:end], piece_tokens):
+                        chunk = self._make_chunk(buffer, base, pieces, chunk_tokens)
+                        if chunk is not None:
+                            yield chunk
+                        while pieces and chunk_tokens > self.chunk_overlap:
+                            chunk_tokens -= pieces.popleft()[2]
+                        has_new_pieces = False
+                scanned = paragraph_end
+
+            kept = pieces[0][0] - base if pieces else scanned
+            buffer = buffer[kept:]
+            base += kept
+            scanned -= kept
+
+        if has_new_pieces:
+            chunk = self._make_chunk(buffer, base, pieces, chunk_tokens)
+            if chunk is not None:
+                yield chunk
+
+    def _is_boundary(self, piece_text, piece_tokens):
+        # A content-defined cut after the piece, whose probability grows with its size
+        piece_text = piece_text.strip()
+        if not self.boundary_tokens or not piece_text:
+            return False
+        return zlib.crc32(piece_text.encode("utf-8")) * self.boundary_tokens < piece_tokens * 2 ** 32
+
+    def _iter_pieces_of_paragraph(self, tokenizer, text, start, end):
+        # Yields the (start, end, token count) of the pieces of a paragraph, measured with its own tokens
+        paragraph = text[start:end]
+        tokens = tokenizer.encode_ordinary(paragraph)
+        if len(tokens) <= self.chunk_size:
+            yield start, end, len(tokens)
+            return
+
+        if paragraph.isascii():
+            # Every byte is a character, so the offsets are the running sum of the token lengths
+            token_positions = list(itertools.accumulate(
+                (len(token_bytes) for token_bytes in tokenizer.decode_tokens_bytes(tokens[:-1])), initial=0
+            ))
+        else:
+            _, token_positions = tokenizer.decode_with_offsets(tokens)
+
+        def tokens_before(position):
+            return bisect.bisect_left(token_positions, position - start)
+
+        def position_of_token(token_index):
+            return start + token_positions[token_index] if token_index < len(token_positions) else end
+
+        for piece_start, piece_end in self._iter_pieces(text, start, end, 1, tokens_before, position_of_token):
+            yield piece_start, piece_end, tokens_before(piece_end) - tokens_before(piece_start)
+
+    def _iter_pieces(self, text, start, end, level, tokens_before, position_of_token):
+        # Yields the (start, end) offsets of consecutive pieces of at most chunk_size tokens
+        if level == len(self.SEPARATOR_PATTERNS):
+            while start < end:
+                cut = min(max(position_of_token(tokens_before(start) + self.chunk_size), start + 1), end)
+                yield start, cut
+                start = cut
+            return
+
+        piece_start = start
+        for match in itertools.chain(self.SEPARATOR_PATTERNS[level].finditer(text, start, end), [None]):
+            piece_end = match.end() if match is not None else end
+            if piece_end <= piece_start:
+                continue
+            if tokens_before(piece_end) - tokens_before(piece_start) <= self.chunk_size:
+                yield piece_start, piece_end
+            else:
+                yield from self._iter_pieces(text, piece_start, piece_end, level + 1, tokens_before,
+                                             position_of_token)
+            piece_start = piece_end
+
+    @staticmethod
+    def _make_chunk(text, base, pieces, token_count):
+        # The chunk of the queued pieces, None if it is blank; text starts at offset base of the joined text
+        start, end = pieces[0][0], pieces[-1][1]
+        chunk_text = text[start - base:end - base].strip()
+        return TextChunk(chunk_text, start, end, token_count) if chunk_text else None
+
+
+parent_chunker = TokenChunker(CHUNKING_CONFIG["parent_chunk_tokens"], CHUNKING_CONFIG["chunk_overlap_tokens"],
+                               boundary_tokens=CHUNKING_CONFIG["parent_boundary_tokens"])
+child_chunker = TokenChunker(CHUNKING_CONFIG["child_chunk_tokens"], CHUNKING_CONFIG["chunk_overlap_tokens"])
+
+
+def split_parent_chunk(parent_text, source_key=None, occurrence=0):
+    """
+    Splits a parent chunk into its child chunks. The ids are derived from the content, not from the position of
+    the parent chunk, so a parent chunk that only moved in a new version of the document keeps its id.
+
+    Args:
+        parent_text (str): The text of the parent chunk.
+        source_key (str): Identifies the document and the source of the content. If given, the ids are derived
+                          from it and the content hash of the chunks, otherwise they are random.
+        occurrence (int): The number of earlier parent chunks of the source with the same text.
+
+    Returns:
+        parent_id (str): The id of the parent chunk.
+        chunks (List[Dict]): The child chunks of the parent chunk.
+    """
+    if source_key is not None:
+        parent_id = make_chunk_id(source_key, content_hash(parent_text), occurrence)
     else:
-        if len(text) != len(ids):
-            raise ValueError(
-                "Got uneven list of documents and ids. "
-                "If `ids` is provided, should be same length as `documents`."
-            )
-        doc_ids = ids
+        parent_id = str(uuid4())
 
-    parent_child_chunks = {}
-    for doc, _id in zip(text, doc_ids, strict=True):
-        sub_docs = child_splitter.split_text((doc))
-        parent_child_chunks[_id] = []
+    chunks = []
+    for child_index, child_chunk in enumerate(child_chunker.split(parent_text)):
+        chunk_hash = content_hash(child_chunk.text)
+        chunk_id = make_chunk_id(parent_id, child_index, chunk_hash) if source_key is not None else str(uuid4())
+        chunks.append({"id": chunk_id, 'parent_id': parent_id, 'parent_chunk': parent_text,
+                       'chunk': child_chunk.text, 'content_hash': chunk_hash})
+    return parent_id, chunks
 
-        for sub_doc in sub_docs:
-            chunk_info = {"id": str(uuid4()), 'parent_id': _id, 'parent_chunk': doc,
-                          'chunk': sub_doc}  # Create dictionary with chunk information
-            parent_child_chunks[_id].append(chunk_info)
 
+def iter_parent_child_chunks(texts, source_key=None):
+    """
+    Splits a text given as consecutive parts into parent chunks, and these into their child chunks.
+
+    Args:
+        texts (Iterable[str]): The consecutive parts of the text, e.g. the pages of a PDF file.
+        source_key (str): Identifies the document and the source of the content, see split_parent_chunk.
+
+    Yields:
+        tuple: The id of the next parent chunk and its child chunks.
+    """
+    # Repeated parent texts of a source, e.g. boilerplate pages, are told apart by their occurrence
+    occurrences = collections.Counter()
+    for parent_text in parent_chunker.split_stream(texts):
+        yield split_parent_chunk(parent_text, source_key, occurrences[parent_text])
+        occurrences[parent_text] += 1
+
+
+def split_pdf_to_chunks(pdf_dict, source_key=None):
+    """
+    Split a PDF into chunks of text and create a list of dictionaries with chunk information.
+
+    Args:
+        pdf_dict (Dict): A dictionary containing the PDF content and metadata.
+        source_key (str): Identifies the document and the source of the content, see split_parent_chunk.
+
+    Returns:
+        parent_child_chunks (Dict[str, List[Dict]]): The child chunks of every parent chunk by its id.
+    """
+    parent_child_chunks = dict(iter_parent_child_chunks([pdf_dict["full_content"]], source_key))
+    app_logger.info(f"PDF splitted to {len(parent_child_chunks.keys())} parent chunks successfully!")
+    return parent_child_chunks
+
+
+def split_text_to_chunks(text, source_key=None):
+    """
+    Split a text into chunks and create a list of dictionaries with chunk information.
+
+    Args:
+        text (str): The text to be split into chunks.
+        source_key (str): Identifies the document and the source of the content, see split_parent_chunk.
+
+    Returns:
+        parent_child_chunks (Dict[str, List[Dict]]): The child chunks of every parent chunk by its id.
+    """
+    parent_child_chunks = dict(iter_parent_child_chunks([text], source_key))
     app_logger.info(f".TXT splitted to {len(parent_child_chunks.keys())} parent chunks successfully!")
     return parent_child_chunks
 
@@ -176,10 +627,9 @@ def process_pdf_file(pdf_file):
                            with an added 'chunk_vector' key storing the embedding.
     """
     pdf_dict = parse_pdf(pdf_file)
-    pdf_chunks = split_pdf_to_chunks(pdf_dict)
-    for chunk in pdf_chunks:
-        chunk["chunk_vector"] = get_embedding(chunk["chunk"])
-    return pdf_chunks
+    parent_child_chunks = split_pdf_to_chunks(pdf_dict)
+    pdf_chunks = [chunk for chunks in parent_child_chunks.values() for chunk in chunks]
+    return embed_chunks(pdf_chunks)
 
 
 def process_pdf_file_with_path(pdf_file_path):
@@ -194,10 +644,9 @@ def process_pdf_file_with_path(pdf_file_path):
         pdf_chunks (List): A list of dictionaries, each containing a PDF chunk and its corresponding embedding vector.
     """
     pdf_dict = parse_pdf_with_path(pdf_file_path)
-    pdf_chunks = split_pdf_to_chunks(pdf_dict)
-    for chunk in pdf_chunks:
-        chunk["chunk_vector"] = get_embedding(chunk["chunk"])
-    return pdf_chunks
+    parent_child_chunks = split_pdf_to_chunks(pdf_dict)
+    pdf_chunks = [chunk for chunks in parent_child_chunks.values() for chunk in chunks]
+    return embed_chunks(pdf_chunks)
 
 
 def format_date_as_odatav4(date_string):
@@ -216,9 +665,156 @@ def format_date_as_odatav4(date_string):
     return odata_format
 
 
+def get_tokenizer():
+    """
+    Returns the cl100k_base tokenizer used by the Ada and GPT models, loaded once on first use. The encoding file
+    is baked into the image under TIKTOKEN_CACHE_DIR, there is no fallback: the chunk boundaries, and so the chunk
+    ids, depend on the tokenizer.
+
+    Args:
+        N/A
+
+    Returns:
+        tiktoken.Encoding: The tokenizer.
+
+    Raises:
+        RuntimeError: If tiktoken or its encoding file is not available.
+    """
+    global _tokenizer
+    with _tokenizer_lock:
+        if _tokenizer is None:
+            try:
+                import tiktoken
+                _tokenizer = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                raise RuntimeError(f"The cl100k_base tokenizer could not be loaded: {str(e)}") from e
+        return _tokenizer
+
+
+def count_tokens(text):
+    """
+    Counts the tokens of a text.
+
+    Args:
+        text (str): The text to count the tokens of.
+
+    Returns:
+        int: The number of tokens.
+    """
+    if not text:
+        return 0
+    return len(get_tokenizer().encode(text, disallowed_special=()))
+
+
+class OpenAIClientManager:
+    """
+    Holds one long-lived AzureOpenAI client per deployment, shared by all threads, so that the TLS handshake and
+    the connection pool are reused across calls instead of being created for every request. The clients use
+    keep-alive connections with the limits of OPENAI_CLIENT_CONFIG, and HTTP/2 when the h2 package is installed.
+
+    Args:
+        client_config (Dict): The connection pool settings, see OPENAI_CLIENT_CONFIG.
+    """
+
+    def __init__(self, client_config):
+        self._client_config = client_config
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get_client(self, deployment_config):
+        """
+        Returns the shared client of a deployment, creating it on first use.
+
+        Args:
+            deployment_config (Dict): The deployment configuration, e.g. ADA_CONFIG or GPT_CONFIG.
+
+        Returns:
+            AzureOpenAI: The client of the deployment.
+        """
+        key = (deployment_config["api_base"], deployment_config["deployment_name"], deployment_config["api_version"])
+        with self._lock:
+            openai_client = self._clients.get(key)
+            if openai_client is None:
+                http_client = openai.DefaultHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=self._client_config["max_connections"],
+                        max_keepalive_connections=self._client_config["max_keepalive_connections"],
+                        keepalive_expiry=self._client_config["keepalive_expiry"]
+                    ),
+                    http2=self._client_config["http2"] and importlib.util.find_spec("h2") is not None
+                )
+                openai_client = AzureOpenAI(
+                    api_key=deployment_config["api_key"],
+                    api_version=deployment_config["api_version"],
+                    azure_endpoint=deployment_config["api_base"],
+                    azure_deployment=deployment_config["deployment_name"],
+                    http_client=http_client,
+                    # Retries go through the rate limiter of the deployment instead
+                    max_retries=0
+                )
+                self._clients[key] = openai_client
+            return openai_client
+
+    def close(self):
+        """
+        Closes all clients and their connection pools. Clients requested afterwards are created again.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+        """
+        with self._lock:
+            for openai_client in self._clients.values():
+                openai_client.close()
+            self._clients.clear()
+
+
+openai_clients = OpenAIClientManager(OPENAI_CLIENT_CONFIG)
+embedding_rate_limiter = RateLimiter("Ada", max_retries=RATE_LIMIT_CONFIG["max_retries"],
+                                     **RATE_LIMIT_CONFIG["embedding"])
+completion_rate_limiter = RateLimiter("GPT", max_retries=RATE_LIMIT_CONFIG["max_retries"],
+                                      **RATE_LIMIT_CONFIG["completion"])
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_CONFIG["path"], EMBEDDING_CACHE_CONFIG["max_size_mb"] * 1024 * 1024) \
+    if EMBEDDING_CACHE_CONFIG["enabled"] else None
+if QUERY_EMBEDDING_CACHE_CONFIG["disk_enabled"] and \
+        os.path.abspath(QUERY_EMBEDDING_CACHE_CONFIG["disk_path"]) == os.path.abspath(EMBEDDING_CACHE_CONFIG["path"]):
+    # Both caches would account and evict the same file as if it was their own
+    raise RuntimeError("The disk tier of the query embedding cache must not use the file of the embedding cache.")
+query_embedding_cache = QueryEmbeddingCache(
+    QUERY_EMBEDDING_CACHE_CONFIG["max_entries"],
+    QUERY_EMBEDDING_CACHE_CONFIG["max_size_mb"] * 1024 * 1024,
+    QUERY_EMBEDDING_CACHE_CONFIG["ttl_seconds"],
+    EmbeddingCache(QUERY_EMBEDDING_CACHE_CONFIG["disk_path"],
+                   QUERY_EMBEDDING_CACHE_CONFIG["disk_max_size_mb"] * 1024 * 1024)
+    if QUERY_EMBEDDING_CACHE_CONFIG["disk_enabled"] else None
+) if QUERY_EMBEDDING_CACHE_CONFIG["enabled"] else None
+
+
+def close_openai_clients():
+    """
+    Closes the shared OpenAI clients and the embedding engine, called on service shutdown.
+    """
+    openai_clients.close()
+    embedding_engine.close()
+
+
+def close_embedding_cache():
+    """
+    Closes the database of the embedding cache and the query embedding cache, called on service shutdown.
+    """
+    if embedding_cache is not None:
+        embedding_cache.close()
+    if query_embedding_cache is not None:
+        query_embedding_cache.close()
+
+
 def get_embedding(input_string, verbose_token=False):
     """
-    Get an embedding vector based on the input string using OpenAI Ada model.
+    Get an embedding vector based on the input string using OpenAI Ada model. The request waits for the quota of
+    the embedding rate limiter and rate limited requests are retried. Texts found in the embedding cache are not
+    sent at all.
 
     Args:
         input_string (str): The input text to generate an embedding for.
@@ -227,34 +823,298 @@ def get_embedding(input_string, verbose_token=False):
     Returns:
         list or None: The embedding vector if successful, else None.
     """
-    openai_client = AzureOpenAI(
-        api_key=ADA_CONFIG["api_key"],
-        api_version=ADA_CONFIG["api_version"],
-        azure_endpoint=ADA_CONFIG["api_base"],
-        azure_deployment=ADA_CONFIG["deployment_name"],
-    )
+    if embedding_cache is not None:
+        cache_key = EmbeddingCache.make_key(ADA_CONFIG, input_string)
+        cached_vector = embedding_cache.get(cache_key)
+        if cached_vector is not None:
+            return cached_vector
+
+    openai_client = openai_clients.get_client(ADA_CONFIG)
     try:
-        response = openai_client.embeddings.create(
-            input=input_string,
-            model=ADA_CONFIG["model"],
+        response = embedding_rate_limiter.call(
+            count_tokens(input_string),
+            lambda: openai_client.embeddings.with_raw_response.create(
+                input=input_string,
+                model=ADA_CONFIG["model"],
+            )
         )
         results = response.data[0].embedding
-        openai_client.close()
         if verbose_token:
             app_logger.info(f"OpenAI - Ada Token Usage: (Tokens={response.usage.total_tokens})")
+        if embedding_cache is not None:
+            embedding_cache.put(cache_key, results)
         return results
     except openai.APIConnectionError as e:
-        openai_client.close()
         app_logger.info(f"(OpenAI/Ada): Failed to connect to OpenAI API: {e}")
         return None
-    except openai.APIError as e:
-        openai_client.close()
-        app_logger.info(f"(OpenAI/Ada): OpenAI API returned an API Error: {e}")
-        return None
     except openai.RateLimitError as e:
-        openai_client.close()
         app_logger.info(f"(OpenAI/Ada): OpenAI API request exceeded rate limit: {e}")
         return None
+    except openai.APIError as e:
+        app_logger.info(f"(OpenAI/Ada): OpenAI API returned an API Error: {e}")
+        return None
+
+
+class AsyncEmbeddingEngine:
+    """
+    Generates embeddings in concurrent batches on a background event loop shared by all threads, with at most
+    concurrency_limit requests in flight, each waiting for the rate limiter. Cached and identical inputs are sent once
+    at most, and a rejected batch is split in halves to lose only the faulty input.
+
+    Args:
+        deployment_config (Dict): The configuration of the embedding deployment, e.g. ADA_CONFIG.
+        concurrency_limit (int): The maximum number of concurrent embedding requests.
+        batch_size (int): The maximum number of inputs sent in one request.
+        rate_limiter (RateLimiter): The limiter of the deployment's requests and tokens per minute.
+        cache (EmbeddingCache): Optional cache of the vectors of already embedded texts.
+    """
+
+    def __init__(self, deployment_config, concurrency_limit, batch_size, rate_limiter, cache=None):
+        self._deployment_config = deployment_config
+        self._concurrency_limit = concurrency_limit
+        self._batch_size = batch_size
+        self._rate_limiter = rate_limiter
+        self._cache = cache
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._client = None
+        self._semaphore = None
+
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=loop.run_forever, name="embedding-engine", daemon=True)
+                self._thread.start()
+                asyncio.run_coroutine_threadsafe(self._start(), loop).result()
+                self._loop = loop
+            return self._loop
+
+    async def _start(self):
+        # The client and the semaphore are bound to the event loop they are created in
+        self._semaphore = asyncio.Semaphore(self._concurrency_limit)
+        self._client = AsyncAzureOpenAI(
+            api_key=self._deployment_config["api_key"],
+            api_version=self._deployment_config["api_version"],
+            azure_endpoint=self._deployment_config["api_base"],
+            azure_deployment=self._deployment_config["deployment_name"],
+            max_retries=0,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=max(self._concurrency_limit, OPENAI_CLIENT_CONFIG["max_connections"]),
+                    max_keepalive_connections=OPENAI_CLIENT_CONFIG["max_keepalive_connections"],
+                    keepalive_expiry=OPENAI_CLIENT_CONFIG["keepalive_expiry"]
+                ),
+                http2=OPENAI_CLIENT_CONFIG["http2"] and importlib.util.find_spec("h2") is not None
+            )
+        )
+
+    async def _embed(self, input_strings, verbose_token=False, use_cache=True):
+        cache = self._cache if use_cache else None
+        embeddings = [None] * len(input_strings)
+        # Empty inputs are rejected by the API, they are never sent
+        indices = [index for index, input_string in enumerate(input_strings)
+                   if input_string is not None and input_string.strip()]
+        keys = {index: EmbeddingCache.make_key(self._deployment_config, input_strings[index]) for index in indices}
+        cached_vectors = {}
+        if cache is not None and keys:
+            # SQLite is blocking, keep it off the event loop
+            cached_vectors = await asyncio.to_thread(cache.get_many, list(keys.values()))
+
+        # Only the first input of every missing key is sent, its vector is shared by the identical inputs
+        pending_indices = {}
+        for index in indices:
+            if keys[index] in cached_vectors:
+                embeddings[index] = cached_vectors[keys[index]]
+            else:
+                pending_indices.setdefault(keys[index], index)
+        pending_indices = list(pending_indices.values())
+        await asyncio.gather(*[
+            self._embed_batch(input_strings, pending_indices[start:start + self._batch_size], embeddings,
+                              verbose_token)
+            for start in range(0, len(pending_indices), self._batch_size)
+        ])
+
+        new_vectors = {keys[index]: embeddings[index] for index in pending_indices if embeddings[index] is not None}
+        for index in indices:
+            if embeddings[index] is None:
+                embeddings[index] = new_vectors.get(keys[index])
+        if cache is not None and new_vectors:
+            await asyncio.to_thread(cache.put_many, new_vectors)
+
+        failed_count = sum(1 for embedding in embeddings if embedding is None)
+        if failed_count > 0:
+            app_logger.info(f"(OpenAI/Ada): {failed_count} of {len(input_strings)} inputs could not be embedded.")
+        return embeddings
+
+    async def _embed_batch(self, input_strings, indices, embeddings, verbose_token=False):
+        batch = [input_strings[index] for index in indices]
+        # Tokenizing a batch takes milliseconds, keep it off the event loop shared by all callers
+        token_count = await asyncio.to_thread(lambda: sum(count_tokens(input_string) for input_string in batch))
+        try:
+            async with self._semaphore:
+                response = await self._rate_limiter.call_async(
+                    token_count,
+                    lambda: self._client.embeddings.with_raw_response.create(
+                        input=batch,
+                        model=self._deployment_config["model"],
+                    )
+                )
+        except openai.BadRequestError as e:
+            if len(indices) == 1:
+                app_logger.info(f"(OpenAI/Ada): OpenAI API rejected the input {indices[0]}: {e}")
+                return
+            middle = len(indices) // 2
+            await asyncio.gather(self._embed_batch(input_strings, indices[:middle], embeddings, verbose_token),
+                                 self._embed_batch(input_strings, indices[middle:], embeddings, verbose_token))
+            return
+        except openai.APIConnectionError as e:
+            app_logger.info(f"(OpenAI/Ada): Failed to connect to OpenAI API: {e}")
+            return
+        except openai.RateLimitError as e:
+            app_logger.info(f"(OpenAI/Ada): OpenAI API request exceeded rate limit: {e}")
+            return
+        except openai.APIError as e:
+            app_logger.info(f"(OpenAI/Ada): OpenAI API returned an API Error: {e}")
+            return
+
+        for embedding_data in response.data:
+            embeddings[indices[embedding_data.index]] = embedding_data.embedding
+        if verbose_token:
+            app_logger.info(f"OpenAI - Ada Token Usage: (Tokens={response.usage.total_tokens})")
+
+    async def embed_async(self, input_strings, verbose_token=False, use_cache=True):
+        """
+        Embeds the input strings from any event loop; the requests run on the loop of the engine.
+
+        Args:
+            input_strings (List[str]): The input texts to generate embeddings for.
+            verbose_token (bool): Whether to print the token usage. Defaults to False.
+            use_cache (bool): Whether the cache of the engine is read and filled. Defaults to True.
+
+        Returns:
+            embeddings (List[list or None]): The embedding vectors in the order of the inputs, None for the failed ones.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._embed(input_strings, verbose_token, use_cache),
+                                                  self._get_loop())
+        return await asyncio.wrap_future(future)
+
+    def embed(self, input_strings, verbose_token=False):
+        """
+        Synchronous wrapper of embed_async, blocking the calling thread until all inputs are embedded.
+
+        Args:
+            input_strings (List[str]): The input texts to generate embeddings for.
+            verbose_token (bool): Whether to print the token usage. Defaults to False.
+
+        Returns:
+            embeddings (List[list or None]): The embedding vectors in the order of the inputs, None for the failed ones.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._embed(input_strings, verbose_token), self._get_loop())
+        return future.result()
+
+    def close(self):
+        """
+        Closes the client and stops the event loop of the engine. It is started again on the next call.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+        """
+        with self._lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._client.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+
+
+embedding_engine = AsyncEmbeddingEngine(ADA_CONFIG, CONCURRENCY_LIMIT, EMBEDDING_BATCH_SIZE, embedding_rate_limiter,
+                                        embedding_cache)
+
+
+def get_embeddings(input_strings, verbose_token=False):
+    """
+    Get embedding vectors for many input strings using OpenAI Ada model. The inputs are sent in batches of
+    EMBEDDING_BATCH_SIZE, with up to CONCURRENCY_LIMIT concurrent requests, and the results are mapped back
+    to the inputs by their index. Inputs found in the embedding cache are not sent.
+
+    Args:
+        input_strings (List[str]): The input texts to generate embeddings for.
+        verbose_token (bool): Whether to print the token usage. Defaults to False.
+
+    Returns:
+        embeddings (List[list or None]): The embedding vectors in the order of the inputs, None for the failed ones.
+    """
+    return embedding_engine.embed(input_strings, verbose_token)
+
+
+async def get_embeddings_async(input_strings, verbose_token=False):
+    """
+    Asynchronous version of get_embeddings.
+
+    Args:
+        input_strings (List[str]): The input texts to generate embeddings for.
+        verbose_token (bool): Whether to print the token usage. Defaults to False.
+
+    Returns:
+        embeddings (List[list or None]): The embedding vectors in the order of the inputs, None for the failed ones.
+    """
+    return await embedding_engine.embed_async(input_strings, verbose_token)
+
+
+async def get_query_embeddings_async(queries):
+    """
+    Get the embedding vectors of search queries through the query embedding cache, so that repeated queries skip
+    the round trip to OpenAI. The queries missing in the cache are embedded in one batch and stored in it; they
+    never go through the embedding cache of the ingestion.
+
+    Args:
+        queries (List[str]): The search queries.
+
+    Returns:
+        embeddings (List[list or None]): The embedding vectors in the order of the queries, None for the failed ones.
+    """
+    if query_embedding_cache is None:
+        return await embedding_engine.embed_async(queries, use_cache=False)
+
+    keys = [QueryEmbeddingCache.make_key(ADA_CONFIG, query) for query in queries]
+    vectors = await query_embedding_cache.get_many_async(keys)
+    missing_queries = {key: query for key, query in zip(keys, queries) if key not in vectors}
+    if missing_queries:
+        embeddings = await embedding_engine.embed_async(list(missing_queries.values()), use_cache=False)
+        new_vectors = {key: embedding for key, embedding in zip(missing_queries, embeddings) if embedding is not None}
+        await query_embedding_cache.put_many_async(new_vectors)
+        vectors.update(new_vectors)
+    return [vectors.get(key) for key in keys]
+
+
+def embed_chunks(chunks):
+    """
+    Generates the embedding vectors of the given chunks with concurrent batched requests and stores them in
+    'chunk_vector'.
+    Chunks whose embedding could not be generated are left out.
+
+    Args:
+        chunks (List[Dict]): A list of dictionaries, each containing a 'chunk' text.
+
+    Returns:
+        embedded_chunks (List[Dict]): The chunks with an added 'chunk_vector' key storing the embedding.
+    """
+    embeddings = get_embeddings([chunk["chunk"] for chunk in chunks])
+    embedded_chunks = []
+    for chunk, embedding in zip(chunks, embeddings):
+        if embedding is None:
+            app_logger.error(f"Chunk {chunk['id']} is skipped because its embedding could not be generated.")
+            continue
+        chunk["chunk_vector"] = embedding
+        embedded_chunks.append(chunk)
+    return embedded_chunks
 
 
 def rerank_contexts(lists, k=60):
@@ -290,7 +1150,8 @@ def get_completion(prompt, history=None, temperature=0.7, max_tokens=2048, top_p
                    presence_penalty=0,
                    verbose_token=False, system_message="", json_response=False):
     """
-    Get text completion using AzureOpenAI API based on the provided prompt.
+    Get text completion using AzureOpenAI API based on the provided prompt. The prompt and max_tokens are counted
+    against the quota of the completion rate limiter, and rate limited requests are retried.
 
     Args:
         prompt (str): The input text prompt.
@@ -307,12 +1168,7 @@ def get_completion(prompt, history=None, temperature=0.7, max_tokens=2048, top_p
         str or None: Generated completion text if successful, else None.
     """
 
-    openai_client = AzureOpenAI(
-        api_key=GPT_CONFIG["api_key"],
-        api_version=GPT_CONFIG["api_version"],
-        azure_endpoint=GPT_CONFIG["api_base"],
-        azure_deployment=GPT_CONFIG["deployment_name"],
-    )
+    openai_client = openai_clients.get_client(GPT_CONFIG)
 
     try:
         if history is None:
@@ -323,30 +1179,32 @@ def get_completion(prompt, history=None, temperature=0.7, max_tokens=2048, top_p
         for prev_message in history:
             chat_messages.append(prev_message)
         chat_messages.append({"role": "user", "content": prompt})
-        response = openai_client.chat.completions.create(
-            model=GPT_CONFIG["model"],
-            messages=chat_messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            top_p=top_p,
-            frequency_penalty=frequency_penalty,
-            presence_penalty=presence_penalty,
-            seed=42,
-            response_format={"type": "json_object" if json_response else "text"}
+        # Azure OpenAI counts max_tokens against the tokens per minute quota when the request is accepted
+        token_count = sum(count_tokens(message["content"]) for message in chat_messages) + max_tokens
+        response = completion_rate_limiter.call(
+            token_count,
+            lambda: openai_client.chat.completions.with_raw_response.create(
+                model=GPT_CONFIG["model"],
+                messages=chat_messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                top_p=top_p,
+                frequency_penalty=frequency_penalty,
+                presence_penalty=presence_penalty,
+                seed=42,
+                response_format={"type": "json_object" if json_response else "text"}
+            )
         )
         if verbose_token:
             app_logger.info(f"(OpenAI/GPT Token Usage): Prompt: {response.usage.prompt_tokens} + Completion: "
                             f"{response.usage.completion_tokens} = Total: {response.usage.total_tokens}")
         return response.choices[0].message.content
     except openai.APIConnectionError as e:
-        openai_client.close()
         app_logger.info(f"(OpenAI/GPT): Failed to connect to OpenAI API: {e}")
         return None
-    except openai.APIError as e:
-        openai_client.close()
-        app_logger.info(f"(OpenAI/GPT): OpenAI API returned an API Error: {e}")
-        return None
     except openai.RateLimitError as e:
-        openai_client.close()
         app_logger.info(f"(OpenAI/GPT): OpenAI API request exceeded rate limit: {e}")
         return None
+    except openai.APIError as e:
+        app_logger.info(f"(OpenAI/GPT): OpenAI API returned an API Error: {e}")
+        return None
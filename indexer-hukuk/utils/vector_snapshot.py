@@ -0,0 +1,179 @@
+import json
+import sqlite3
+import struct
+import threading
+from array import array
+
+from config import app_logger
+
+# The snapshot tables, one for the documents of the chunk index and one for those of the parent index
+SNAPSHOT_TABLES = ("chunks", "parents")
+VECTOR_FORMATS = {"float32": "f", "float16": "e"}
+
+
+class VectorSnapshot:
+    """
+    A local SQLite copy of the documents of the chunk and parent indexes with their vectors, kept in step with the
+    indexes, so that they can be rebuilt without embedding the chunks again. The vectors are stored as float32 or
+    float16 blobs, the other fields as JSON.
+
+    Args:
+        snapshot_path (str): The file path of the SQLite database.
+        vector_dtype (str): The type the vectors are stored as, "float32" or "float16".
+    """
+
+    def __init__(self, snapshot_path, vector_dtype="float32"):
+        if vector_dtype not in VECTOR_FORMATS:
+            raise ValueError(f"Unknown vector type: {vector_dtype}")
+        self.snapshot_path = snapshot_path
+        self.vector_format = VECTOR_FORMATS[vector_dtype]
+        self._lock = threading.Lock()
+        self._connection = None
+
+    def _get_connection(self):
+        # Must be called while holding the lock
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.snapshot_path, check_same_thread=False, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            for table in SNAPSHOT_TABLES:
+                self._connection.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        id TEXT PRIMARY KEY,
+                        document TEXT NOT NULL,
+                        vector BLOB,
+                        vector_format TEXT
+                    )
+                """)
+            app_logger.info(f"Vector snapshot {self.snapshot_path} is loaded.")
+        return self._connection
+
+    def _encode_vector(self, vector):
+        if vector is None:
+            return None, None
+        if self.vector_format == "f":
+            return array("f", vector).tobytes(), "f"
+        return struct.pack(f"<{len(vector)}e", *vector), "e"
+
+    @staticmethod
+    def _decode_vector(blob, vector_format):
+        if blob is None:
+            return None
+        if vector_format == "f":
+            vector = array("f")
+            vector.frombytes(blob)
+            return vector.tolist()
+        return list(struct.unpack(f"<{len(blob) // 2}e", blob))
+
+    def put_many(self, table, documents):
+        """
+        Stores documents by their id, replacing the stored versions. The 'chunk_vector' of a document is stored as
+        its vector.
+
+        Args:
+            table (str): The snapshot table, "chunks" or "parents".
+            documents (List[Dict]): The documents uploaded to the index of the table.
+
+        Returns:
+            N/A
+        """
+        if not documents:
+            return
+        rows = []
+        for document in documents:
+            fields = {key: value for key, value in document.items() if key != "chunk_vector"}
+            vector, vector_format = self._encode_vector(document.get("chunk_vector"))
+            rows.append((document["id"], json.dumps(fields, ensure_ascii=False), vector, vector_format))
+        with self._lock:
+            connection = self._get_connection()
+            connection.execute("BEGIN")
+            connection.executemany(f"INSERT OR REPLACE INTO {table} (id, document, vector, vector_format) "
+                                   f"VALUES (?, ?, ?, ?)", rows)
+            connection.execute("COMMIT")
+
+    def delete_many(self, table, ids):
+        """
+        Deletes documents by their id.
+
+        Args:
+            table (str): The snapshot table, "chunks" or "parents".
+            ids (Iterable[str]): The ids of the documents deleted from the index of the table.
+
+        Returns:
+            N/A
+        """
+        rows = [(document_id,) for document_id in ids]
+        if not rows:
+            return
+        with self._lock:
+            self._get_connection().executemany(f"DELETE FROM {table} WHERE id = ?", rows)
+
+    def iter_batches(self, table, batch_size=1000):
+        """
+        Reads the documents of a table in batches ordered by id, paging by id so that the whole table is never
+        held in memory.
+
+        Args:
+            table (str): The snapshot table, "chunks" or "parents".
+            batch_size (int): The number of documents per batch.
+
+        Yields:
+            documents (List[Dict]): The next documents, with their vectors as 'chunk_vector'.
+        """
+        last_id = ""
+        while True:
+            with self._lock:
+                rows = self._get_connection().execute(
+                    f"SELECT id, document, vector, vector_format FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            documents = []
+            for _, document, vector, vector_format in rows:
+                document = json.loads(document)
+                if vector is not None:
+                    document["chunk_vector"] = self._decode_vector(vector, vector_format)
+                documents.append(document)
+            yield documents
+            last_id = rows[-1][0]
+
+    def missing_ids(self, table, ids):
+        """
+        Returns the ids that are not in a table, e.g. to find the documents of an index that the snapshot no longer
+        has.
+
+        Args:
+            table (str): The snapshot table, "chunks" or "parents".
+            ids (List[str]): The ids to look up.
+
+        Returns:
+            missing_ids (List[str]): The given ids that are not in the table, in their order.
+        """
+        found_ids = set()
+        with self._lock:
+            connection = self._get_connection()
+            # SQLite limits the number of parameters of a statement
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                found_ids.update(row[0] for row in connection.execute(
+                    f"SELECT id FROM {table} WHERE id IN ({', '.join('?' * len(batch))})", batch))
+        return [document_id for document_id in ids if document_id not in found_ids]
+
+    def count(self, table):
+        """
+        Returns the number of documents in a table.
+
+        Args:
+            table (str): The snapshot table, "chunks" or "parents".
+
+        Returns:
+            int: The number of documents.
+        """
+        with self._lock:
+            return self._get_connection().execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -1,11 +1,14 @@
 from datetime import datetime
-import gc
+from functools import partial
 
-import pdfminer
 import uvicorn
 from azure.storage.blob import BlobServiceClient
+import io
 import zipfile
 import tempfile
+import posixpath
+import threading
+import time
 
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
@@ -14,19 +17,36 @@ from config import app_logger
 import math
 import json
 import os
-from config import BLOB_STORAGE_CONFIG
-from utils.utils import parse_pdf_with_path, split_text_to_chunks, split_pdf_to_chunks, get_embedding, \
-    format_date_as_odatav4
-from utils.search import create_index, does_index_exists, ingest_chunks, delete_index, \
-    check_document_existence_by_title_and_date
-
-
-def get_meta_data(directory_path, website_name, file_name, keyword, notified_date):
+from config import BLOB_STORAGE_CONFIG, COGNITIVE_SEARCH_CONFIG, PIPELINE_CONFIG, LEDGER_PATH, ZIP_SPOOL_MAX_SIZE, \
+    ZIP_RANGE_BLOCK_SIZE, SEARCH_UPLOAD_CONFIG, UPDATE_MODE, WINDOW_PARENT_CHUNKS, CHUNK_DUMP_CONFIG, \
+    VECTOR_SNAPSHOT_CONFIG
+from utils.utils import iter_pdf_pages, iter_parent_child_chunks, embed_chunks, \
+    format_date_as_odatav4, shutdown_pdf_process_pool, close_openai_clients, \
+    close_embedding_cache, embedding_cache, query_embedding_cache, get_tokenizer
+from utils.search import create_index, create_parent_index, does_index_exists, delete_index, IndexedDocumentSet, \
+    split_parent_documents, add_missing_index_fields, document_key, fetch_document_chunks, fetch_chunk_vectors, \
+    iter_index_chunks, iter_index_ids, attach_parent_chunks, close_search_clients, fields as index_fields, \
+    parent_fields, create_catalog_index, make_catalog_entry, fetch_catalog_entries_from_chunks
+from utils.ingestion_sink import IngestionSink, DocumentProgress
+from utils.chunk_dump import ChunkDumpSink
+from utils.vector_snapshot import VectorSnapshot
+from utils.pipeline import Pipeline, Stage
+from utils.blob_reader import BlobRangeReader
+from utils.ledger import IngestionLedger, STATUS_IN_PROGRESS, STATUS_DONE, STATUS_FAILED, STATUS_SKIPPED, \
+    REASON_ALREADY_INDEXED, MARKER_CATALOG_BACKFILLED
+from utils.jobs import JobManager, JobConflictError
+
+vector_snapshot = None
+if VECTOR_SNAPSHOT_CONFIG["enabled"]:
+    vector_snapshot = VectorSnapshot(VECTOR_SNAPSHOT_CONFIG["path"], VECTOR_SNAPSHOT_CONFIG["vector_dtype"])
+
+
+def get_meta_data(zip_file, website_name, file_name, keyword, notified_date):
     """
-    Generates metadata for regulation files located in a specific directory path.
+    Generates metadata for regulation files from the metadata file of the regulation's zip archive.
 
     Args:
-        directory_path (str): The path to the directory containing files.
+        zip_file (ZipFile): The zip archive of the regulation files.
         website_name (str): The name of the website associated with the regulation files.
         file_name (str): The name of the file to extract metadata from.
         keyword (str): The keyword to associate with the regulation files.
@@ -37,12 +57,10 @@ def get_meta_data(directory_path, website_name, file_name, keyword, notified_dat
     """
     metadata_dict = {}
     try:
-        for root, dirs, files in os.walk(directory_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                if file.startswith('metadata') and file_path.endswith('.json'):
-                    with open(file_path, 'r') as f:
-                        metadata_dict = json.load(f)
+        for member in zip_file.infolist():
+            file = posixpath.basename(member.filename)
+            if file.startswith('metadata') and file.endswith('.json'):
+                metadata_dict = json.loads(zip_file.read(member))
 
         metadata_dict["website"] = website_name
 
@@ -78,162 +96,301 @@ def get_meta_data(directory_path, website_name, file_name, keyword, notified_dat
     return metadata_dict
 
 
-def extract_regulation_content(directory_path):
+def extract_regulation_content(zip_file):
     """
-    Extracts content from text, summarize, and json files in the specified directory of the regulation.
+    Extracts content from text, summarize, and json files in the zip archive of the regulation. The members are
+    read straight from the archive, without extracting them to disk. The PDF files are parsed page by page while
+    they are split, so that large files are never held as a whole text.
 
     Args:
-        directory_path (str): The path to the directory containing the regulation files.
+        zip_file (ZipFile): The zip archive of the regulation files.
 
     Returns:
-        tuple: A tuple containing lists of text contents, summarize contents, and json contents of the regulation files.
+        tuple: A tuple containing lists of text contents, (name, content) pairs of the PDF files, and json contents
+               of the regulation files.
+
+    Raises:
+        RuntimeError: If a text or json file could not be parsed.
     """
     txt_contents = []
-    pdf_contents = []
     json_contents = []
-    for root, dirs, files in os.walk(directory_path):
-        for file in files:
-            file_path = os.path.join(root, file)
-
-            if file_path.endswith('.txt'):
-                try:
-                    with open(file_path, 'r', encoding="utf-8") as f:
-                        txt_content = f.read()
-                        txt_content = txt_content.strip()
-                        app_logger.info("txt File Parsed")
-                        if len(txt_content) > 4:
-                            txt_contents.append(txt_content)
-                        else:
-                            app_logger.info("txt File is Empty")
-                except Exception as e:
-                    app_logger.error(f"Error parsing txt file {file_path}: {str(e)}")
-                    continue
-
-            if file_path.endswith('.json') and not file.startswith('metadata'):
-                try:
-                    with open(file_path, 'r', encoding="utf-8") as f:
-                        json_content = json.load(f)
-                        app_logger.info("JSON File Parsed")
-                        if len(str(json_content)) > 4:
-                            json_contents.append(json_content)
-                        else:
-                            app_logger.info("JSON File is Empty")
-                except Exception as e:
-                    app_logger.error(f"Error parsing JSON file {file_path}: {str(e)}")
-                    continue
-
-            if file_path.endswith('.pdf'):
-                try:
-                    pdf_content = parse_pdf_with_path(file_path)
-                    if len(pdf_content) > 0:
-                        pdf_contents.append(pdf_content)
-                except pdfminer.pdfparser.PDFSyntaxError as e:
-                    app_logger.error(f"PDF syntax error in file {file_path}: {str(e)}")
-                    continue
-                except Exception as e:
-                    app_logger.error(f"Error parsing PDF file {file_path}: {str(e)}")
-                    continue
-
-    return txt_contents, pdf_contents, json_contents
-
-
-def generate_child_chunks(parent_child_chunks: dict) -> list:
+    pdf_files = []
+    for member in zip_file.infolist():
+        if member.is_dir():
+            continue
+        file = posixpath.basename(member.filename)
+        file_path = member.filename
+
+        if file_path.endswith('.txt'):
+            try:
+                txt_content = zip_file.read(member).decode("utf-8")
+                txt_content = txt_content.strip()
+                app_logger.info("txt File Parsed")
+                if len(txt_content) > 4:
+                    txt_contents.append(txt_content)
+                else:
+                    app_logger.info("txt File is Empty")
+            except Exception as e:
+                app_logger.error(f"Error parsing txt file {file_path}: {str(e)}")
+                # A regulation without one of its files must not replace its indexed version
+                raise RuntimeError(f"txt file {file_path} could not be parsed: {str(e)}") from e
+
+        if file_path.endswith('.json') and not file.startswith('metadata'):
+            try:
+                json_content = json.loads(zip_file.read(member).decode("utf-8"))
+                app_logger.info("JSON File Parsed")
+                if len(str(json_content)) > 4:
+                    json_contents.append(json_content)
+                else:
+                    app_logger.info("JSON File is Empty")
+            except Exception as e:
+                app_logger.error(f"Error parsing JSON file {file_path}: {str(e)}")
+                # A regulation without one of its files must not replace its indexed version
+                raise RuntimeError(f"JSON file {file_path} could not be parsed: {str(e)}") from e
+
+        if file_path.endswith('.pdf'):
+            pdf_files.append((file_path, zip_file.read(member)))
+
+    return txt_contents, pdf_files, json_contents
+
+
+def generate_child_chunks(parent_child_chunks_list: list) -> list:
     child_chunks = []
-    for _, c_chunks in parent_child_chunks.items():
-        for c_chunk in c_chunks:
-            c_chunk["chunk_vector"] = get_embedding(c_chunk["chunk"])
-            child_chunks.append(c_chunk)
+    for parent_child_chunks in parent_child_chunks_list:
+        for _, c_chunks in parent_child_chunks.items():
+            child_chunks.extend(c_chunks)
 
-    return child_chunks
+    # The child chunks of all sources are embedded together, so that all of their batches are sent concurrently
+    embedded_chunks = embed_chunks(child_chunks)
+    if len(embedded_chunks) < len(child_chunks):
+        # A regulation indexed without some of its chunks would be marked as done and never retried
+        raise RuntimeError(f"{len(child_chunks) - len(embedded_chunks)} of {len(child_chunks)} chunks could not be "
+                           f"embedded")
+    return embedded_chunks
 
 
-def ingest_regulation(chunks):
+def ingest_regulation(document_id, chunks, sink, parent_sink, on_complete=None, deleted_ids=(),
+                      deleted_parent_ids=(), chunk_dump=None):
     """
-    Ingests provided data chunks and saves them to a JSON file for later inspection.
+    Queues provided data chunks for upload, and in the chunk dump for later inspection if one is given. The parent
+    chunk texts are uploaded once to the parent index, and the child chunks without them.
 
     Args:
+        document_id (str): The identifier of the regulation, e.g. its blob name.
         chunks (List[Dict]): A list of data chunks to ingest.
+        sink (IngestionSink): The sink uploading the child chunks of the run.
+        parent_sink (IngestionSink): The sink uploading the parent chunks of the run.
+        on_complete (Callable): Optional callback called with the number of failed chunks once all chunks are
+                                uploaded.
+        deleted_ids (Iterable[str]): The ids of the removed chunks of an updated regulation.
+        deleted_parent_ids (Iterable[str]): The ids of the removed parent chunks of an updated regulation.
+        chunk_dump (ChunkDumpSink): Optional sink writing the chunks to disk.
 
     Returns:
         None
     """
-    with open('chunks_output.json', 'w', encoding='utf-8') as f:
-        json.dump(chunks, f, ensure_ascii=False, indent=4)
-
-    ingest_chunks(chunks)
-
-
-def create_index_if_not_exists() -> None:
+    if chunk_dump is not None:
+        chunk_dump.add(document_id, chunks)
+
+    child_chunks, parent_documents = split_parent_documents(chunks)
+    if vector_snapshot is not None:
+        # The snapshot is written first, so that every indexed document can be rebuilt from it
+        vector_snapshot.put_many("parents", parent_documents)
+        vector_snapshot.delete_many("parents", deleted_parent_ids)
+        vector_snapshot.put_many("chunks", child_chunks)
+        vector_snapshot.delete_many("chunks", deleted_ids)
+    # The regulation is complete once both its parents and its children are uploaded
+    progress = {"remaining": 2, "failed": 0}
+    progress_lock = threading.Lock()
+
+    def complete_part(failed_count):
+        with progress_lock:
+            progress["remaining"] -= 1
+            progress["failed"] += failed_count
+            is_complete = progress["remaining"] == 0
+        if is_complete and on_complete is not None:
+            on_complete(progress["failed"])
+
+    parent_sink.add(document_id, parent_documents, complete_part, deleted_keys=deleted_parent_ids)
+    sink.add(document_id, child_chunks, complete_part, deleted_keys=deleted_ids)
+
+
+def create_index_if_not_exists(ledger) -> bool:
     """
-    Ensuring index existence, creating index if necessary.
+    Ensuring index existence, creating index if necessary. A new document catalog is filled with the documents
+    indexed before it, and a fill that did not complete, e.g. because the service stopped, is run again.
 
     Args:
-        None
+        ledger (IngestionLedger): The ledger recording whether the document catalog is filled.
 
     Returns:
-        None
+        bool: True if the document catalog holds every indexed document, False if it could not be filled yet.
     """
     if not does_index_exists():
         create_index()
+    else:
+        add_missing_index_fields()
+    create_parent_index()
+    if create_catalog_index():
+        ledger.set_marker(MARKER_CATALOG_BACKFILLED, False)
+    if not ledger.has_marker(MARKER_CATALOG_BACKFILLED):
+        try:
+            backfill_catalog(ledger=ledger)
+        except Exception as e:
+            app_logger.error(f"Document catalog could not be filled, it is filled again by the next run: {str(e)}")
+    return ledger.has_marker(MARKER_CATALOG_BACKFILLED)
+
+
+def backfill_catalog(batch_size=1000, job=None, ledger=None):
+    """
+    Fills the document catalog with every document of the chunk index, e.g. for the regulations indexed before
+    the catalog was introduced. Existing rows are overwritten, so a fill that did not complete is simply run again;
+    its completion is recorded in the ledger.
 
+    Args:
+        batch_size (int): The number of catalog rows queued at once.
+        job (Job): Optional job running the fill. Its progress is tracked, and a cancelled job stops between pages.
+        ledger (IngestionLedger): The ledger recording the completion, the one of LEDGER_PATH if not given.
 
-def chunk_regulation(metadata, txt_contents, pdf_contents, json_contents):
+    Returns:
+        stats (Dict): The upload counters of the catalog, None if the job is cancelled before the upload.
     """
-    Generates a list of chunks from text, PDF, and JSON contents with associated metadata.
+    cancel_event = job.cancel_event if job is not None else None
+    create_catalog_index()
+    entries = fetch_catalog_entries_from_chunks(cancel_event=cancel_event)
+    if entries is None:
+        return None
+
+    catalog_sink = IngestionSink(COGNITIVE_SEARCH_CONFIG["catalog_index_name"], **SEARCH_UPLOAD_CONFIG)
+    if job is not None:
+        job.track(catalog_sink.stats)
+    is_cancelled = False
+    try:
+        for start in range(0, len(entries), batch_size):
+            if cancel_event is not None and cancel_event.is_set():
+                is_cancelled = True
+                break
+            catalog_sink.add(f"catalog#{start}", entries[start:start + batch_size])
+        catalog_sink.flush()
+        stats = catalog_sink.stats()
+    finally:
+        catalog_sink.close()
+
+    if is_cancelled or stats["failed"] > 0:
+        app_logger.info(f"Document catalog is partly filled from the search index: {stats}")
+        return stats
+    owns_ledger = ledger is None
+    if owns_ledger:
+        ledger = IngestionLedger(LEDGER_PATH)
+    try:
+        ledger.set_marker(MARKER_CATALOG_BACKFILLED)
+    finally:
+        if owns_ledger:
+            ledger.close()
+    app_logger.info(f"Document catalog is filled from the search index: {stats}")
+    return stats
+
+
+def get_catalog_document(metadata):
+    """
+    Maps the metadata of a regulation to the fields of its chunks that are kept in the document catalog.
+    """
+    return {"title": metadata["title"], "date": metadata["notified_date"], "website": metadata["website"],
+            "keyword": metadata["keyword"], "notified_country": metadata["notified_country"],
+            "url": metadata["URL"]}
+
+
+def get_regulation_key(metadata):
+    """
+    Builds the key identifying a regulation from its title and notified date, used to derive its chunk ids.
+    """
+    return "|".join(document_key(metadata["title"], metadata["notified_date"]))
+
+
+def get_source_key(regulation_key, source):
+    """
+    Builds the key of one source of a regulation, e.g. its text or one of its PDF files or tables.
+    """
+    return f"{regulation_key}|{source}" if regulation_key is not None else None
+
+
+def iter_regulation_windows(txt_contents, pdf_pages, json_contents, source_key=None,
+                            window_size=WINDOW_PARENT_CHUNKS):
+    """
+    Splits the text, PDF, and JSON contents of a regulation into parent and child chunks and yields them in
+    windows of at most window_size parent chunks. The pages of the PDF files are split as they are parsed, so
+    only one window of chunks is held at a time, however large the regulation is.
+
+    Args:
+        txt_contents (List[str]): List of text contents.
+        pdf_pages (List[tuple]): The (file name, pages) pairs of the PDF files, where pages iterates over the texts
+                                 of the pages.
+        json_contents (List[Dict]): List of dictionaries containing JSON contents.
+        source_key (str): Identifies the regulation, the chunk ids are derived from it when given.
+        window_size (int): The maximum number of parent chunks per window.
+
+    Yields:
+        parent_child_chunks_list (List[Dict]): The parent-child chunk groups of the window, one for each source.
+    """
+    sources = []
+    if len(txt_contents) > 0:
+        sources.append(("txt", ["\n\n".join(txt_contents)]))
+    for file_name, pages in pdf_pages:
+        sources.append((f"pdf:{file_name}", pages))
+    for table_index, table in enumerate(json_contents):
+        sources.append((f"json:{table_index}", ["Table: " + json.dumps(table)]))
+
+    window = []
+    window_parent_count = 0
+    for source, texts in sources:
+        parent_child_chunks = {}
+        window.append(parent_child_chunks)
+        for parent_id, chunks in iter_parent_child_chunks(texts, get_source_key(source_key, source)):
+            if window_parent_count == max(1, window_size):
+                yield window
+                parent_child_chunks = {}
+                window = [parent_child_chunks]
+                window_parent_count = 0
+            parent_child_chunks[parent_id] = chunks
+            window_parent_count += 1
+
+    if window_parent_count > 0:
+        yield window
+
+
+def split_regulation(txt_contents, pdf_contents, json_contents, source_key=None):
+    """
+    Splits text, PDF, and JSON contents of a regulation into groups of parent and child chunks.
 
     Args:
-        metadata (Dict): Metadata information including title, notified date, website, keyword, notified country, URL.
         txt_contents (List[str]): List of text contents.
         pdf_contents (List[Dict]): List of dictionaries containing summarized contents.
         json_contents (List[Dict]): List of dictionaries containing JSON contents.
+        source_key (str): Identifies the regulation, the chunk ids are derived from it when given.
 
     Returns:
-        chunks (List[Dict]): A list of dictionaries where each dictionary represents a chunk of text or data
-                             associated with the provided metadata.
+        parent_child_chunks_list (List[Dict]): A list of parent-child chunk dictionaries.
     """
-    chunks = []
+    pdf_pages = [(pdf_content_dict["file_name"], pdf_content_dict["page_contents"])
+                 for pdf_content_dict in pdf_contents]
+    return [parent_child_chunks
+            for window in iter_regulation_windows(txt_contents, pdf_pages, json_contents, source_key=source_key)
+            for parent_child_chunks in window]
 
-    # Check for text content and apply chunk limit
-    if len(txt_contents) > 0:
-        all_text = "\n\n".join(txt_contents)
-        text_parent_child_chunks = split_text_to_chunks(all_text)
-
-        # If text chunk count exceeds 100, skip processing
-        if len(text_parent_child_chunks.keys()) > 100:
-            app_logger.info(f"Text chunks exceed 100. Skipping this file.")
-            return []  # Skip the process
-
-        child_chunks_txt = generate_child_chunks(text_parent_child_chunks)
-        chunks.extend(child_chunks_txt)
-
-    # Check for PDF content and apply chunk limit
-    if len(pdf_contents) > 0:
-        for pdf_content_dict in pdf_contents:
-            pdf_parent_child_chunks = split_pdf_to_chunks(pdf_content_dict)
-
-            # If PDF chunk count exceeds 100, skip processing
-            if len(pdf_parent_child_chunks.keys()) > 100:
-                app_logger.info(f"PDF chunks exceed 100. Skipping this file.")
-                return []  # Skip the process
-
-            app_logger.info(f"PDF split into {len(pdf_parent_child_chunks.keys())} parent chunks successfully!")
-            child_chunks_pdf = generate_child_chunks(pdf_parent_child_chunks)
-            chunks.extend(child_chunks_pdf)
-
-    # Check for JSON content and apply chunk limit
-    if len(json_contents) > 0:
-        for table in json_contents:
-            table_json = json.dumps(table)
-            table_string = "Table: " + table_json
-            table_parent_child_chunks = split_text_to_chunks(table_string)
-
-            # If JSON chunk count exceeds 100, skip processing
-            if len(table_parent_child_chunks.keys()) > 100:
-                app_logger.info(f"JSON chunks exceed 100. Skipping this file.")
-                return []  # Skip the process
-
-            child_chunks_table = generate_child_chunks(table_parent_child_chunks)
-            chunks.extend(child_chunks_table)
+
+def embed_regulation(metadata, parent_child_chunks_list):
+    """
+    Generates embedded child chunks from the parent-child chunk groups of a regulation and adds its metadata.
+
+    Args:
+        metadata (Dict): Metadata information including title, notified date, website, keyword, notified country, URL.
+        parent_child_chunks_list (List[Dict]): The parent-child chunk groups returned by split_regulation.
+
+    Returns:
+        chunks (List[Dict]): A list of dictionaries where each dictionary represents an embedded chunk
+                             associated with the provided metadata.
+    """
+    chunks = generate_child_chunks(parent_child_chunks_list)
 
     # Add metadata to each chunk
     for chunk in chunks:
@@ -247,93 +404,584 @@ def chunk_regulation(metadata, txt_contents, pdf_contents, json_contents):
     return chunks
 
 
-def main():
+def update_regulation(metadata, parent_child_chunks_list, indexed_hashes):
+    """
+    Compares the chunks of a window of a new version of an indexed regulation with the chunks in the index by
+    their ids and content hashes. Unchanged chunks are left as they are, and only new or changed chunks are
+    returned for upload; chunks whose text only moved reuse their stored vector, so only new texts are embedded.
+
+    Args:
+        metadata (Dict): Metadata information including title, notified date, website, keyword, notified country, URL.
+        parent_child_chunks_list (List[Dict]): The parent-child chunk groups of a window.
+        indexed_hashes (Dict[str, str]): The content hashes of the indexed chunks of the regulation by their id.
+
+    Returns:
+        chunks (List[Dict]): The new or changed chunks with their vectors and metadata.
+    """
+    child_chunks = [chunk for parent_child_chunks in parent_child_chunks_list
+                    for c_chunks in parent_child_chunks.values() for chunk in c_chunks]
+    changed_chunks = [chunk for chunk in child_chunks if indexed_hashes.get(chunk["id"]) != chunk["content_hash"]]
+    if not changed_chunks:
+        return []
+
+    ids_by_hash = {content_hash: chunk_id for chunk_id, content_hash in indexed_hashes.items() if content_hash}
+    # A stored vector may already be deleted by the last part of the update, the chunk is then embedded again
+    stored_vectors = fetch_chunk_vectors([ids_by_hash[chunk["content_hash"]] for chunk in changed_chunks
+                                          if chunk["content_hash"] in ids_by_hash])
+    chunks_to_embed = []
+    for chunk in changed_chunks:
+        stored_vector = stored_vectors.get(ids_by_hash.get(chunk["content_hash"]))
+        if stored_vector is not None:
+            chunk["chunk_vector"] = stored_vector
+        else:
+            chunks_to_embed.append(chunk)
+
+    embedded_chunks = embed_chunks(chunks_to_embed)
+    if len(embedded_chunks) < len(chunks_to_embed):
+        # Deleting the old chunks without their replacements would lose content, the update is retried instead
+        raise RuntimeError(f"{len(chunks_to_embed) - len(embedded_chunks)} changed chunks could not be embedded")
+
+    app_logger.info(f"Update of {metadata['title']}: {len(child_chunks) - len(changed_chunks)} unchanged, "
+                    f"{len(changed_chunks) - len(chunks_to_embed)} moved and {len(chunks_to_embed)} embedded "
+                    f"chunks.")
+    for chunk in changed_chunks:
+        chunk["title"] = metadata["title"]
+        chunk["date"] = metadata["notified_date"]
+        chunk["website"] = metadata["website"]
+        chunk["keyword"] = metadata["keyword"]
+        chunk["notified_country"] = metadata["notified_country"]
+        chunk["url"] = metadata["URL"]
+
+    return changed_chunks
+
+
+def chunk_regulation(metadata, txt_contents, pdf_contents, json_contents):
+    """
+    Generates a list of chunks from text, PDF, and JSON contents with associated metadata.
+
+    Args:
+        metadata (Dict): Metadata information including title, notified date, website, keyword, notified country, URL.
+        txt_contents (List[str]): List of text contents.
+        pdf_contents (List[Dict]): List of dictionaries containing summarized contents.
+        json_contents (List[Dict]): List of dictionaries containing JSON contents.
+
+    Returns:
+        chunks (List[Dict]): A list of dictionaries where each dictionary represents a chunk of text or data
+                             associated with the provided metadata.
+    """
+    parent_child_chunks_list = split_regulation(txt_contents, pdf_contents, json_contents,
+                                                source_key=get_regulation_key(metadata))
+    return embed_regulation(metadata, parent_child_chunks_list)
+
+
+def list_regulation_blobs(container_client, ledger):
+    """
+    Lists the regulation zip files in the storage container. Blobs finished in a previous run are skipped by the
+    ingestion ledger without any network call, and blobs without a valid date in their name are recorded as skipped.
+
+    Args:
+        container_client (ContainerClient): The client of the storage container.
+        ledger (IngestionLedger): The ingestion ledger of the container.
+
+    Yields:
+        item (Dict): The pipeline item of the regulation, holding the blob name, version, keyword, file name and date.
+    """
+    for my_blob in container_client.list_blobs():
+        if not my_blob.name.endswith('.zip'):
+            continue
+
+        content_md5 = my_blob.content_settings.content_md5
+        item = {
+            "blob_name": my_blob.name,
+            "size": my_blob.size,
+            "etag": my_blob.etag,
+            "content_hash": bytes(content_md5).hex() if content_md5 else ""
+        }
+        if ledger.is_finished(item["blob_name"], item["etag"], item["content_hash"]):
+            continue
+
+        keyword = my_blob.name.split('/')[1]
+        file_name_with_extension = my_blob.name.split('/')[-1]
+        file_name = file_name_with_extension.split('.')[0]
+        notified_date = file_name[:10]
+
+        try:
+            datetime.strptime(notified_date, '%Y-%m-%d')
+        except ValueError:
+            app_logger.error(f"Invalid date format in file name {file_name}. Skipping this zip file.")
+            mark_regulation(ledger, item, STATUS_SKIPPED, "invalid date in file name")
+            continue
+
+        item.update({"keyword": keyword, "file_name": file_name, "notified_date": notified_date,
+                     "update": UPDATE_MODE and ledger.has_other_version(item["blob_name"], item["etag"],
+                                                                        item["content_hash"])})
+        yield item
+
+
+def mark_regulation(ledger, item, status, reason=None):
+    """
+    Records the status of the blob of a pipeline item in the ingestion ledger.
+    """
+    ledger.mark(item["blob_name"], item["etag"], item["content_hash"], status, reason)
+
+
+def download_regulation(item, blob_service_client, ledger, indexed_documents):
+    """
+    Pipeline stage reading the metadata of the regulation and downloading its zip file if it is not indexed yet.
+    The metadata file is read through ranged reads of the zip central directory and the metadata member only,
+    so already indexed regulations are dropped without downloading their archive.
+    """
+    mark_regulation(ledger, item, STATUS_IN_PROGRESS)
+    blob_client = blob_service_client.get_blob_client(container=BLOB_STORAGE_CONFIG['container_name'],
+                                                      blob=item['blob_name'])
+
+    blob_reader = BlobRangeReader(blob_client, item["size"], block_size=ZIP_RANGE_BLOCK_SIZE)
+    with zipfile.ZipFile(blob_reader, 'r') as zip_ref:
+        metadata = get_meta_data(zip_ref, website_name=None, file_name=item["file_name"], keyword=item["keyword"],
+                                 notified_date=item["notified_date"])
+
+    if indexed_documents.contains(metadata["title"], metadata["notified_date"]) and not item["update"]:
+        app_logger.info(f"The document is already indexed! ({item['blob_name']})")
+        mark_regulation(ledger, item, STATUS_SKIPPED, REASON_ALREADY_INDEXED)
+        return None
+    item["metadata"] = metadata
+
+    if blob_reader.is_fully_buffered():
+        # Small archives are already in memory after reading the metadata
+        item["zip_buffer"] = io.BytesIO(blob_reader.getvalue())
+        return item
+
+    app_logger.info(f"Downloading {item['blob_name']} ...")
+    # The zip is kept in memory and spooled to disk only if it is larger than ZIP_SPOOL_MAX_SIZE
+    zip_buffer = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_MAX_SIZE)
+    blob_client.download_blob().readinto(zip_buffer)
+    zip_buffer.seek(0)
+    item["zip_buffer"] = zip_buffer
+    return item
+
+
+def parse_regulation(item):
+    """
+    Pipeline stage opening the zip file of the regulation and reading its contents straight from the archive.
+    """
+    with item.pop("zip_buffer") as zip_buffer, zipfile.ZipFile(zip_buffer, 'r') as zip_ref:
+        app_logger.info(f"Extracting {item['blob_name']} ...")
+        item["contents"] = extract_regulation_content(zip_ref)
+
+    return item
+
+
+def split_regulation_stage(item, ledger, indexed_documents, catalog_sink):
+    """
+    Pipeline stage splitting the regulation into windows of parent and child chunks, which go through the next stages
+    one by one. An update ends with a part deleting the chunks missing from the new version. The regulation is marked as
+    done, or failed, once all of its parts are indexed.
+    """
+    def complete_regulation(failed_count):
+        if failed_count > 0:
+            mark_regulation(ledger, item, STATUS_FAILED, f"upload: {failed_count} chunks could not be indexed")
+            return
+        indexed_documents.add(item["metadata"]["title"], item["metadata"]["notified_date"])
+        catalog_sink.add(item["blob_name"], [make_catalog_entry(get_catalog_document(item["metadata"]), chunk_ids)])
+        mark_regulation(ledger, item, STATUS_DONE)
+        app_logger.info(f"Successfully ingested {item['blob_name']} ...\n{'-' * 50}")
+
+    txt_contents, pdf_files, json_contents = item.pop("contents")
+    pdf_pages = [(posixpath.basename(pdf_name), iter_pdf_pages(pdf_name, pdf_file))
+                 for pdf_name, pdf_file in pdf_files]
+    item["progress"] = DocumentProgress(complete_regulation)
+    if item["update"]:
+        indexed_chunks = fetch_document_chunks(item["metadata"]["title"], item["metadata"]["notified_date"])
+        indexed_hashes = {chunk["id"]: chunk["content_hash"] for chunk in indexed_chunks}
+        new_parent_ids = set()
+
+    chunk_ids = set()
+    part_count = 0
+    for parent_child_chunks_list in iter_regulation_windows(txt_contents, pdf_pages, json_contents,
+                                                            source_key=get_regulation_key(item["metadata"])):
+        window = dict(item, part_index=part_count, parent_child_chunks_list=parent_child_chunks_list)
+        for parent_id, chunks in (pair for group in parent_child_chunks_list for pair in group.items()):
+            chunk_ids.update(chunk["id"] for chunk in chunks)
+            if item["update"]:
+                new_parent_ids.add(parent_id)
+        if item["update"]:
+            window["indexed_hashes"] = indexed_hashes
+        yield window
+        part_count += 1
+
+    if part_count == 0:
+        app_logger.info(f"Skipping {item['blob_name']} due to empty chunks.")
+        mark_regulation(ledger, item, STATUS_SKIPPED, "empty chunks")
+        return
+
+    if item["update"]:
+        # Only reached once every file is parsed, a parse failure fails the stage before the old chunks are deleted
+        deleted_ids = [chunk_id for chunk_id in indexed_hashes if chunk_id not in chunk_ids]
+        deleted_parent_ids = list({chunk["parent_id"] for chunk in indexed_chunks} - new_parent_ids)
+        app_logger.info(f"Update of {item['metadata']['title']}: {len(deleted_ids)} deleted chunks.")
+        yield dict(item, part_index=part_count, parent_child_chunks_list=[], indexed_hashes={},
+                   deleted_ids=deleted_ids, deleted_parent_ids=deleted_parent_ids)
+        part_count += 1
+
+    app_logger.info(f"{item['blob_name']} is split into {part_count} parts.")
+    item["progress"].set_part_count(part_count)
+
+
+def embed_regulation_stage(item, ledger):
+    """
+    Pipeline stage generating the embeddings of the chunks of a window of the regulation. A replaced version of
+    an indexed regulation only embeds its new or changed chunks. If any chunk could not be embedded, the stage
+    fails and the whole regulation is marked as failed, so that it is processed again by the next run.
+    """
+    if item["update"]:
+        item["chunks"] = update_regulation(item["metadata"], item.pop("parent_child_chunks_list"),
+                                           item.pop("indexed_hashes"))
+        return item
+
+    item["chunks"] = embed_regulation(item["metadata"], item.pop("parent_child_chunks_list"))
+    if not item["chunks"]:
+        app_logger.info(f"Skipping {item['blob_name']} due to missing chunks.")
+        item["progress"].fail()
+        mark_regulation(ledger, item, STATUS_FAILED, "no chunk could be embedded")
+        return None
+    return item
+
+
+def ingest_regulation_stage(item, sink, parent_sink, chunk_dump=None):
+    """
+    Pipeline stage queuing the embedded chunks of a window of the regulation in the ingestion sinks. The progress
+    of the regulation is updated once all chunks of the window are indexed or failed.
+    """
+    ingest_regulation(f"{item['blob_name']}#{item['part_index']}", item.pop("chunks"), sink, parent_sink,
+                      item["progress"].complete_part, deleted_ids=item.pop("deleted_ids", ()),
+                      deleted_parent_ids=item.pop("deleted_parent_ids", ()), chunk_dump=chunk_dump)
+    return item
+
+
+def get_run_progress(pipeline, ledger, sink, started):
+    """
+    Summarizes the progress of an ingestion run: the blobs listed so far, the blobs done, skipped and failed in this
+    run, the throughput and the estimated time left. The estimate only covers the listed blobs until the listing of
+    the container is finished.
+
+    Args:
+        pipeline (Pipeline): The pipeline of the run.
+        ledger (IngestionLedger): The ingestion ledger of the container.
+        sink (IngestionSink): The chunk sink of the run.
+        started (float): The time.monotonic() value at the start of the run.
+
+    Returns:
+        progress (Dict): The progress of the run.
+    """
+    counts = ledger.session_status_counts()
+    done = counts.get(STATUS_DONE, 0)
+    skipped = counts.get(STATUS_SKIPPED, 0)
+    failed = counts.get(STATUS_FAILED, 0)
+    remaining = max(0, pipeline.listed - done - skipped - failed)
+    elapsed = time.monotonic() - started
+    blobs_per_minute = (done + skipped + failed) * 60 / elapsed if elapsed > 0 else 0.0
+    return {
+        "blobs_listed": pipeline.listed,
+        "listing_finished": pipeline.listing_finished,
+        "blobs_done": done,
+        "blobs_skipped": skipped,
+        "blobs_failed": failed,
+        "blobs_remaining": remaining,
+        "chunks_indexed": sink.stats()["succeeded"],
+        "blobs_per_minute": round(blobs_per_minute, 2),
+        "eta_seconds": round(remaining * 60 / blobs_per_minute) if blobs_per_minute > 0 else None
+    }
+
+
+def main(job=None):
+    """
+    Ingests every new or changed regulation of the storage container through the pipeline.
+
+    Args:
+        job (Job): Optional job running the ingestion. Its progress is tracked, and a cancelled job stops listing
+                   blobs and finishes the regulations already uploading; the others stay in progress in the
+                   ledger and are processed by the next run.
+
+    Returns:
+        stats (Dict): The counters of the pipeline, the sinks and the ledger.
+    """
+    started = time.monotonic()
     blob_service_client = BlobServiceClient.from_connection_string(BLOB_STORAGE_CONFIG['connection_string'])
     container_client = blob_service_client.get_container_client(container=BLOB_STORAGE_CONFIG['container_name'])
-    blobs = container_client.list_blobs()
-
-    create_index_if_not_exists()
-
-    # Initialize the index counter
-    index_counter = 0
-
-    for my_blob in blobs:
-        metadata = {}
-        txt_contents = []
-        pdf_contents = []
-        json_contents = []
-        with tempfile.TemporaryDirectory() as temp_dir:
-            if my_blob.name.endswith('.zip'):
-                keyword = my_blob.name.split('/')[1]
-                file_name_with_extension = my_blob.name.split('/')[-1]
-                file_name = file_name_with_extension.split('.')[0]
-                notified_date = file_name[:10]
-
-                try:
-                    datetime.strptime(notified_date, '%Y-%m-%d')
-                except ValueError:
-                    app_logger.error(f"Invalid date format in file name {file_name}. Skipping this zip file.")
-                    continue
-
-                app_logger.info(f"Downloading and extracting {my_blob.name} ...")
-                blob_client = blob_service_client.get_blob_client(container=BLOB_STORAGE_CONFIG['container_name'],
-                                                                  blob=my_blob.name)
-                zip_data = blob_client.download_blob().read()
-
-                zip_path = os.path.join(temp_dir, "my_compressed_zip.zip")
-                with open(zip_path, "wb") as fp:
-                    fp.write(zip_data)
-
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    zip_ref.extractall(temp_dir)
-
-                metadata = get_meta_data(temp_dir, website_name=None, file_name=file_name, keyword=keyword,
-                                         notified_date=notified_date)
-
-                if check_document_existence_by_title_and_date(metadata["title"].replace("'", "\'"),
-                                                              metadata["notified_date"]):
-                    app_logger.info("The document is already indexed!")
-                    # Increment and log the index counter
-                    index_counter += 1
-                    app_logger.info(f"Index Counter: {index_counter}")
-                    continue
-
-                txt_contents, pdf_contents, json_contents = extract_regulation_content(temp_dir)
-
-        # Chunk sayısını kontrol et ve fazla chunk'lı dosyaları bellekten serbest bırak
-        chunks = chunk_regulation(metadata, txt_contents, pdf_contents, json_contents)
-        if not chunks:
-            app_logger.info(f"Skipping {my_blob.name} due to excessive PDF chunk size.")
-            # Belleği serbest bırak
-            del chunks, txt_contents, pdf_contents, json_contents
-            gc.collect()
-            continue
+    ledger = IngestionLedger(LEDGER_PATH)
+
+    is_catalog_filled = create_index_if_not_exists(ledger)
+    indexed_documents = IndexedDocumentSet.from_index(from_catalog=is_catalog_filled)
+    sink = IngestionSink(COGNITIVE_SEARCH_CONFIG["index_name"], **SEARCH_UPLOAD_CONFIG)
+    parent_sink = IngestionSink(COGNITIVE_SEARCH_CONFIG["parent_index_name"], **SEARCH_UPLOAD_CONFIG)
+    catalog_sink = IngestionSink(COGNITIVE_SEARCH_CONFIG["catalog_index_name"], **SEARCH_UPLOAD_CONFIG)
+    chunk_dump = None
+    if CHUNK_DUMP_CONFIG["enabled"]:
+        chunk_dump = ChunkDumpSink(CHUNK_DUMP_CONFIG["directory"], CHUNK_DUMP_CONFIG["format"],
+                                   CHUNK_DUMP_CONFIG["max_file_size_mb"] * 1024 * 1024)
+
+    def mark_failed_regulation(stage_name, item, error):
+        if "progress" in item:
+            # The other windows of the regulation must not mark it as done
+            item["progress"].fail()
+        mark_regulation(ledger, item, STATUS_FAILED, f"{stage_name}: {str(error)}")
+
+    pipeline = Pipeline(
+        stages=[
+            Stage("download", partial(download_regulation, blob_service_client=blob_service_client, ledger=ledger,
+                                      indexed_documents=indexed_documents),
+                  workers=PIPELINE_CONFIG['download_workers']),
+            Stage("parse", parse_regulation, workers=PIPELINE_CONFIG['parse_workers']),
+            Stage("chunk", partial(split_regulation_stage, ledger=ledger, indexed_documents=indexed_documents,
+                                   catalog_sink=catalog_sink),
+                  workers=PIPELINE_CONFIG['chunk_workers']),
+            Stage("embed", partial(embed_regulation_stage, ledger=ledger), workers=PIPELINE_CONFIG['embed_workers']),
+            Stage("upload", partial(ingest_regulation_stage, sink=sink, parent_sink=parent_sink,
+                                    chunk_dump=chunk_dump),
+                  workers=PIPELINE_CONFIG['upload_workers']),
+        ],
+        queue_size=PIPELINE_CONFIG['queue_size'],
+        on_error=mark_failed_regulation,
+        cancel_event=job.cancel_event if job is not None else None
+    )
+    if job is not None:
+        job.track(partial(get_run_progress, pipeline, ledger, sink, started))
+    try:
+        stats = pipeline.run(list_regulation_blobs(container_client, ledger))
+        # The last batches are uploaded, and their regulations marked as done, when the sink is flushed
+        sink.flush()
+        parent_sink.flush()
+        # The catalog rows are queued once the regulations are indexed
+        catalog_sink.flush()
+        stats["search"] = sink.stats()
+        stats["parent_search"] = parent_sink.stats()
+        stats["catalog"] = catalog_sink.stats()
+        stats["ledger"] = ledger.status_counts()
+        if embedding_cache is not None:
+            stats["embedding_cache"] = embedding_cache.stats()
+        if chunk_dump is not None:
+            chunk_dump.close()
+            stats["chunk_dump"] = chunk_dump.stats()
+        stats["cancelled"] = pipeline.cancelled
+    finally:
+        sink.close()
+        parent_sink.close()
+        catalog_sink.close()
+        if chunk_dump is not None:
+            chunk_dump.close()
+        ledger.close()
+    app_logger.info(f"Pipeline finished: {stats}")
+    return stats
+
+
+def snapshot_index(page_size=500, job=None):
+    """
+    Fills the vector snapshot from the search indexes, for the regulations indexed before the snapshot was enabled.
+    Chunks indexed before the parent index was introduced are split into a child and a parent document, like the
+    new uploads.
+
+    Args:
+        page_size (int): The number of chunks read from the index per page.
+        job (Job): Optional job running the snapshot, which stops between pages once it is cancelled.
 
-        ingest_regulation(chunks)
-        app_logger.info(f"Successfully ingested {my_blob.name} ...\n{'-' * 50}")
+    Returns:
+        stats (Dict): The number of chunks and parents in the snapshot.
+    """
+    if vector_snapshot is None:
+        raise RuntimeError("The vector snapshot is disabled.")
+
+    for chunks in iter_index_chunks(page_size):
+        if job is not None and job.cancel_event.is_set():
+            break
+        child_chunks, parent_documents = split_parent_documents(attach_parent_chunks(chunks))
+        vector_snapshot.put_many("parents", [parent for parent in parent_documents if parent["parent_chunk"]])
+        vector_snapshot.put_many("chunks", child_chunks)
 
-        # Her ingestion sonrası bellek temizliği
-        del chunks, txt_contents, pdf_contents, json_contents
-        gc.collect()
+    stats = {"chunks": vector_snapshot.count("chunks"), "parents": vector_snapshot.count("parents")}
+    app_logger.info(f"Vector snapshot is filled from the search index: {stats}")
+    return stats
 
-        index_counter += 1
-        app_logger.info(f"Index Counter: {index_counter}")
+
+def rebuild_index(batch_size=1000, job=None, recreate=False):
+    """
+    Rebuilds the chunk and parent indexes from the vector snapshot, without embedding any chunk again. By default the
+    live indexes are updated in place and the documents missing from the snapshot are deleted; recreate deletes the
+    indexes first, so searches miss documents until the upload is finished.
+
+    Args:
+        batch_size (int): The number of documents read from the snapshot and queued at once.
+        job (Job): Optional job running the rebuild, which stops both indexes between batches once it is
+                   cancelled. No stale document is deleted then.
+        recreate (bool): Whether to delete and recreate the indexes instead of updating them in place.
+
+    Returns:
+        stats (Dict): The upload counters of the chunk and parent indexes, and the number of stale documents
+                      deleted from each.
+    """
+    if vector_snapshot is None:
+        raise RuntimeError("The vector snapshot is disabled.")
+    if vector_snapshot.count("chunks") == 0:
+        raise RuntimeError("The vector snapshot is empty, the search index is not rebuilt.")
+
+    if recreate:
+        # The search service has no index alias to swap a freshly built index in
+        app_logger.warning("The search indexes are deleted, searches miss documents until the rebuild is finished.")
+        if does_index_exists():
+            delete_index()
+        create_index()
+    elif not does_index_exists():
+        create_index()
+    else:
+        add_missing_index_fields()
+    create_parent_index()
+
+    sink = IngestionSink(COGNITIVE_SEARCH_CONFIG["index_name"], **SEARCH_UPLOAD_CONFIG)
+    parent_sink = IngestionSink(COGNITIVE_SEARCH_CONFIG["parent_index_name"], **SEARCH_UPLOAD_CONFIG)
+    tables = (("parents", COGNITIVE_SEARCH_CONFIG["parent_index_name"], parent_sink, parent_fields),
+              ("chunks", COGNITIVE_SEARCH_CONFIG["index_name"], sink, index_fields))
+    is_cancelled = False
+    stale_counts = {"parents": 0, "chunks": 0}
+    try:
+        for table, _, table_sink, schema_fields in tables:
+            field_names = {field.name for field in schema_fields}
+            for batch_index, documents in enumerate(vector_snapshot.iter_batches(table, batch_size)):
+                if job is not None and job.cancel_event.is_set():
+                    is_cancelled = True
+                    break
+                table_sink.add(f"{table}#{batch_index}",
+                               [{key: value for key, value in document.items() if key in field_names}
+                                for document in documents])
+            if is_cancelled:
+                break
+        sink.flush()
+        parent_sink.flush()
+
+        if not is_cancelled and not recreate:
+            # The documents deleted from the snapshot, e.g. by a run without it, are not in a rebuilt index either
+            for table, index_name, table_sink, _ in tables:
+                for page_index, ids in enumerate(iter_index_ids(index_name)):
+                    stale_ids = vector_snapshot.missing_ids(table, ids)
+                    if stale_ids:
+                        table_sink.add(f"{table}#stale#{page_index}", [], deleted_keys=stale_ids)
+                        stale_counts[table] += len(stale_ids)
+            sink.flush()
+            parent_sink.flush()
+        stats = {"search": sink.stats(), "parent_search": parent_sink.stats(), "stale_deleted": stale_counts,
+                 "cancelled": is_cancelled}
+    finally:
+        sink.close()
+        parent_sink.close()
+    app_logger.info(f"Search index is rebuilt from the vector snapshot: {stats}")
+    return stats
 
 
 app = FastAPI()
+job_manager = JobManager()
 
-@app.post("/process-site/")
-def process_site():
+
+@app.on_event("startup")
+def startup():
+    """
+    Loads the tokenizer, so that the service does not start without it instead of failing on the first document.
+    """
+    get_tokenizer()
+
+
+@app.on_event("shutdown")
+def shutdown():
+    """
+    Releases the worker processes and the connection pools of the service.
+    """
+    job_manager.shutdown()
+    shutdown_pdf_process_pool()
+    close_openai_clients()
+    close_search_clients()
+    close_embedding_cache()
+    if vector_snapshot is not None:
+        vector_snapshot.close()
+
+
+def submit_job(name, func, message):
     """
-    Process all blobs in the storage container without filtering by website name.
+    Starts a job in the background and returns its id, or rejects it if another job is running.
     """
     try:
-        # Tüm blobları işleyen main fonksiyonunu çağırıyoruz
-        main()
-        return {"message": "Processing started for all blobs in the container"}
-    except Exception as e:
-        # Hata olursa bir exception fırlatıyoruz
-        raise HTTPException(status_code=500, detail=str(e))
+        job = job_manager.submit(name, func)
+    except JobConflictError as e:
+        raise HTTPException(status_code=409, detail={"message": str(e), "job_id": e.job.id})
+    return {"message": message, "job_id": job.id}
+
+
+@app.post("/process-site/", status_code=202)
+def process_site():
+    """
+    Start processing all blobs in the storage container in the background. Blobs finished in a previous run are
+    skipped by the ingestion ledger, so an interrupted or cancelled run resumes where it stopped. The progress is
+    reported by /jobs/{job_id}.
+    """
+    return submit_job("process-site", main, "Processing started for all blobs in the container")
+
+
+@app.post("/snapshot-index/", status_code=202)
+def snapshot_index_endpoint():
+    """
+    Start filling the vector snapshot from the search indexes, for the regulations indexed before it was enabled.
+    """
+    return submit_job("snapshot-index", lambda job: snapshot_index(job=job),
+                      "Filling the vector snapshot from the search index started")
+
+
+@app.post("/rebuild-index/", status_code=202)
+def rebuild_index_endpoint(recreate: bool = False):
+    """
+    Start rebuilding the search indexes from the vector snapshot, without embedding the chunks again. The indexes
+    are updated in place; with recreate=true they are deleted first, and searches miss documents until the
+    rebuild is finished.
+    """
+    return submit_job("rebuild-index", lambda job: rebuild_index(job=job, recreate=recreate),
+                      "Rebuilding the search index from the vector snapshot started")
+
+
+@app.post("/backfill-catalog/", status_code=202)
+def backfill_catalog_endpoint():
+    """
+    Start filling the document catalog from the search index, for the regulations indexed before it was introduced.
+    """
+    return submit_job("backfill-catalog", lambda job: backfill_catalog(job=job),
+                      "Filling the document catalog started")
+
+
+@app.get("/cache-stats/")
+def cache_stats():
+    """
+    Report the hit ratios and sizes of the embedding cache and of the query embedding cache.
+    """
+    return {"embedding_cache": embedding_cache.stats() if embedding_cache is not None else None,
+            "query_embedding_cache": query_embedding_cache.stats() if query_embedding_cache is not None else None}
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """
+    Report the status, progress and result of a job.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} is not found")
+    return job.to_dict()
+
+
+@app.post("/jobs/{job_id}/cancel")
+def cancel_job(job_id: str):
+    """
+    Cancel a running job. The job stops after the work in flight is finished.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} is not found")
+    job.cancel()
+    return job.to_dict()
+
 
 if __name__ == "__main__":
     import uvicorn
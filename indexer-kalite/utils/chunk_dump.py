@@ -0,0 +1,163 @@
+import importlib.util
+import json
+import os
+import queue
+import threading
+from datetime import datetime
+
+from config import app_logger
+
+_STOP = object()
+
+# The columns of the Parquet files, the vectors are stored as float32 lists
+PARQUET_COLUMNS = ["document_id", "id", "parent_id", "title", "date", "website", "keyword", "notified_country",
+                   "url", "content_hash", "parent_chunk", "chunk"]
+
+
+class ChunkDumpSink:
+    """
+    Appends the ingested chunks of a run to its own JSONL or Parquet files, written by a background thread through a
+    bounded queue. A new file is started once the current one exceeds max_file_size_bytes; without pyarrow, Parquet
+    falls back to JSONL.
+
+    Args:
+        directory (str): The directory of the dump files.
+        file_format (str): The format of the files, "jsonl" or "parquet".
+        max_file_size_bytes (int): The size after which a new file is started.
+        queue_size (int): The maximum number of documents waiting to be written.
+        row_group_size (int): The number of chunks per row group of the Parquet files.
+    """
+
+    def __init__(self, directory, file_format="jsonl", max_file_size_bytes=256 * 1024 * 1024, queue_size=64,
+                 row_group_size=1024):
+        if file_format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+            app_logger.error("pyarrow is not installed, the chunks are dumped as JSONL instead of Parquet.")
+            file_format = "jsonl"
+        if file_format not in ("jsonl", "parquet"):
+            raise ValueError(f"Unknown chunk dump format: {file_format}")
+
+        self.directory = directory
+        self.file_format = file_format
+        self.max_file_size_bytes = max_file_size_bytes
+        self.row_group_size = max(1, int(row_group_size))
+        self._run_name = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self._queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._file = None
+        self._file_path = None
+        self._file_index = 0
+        self._rows = []
+        self.documents = 0
+        self.chunks = 0
+        self.files = 0
+        self.failed = 0
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="chunk-dump", daemon=True)
+        self._thread.start()
+
+    def add(self, document_id, chunks):
+        """
+        Queues the chunks of a document to be written.
+
+        Args:
+            document_id (str): The identifier of the document, e.g. its blob name.
+            chunks (List[Dict]): The chunks of the document.
+
+        Returns:
+            N/A
+        """
+        self._queue.put((document_id, chunks))
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is _STOP:
+                break
+            document_id, chunks = entry
+            try:
+                self._write(document_id, chunks)
+                self.documents += 1
+                self.chunks += len(chunks)
+            except Exception as e:
+                self.failed += 1
+                app_logger.error(f"Chunks of {document_id} could not be dumped: {str(e)}")
+        try:
+            self._close_file()
+        except Exception as e:
+            app_logger.error(f"Chunk dump {self._file_path} could not be closed: {str(e)}")
+
+    def _open_file(self):
+        self._file_index += 1
+        self._file_path = os.path.join(self.directory,
+                                       f"chunks-{self._run_name}-{self._file_index:04d}.{self.file_format}")
+        if self.file_format == "jsonl":
+            self._file = open(self._file_path, "a", encoding="utf-8")
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            schema = pa.schema([(column, pa.string()) for column in PARQUET_COLUMNS]
+                               + [("chunk_vector", pa.list_(pa.float32()))])
+            self._file = pq.ParquetWriter(self._file_path, schema, compression="zstd")
+        self.files += 1
+        app_logger.info(f"Dumping chunks to {self._file_path}.")
+
+    def _close_file(self):
+        if self._file is None:
+            return
+        if self.file_format == "parquet":
+            self._write_row_group()
+        self._file.close()
+        self._file = None
+
+    def _write(self, document_id, chunks):
+        if self._file is None:
+            self._open_file()
+
+        if self.file_format == "jsonl":
+            self._file.write("".join(json.dumps(dict(chunk, document_id=document_id), ensure_ascii=False) + "\n"
+                                     for chunk in chunks))
+            self._file.flush()
+        else:
+            self._rows.extend(dict(chunk, document_id=document_id) for chunk in chunks)
+            if len(self._rows) >= self.row_group_size:
+                self._write_row_group()
+
+        if os.path.getsize(self._file_path) >= self.max_file_size_bytes:
+            self._close_file()
+
+    def _write_row_group(self):
+        if not self._rows:
+            return
+        import pyarrow as pa
+
+        columns = {column: [None if row.get(column) is None else str(row[column]) for row in self._rows]
+                   for column in PARQUET_COLUMNS}
+        columns["chunk_vector"] = [row.get("chunk_vector") for row in self._rows]
+        self._file.write_table(pa.Table.from_pydict(columns, schema=self._file.schema))
+        self._rows = []
+
+    def close(self):
+        """
+        Writes the queued chunks and closes the current file.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+        """
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def stats(self):
+        """
+        Returns the counters of the sink.
+
+        Args:
+            N/A
+
+        Returns:
+            Dict: The number of dumped documents and chunks, of written files and of failed documents.
+        """
+        return {"documents": self.documents, "chunks": self.chunks, "files": self.files, "failed": self.failed}
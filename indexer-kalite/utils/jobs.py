@@ -0,0 +1,205 @@
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from config import app_logger
+
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_CANCELLING = "cancelling"
+JOB_CANCELLED = "cancelled"
+
+
+class JobConflictError(RuntimeError):
+    """
+    Raised when a job is submitted while another job is still running.
+    """
+
+    def __init__(self, job):
+        super().__init__(f"Job {job.id} ({job.name}) is still running.")
+        self.job = job
+
+
+class Job:
+    """
+    A long running task, e.g. the ingestion of the storage container, run in a background thread. The task gets the
+    job, so that it can register a progress callback with track() and stop early once cancel_event is set.
+
+    Args:
+        name (str): The name of the task, e.g. "process-site".
+        func (Callable): The task, called with the job, whose return value is the result of the job.
+    """
+
+    def __init__(self, name, func):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.func = func
+        self.status = JOB_RUNNING
+        self.result = None
+        self.error = None
+        self.started_at = datetime.now(timezone.utc)
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        # Guards the status, so that a cancel racing with the end of the task cannot overwrite the final status
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._finished = None
+        self._progress = None
+        self._final_progress = None
+        self._thread = threading.Thread(target=self._run, name=f"job-{self.id}", daemon=True)
+
+    def _run(self):
+        status = JOB_FAILED
+        try:
+            self.result = self.func(self)
+            status = JOB_SUCCEEDED
+        except Exception as e:
+            self.error = str(e)
+            app_logger.error(f"Job {self.id} ({self.name}) failed: {str(e)}")
+        finally:
+            # The progress is kept as it was at the end, the task may close what its callback reads
+            final_progress = self._read_progress()
+            with self._lock:
+                if status == JOB_SUCCEEDED and self.cancel_event.is_set():
+                    status = JOB_CANCELLED
+                self.status = status
+                self._final_progress = final_progress
+                self._finished = time.monotonic()
+                self.finished_at = datetime.now(timezone.utc)
+        app_logger.info(f"Job {self.id} ({self.name}) is {self.status}.")
+
+    @property
+    def is_running(self):
+        return self._finished is None
+
+    def track(self, progress):
+        """
+        Registers the progress callback of the job.
+
+        Args:
+            progress (Callable): Called without arguments, returns the progress of the task as a dict.
+
+        Returns:
+            N/A
+        """
+        self._progress = progress
+
+    def cancel(self):
+        """
+        Asks the task to stop, the job is cancelled once the task returns.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+        """
+        with self._lock:
+            if self.is_running:
+                self.cancel_event.set()
+                self.status = JOB_CANCELLING
+
+    def _read_progress(self):
+        if self._progress is None:
+            return None
+        try:
+            return self._progress()
+        except Exception as e:
+            app_logger.error(f"Progress of job {self.id} could not be read: {str(e)}")
+            return None
+
+    def to_dict(self):
+        """
+        Returns the status of the job.
+
+        Args:
+            N/A
+
+        Returns:
+            Dict: The id, name and status of the job, its start and end times, and its progress, result or error.
+        """
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "elapsed_seconds": round((self._finished or time.monotonic()) - self._started, 1),
+            "progress": self._read_progress() if self.is_running else self._final_progress,
+            "result": self.result,
+            "error": self.error
+        }
+
+
+class JobManager:
+    """
+    Runs jobs in background threads, one at a time, so that two requests never process the same container or
+    rebuild the index concurrently. The last max_finished_jobs finished jobs are kept for their status.
+
+    Args:
+        max_finished_jobs (int): The number of finished jobs kept.
+    """
+
+    def __init__(self, max_finished_jobs=20):
+        self.max_finished_jobs = max_finished_jobs
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._active_job = None
+
+    def submit(self, name, func):
+        """
+        Starts a job, unless another job is running.
+
+        Args:
+            name (str): The name of the task.
+            func (Callable): The task, called with the job.
+
+        Returns:
+            Job: The started job.
+
+        Raises:
+            JobConflictError: If another job is running.
+        """
+        with self._lock:
+            if self._active_job is not None and self._active_job.is_running:
+                raise JobConflictError(self._active_job)
+            job = Job(name, func)
+            self._jobs[job.id] = job
+            self._active_job = job
+            finished_jobs = [job_id for job_id, other in self._jobs.items() if not other.is_running]
+            for job_id in finished_jobs[:max(0, len(finished_jobs) - self.max_finished_jobs)]:
+                del self._jobs[job_id]
+        job._thread.start()
+        app_logger.info(f"Job {job.id} ({name}) is started.")
+        return job
+
+    def get(self, job_id):
+        """
+        Looks up a job by its id.
+
+        Args:
+            job_id (str): The id of the job.
+
+        Returns:
+            Job or None: The job, None if it is unknown.
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self, timeout=60):
+        """
+        Cancels the running job and waits up to timeout seconds for it to stop.
+
+        Args:
+            timeout (float): The maximum number of seconds to wait.
+
+        Returns:
+            N/A
+        """
+        with self._lock:
+            job = self._active_job
+        if job is not None and job.is_running:
+            job.cancel()
+            job._thread.join(timeout)
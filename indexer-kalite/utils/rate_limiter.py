@@ -0,0 +1,207 @@
+import asyncio
+import random
+import threading
+import time
+
+import openai
+
+from config import app_logger
+
+# Errors worth retrying, the SDK retries are disabled so that every attempt passes through the limiter
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class RateLimiter:
+    """
+    A client-side token bucket limiter of the requests and tokens per minute of one Azure OpenAI deployment. The buckets
+    follow the x-ratelimit-remaining headers of the responses, and a 429 response blocks all callers for its Retry-After
+    delay.
+
+    Args:
+        name (str): The name of the deployment, used in logs.
+        requests_per_minute (int): The request quota of the deployment.
+        tokens_per_minute (int): The token quota of the deployment.
+        max_retries (int): How many times a rate limited or failed request is retried.
+    """
+
+    def __init__(self, name, requests_per_minute, tokens_per_minute, max_retries=6):
+        self.name = name
+        self.requests_per_minute = max(1, int(requests_per_minute))
+        self.tokens_per_minute = max(1, int(tokens_per_minute))
+        self.max_retries = max(0, int(max_retries))
+        self._available_requests = float(self.requests_per_minute)
+        self._available_tokens = float(self.tokens_per_minute)
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self.throttled_count = 0
+
+    def _refill(self, now):
+        elapsed = now - self._updated_at
+        self._available_requests = min(self.requests_per_minute,
+                                       self._available_requests + elapsed * self.requests_per_minute / 60)
+        self._available_tokens = min(self.tokens_per_minute,
+                                     self._available_tokens + elapsed * self.tokens_per_minute / 60)
+        self._updated_at = now
+
+    def _reserve(self, token_count):
+        # Returns 0 if the request is admitted, otherwise the number of seconds to wait before trying again
+        # A request larger than the whole token quota is admitted once the bucket is full
+        token_count = min(token_count, self.tokens_per_minute)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if now < self._blocked_until:
+                return self._blocked_until - now
+            if self._available_requests >= 1 and self._available_tokens >= token_count:
+                self._available_requests -= 1
+                self._available_tokens -= token_count
+                return 0
+            request_wait = (1 - self._available_requests) * 60 / self.requests_per_minute
+            token_wait = (token_count - self._available_tokens) * 60 / self.tokens_per_minute
+            return max(request_wait, token_wait, 0.01)
+
+    def acquire(self, token_count):
+        """
+        Blocks the calling thread until a request of token_count tokens fits into the quota.
+
+        Args:
+            token_count (int): The number of tokens the request is expected to consume.
+
+        Returns:
+            N/A
+        """
+        while (wait := self._reserve(token_count)) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, token_count):
+        """
+        Asynchronous version of acquire, waiting without blocking the event loop.
+
+        Args:
+            token_count (int): The number of tokens the request is expected to consume.
+
+        Returns:
+            N/A
+        """
+        while (wait := self._reserve(token_count)) > 0:
+            await asyncio.sleep(wait)
+
+    def update_from_headers(self, headers):
+        """
+        Lowers the buckets to the remaining quota reported by Azure OpenAI in the response headers.
+
+        Args:
+            headers (Mapping[str, str]): The headers of a response.
+
+        Returns:
+            N/A
+        """
+        remaining_requests = _parse_float(headers.get("x-ratelimit-remaining-requests"))
+        remaining_tokens = _parse_float(headers.get("x-ratelimit-remaining-tokens"))
+        with self._lock:
+            self._refill(time.monotonic())
+            if remaining_requests is not None:
+                self._available_requests = min(self._available_requests, remaining_requests)
+            if remaining_tokens is not None:
+                self._available_tokens = min(self._available_tokens, remaining_tokens)
+
+    def block(self, seconds):
+        """
+        Stops admitting requests for the given number of seconds, e.g. the Retry-After delay of a 429 response.
+
+        Args:
+            seconds (float): How long to wait before the next request.
+
+        Returns:
+            N/A
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._available_requests = 0
+            self._available_tokens = 0
+            self._updated_at = time.monotonic()
+
+    def _handle_error(self, error, attempt):
+        # Returns the number of seconds to wait before the next attempt, or raises when out of retries
+        if attempt >= self.max_retries:
+            raise error
+        if isinstance(error, openai.RateLimitError):
+            self.throttled_count += 1
+            delay = get_retry_after(error.response.headers)
+            if delay is None:
+                delay = min(60, 2 ** attempt)
+            self.block(delay)
+            app_logger.info(f"(OpenAI/{self.name}): Rate limited, retrying in {delay:.1f}s "
+                            f"(attempt {attempt + 1}/{self.max_retries}).")
+            return 0
+        delay = min(30, 2 ** attempt) * (0.5 + random.random() / 2)
+        app_logger.info(f"(OpenAI/{self.name}): Request failed, retrying in {delay:.1f}s "
+                        f"(attempt {attempt + 1}/{self.max_retries}): {error}")
+        return delay
+
+    def call(self, token_count, request):
+        """
+        Calls request once the quota allows it, retrying rate limited and transient failures.
+
+        Args:
+            token_count (int): The number of tokens the request is expected to consume.
+            request (Callable): Sends the request and returns the raw response, e.g.
+                                client.embeddings.with_raw_response.create with its arguments bound.
+
+        Returns:
+            The parsed response.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.acquire(token_count)
+            try:
+                raw_response = request()
+            except RETRYABLE_ERRORS as e:
+                time.sleep(self._handle_error(e, attempt))
+                continue
+            self.update_from_headers(raw_response.headers)
+            return raw_response.parse()
+
+    async def call_async(self, token_count, request):
+        """
+        Asynchronous version of call, request returns an awaitable of the raw response.
+
+        Args:
+            token_count (int): The number of tokens the request is expected to consume.
+            request (Callable): Sends the request and returns an awaitable of the raw response.
+
+        Returns:
+            The parsed response.
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.acquire_async(token_count)
+            try:
+                raw_response = await request()
+            except RETRYABLE_ERRORS as e:
+                await asyncio.sleep(self._handle_error(e, attempt))
+                continue
+            self.update_from_headers(raw_response.headers)
+            return raw_response.parse()
+
+
+def get_retry_after(headers):
+    """
+    Reads the delay requested by a 429 response, from the retry-after-ms or retry-after header.
+
+    Args:
+        headers (Mapping[str, str]): The headers of the response.
+
+    Returns:
+        float or None: The delay in seconds, None if the response has no usable header.
+    """
+    retry_after_ms = _parse_float(headers.get("retry-after-ms"))
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    return _parse_float(headers.get("retry-after"))
+
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
@@ -1,3 +1,8 @@
+import asyncio
+import hashlib
+import threading
+import time
+
 from azure.search.documents.indexes.models import (
     SearchableField,
     SearchField,
@@ -10,10 +15,13 @@ from azure.search.documents.indexes.models import (
 )
 from azure.search.documents.models import VectorizedQuery
 from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient, SearchIndexingBufferedSender
+from azure.core.exceptions import ResourceNotFoundError
+from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
 from azure.search.documents.indexes import SearchIndexClient
-from config import EMBEDDING_DIMENSION, COGNITIVE_SEARCH_CONFIG
-from utils.utils import get_embedding
+from config import EMBEDDING_DIMENSION, COGNITIVE_SEARCH_CONFIG, LEDGER_PATH
+from utils.ledger import read_marker, MARKER_CATALOG_BACKFILLED
+from utils.utils import get_query_embeddings_async, make_chunk_id, rerank_contexts
 from config import app_logger
 
 
@@ -29,18 +37,43 @@ fields = [
                     sortable=True),
     SearchableField(name="chunk", type=SearchFieldDataType.String, filterable=True, searchable=True),
     SearchableField(name="parent_chunk", type=SearchFieldDataType.String, searchable=False),
+    SimpleField(name="content_hash", type=SearchFieldDataType.String, filterable=True),
     SearchField(name="chunk_vector", type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
                 searchable=True, vector_search_dimensions=EMBEDDING_DIMENSION,
                 vector_search_profile_name="default_vector_search_profile"),
 ]
 
+# The parent chunks, referenced by the parent_id of their child chunks
+parent_fields = [
+    SimpleField(name="id", type=SearchFieldDataType.String, key=True, filterable=True),
+    SimpleField(name="title", type=SearchFieldDataType.String, filterable=True),
+    SimpleField(name="date", type=SearchFieldDataType.DateTimeOffset, filterable=True, sortable=True),
+    SimpleField(name="parent_chunk", type=SearchFieldDataType.String),
+]
 
-def does_index_exists():
+# The catalog of the indexed documents, one row per document instead of one per chunk
+catalog_fields = [
+    SimpleField(name="id", type=SearchFieldDataType.String, key=True, filterable=True, sortable=True),
+    SimpleField(name="title", type=SearchFieldDataType.String, filterable=True, sortable=True),
+    SimpleField(name="date", type=SearchFieldDataType.DateTimeOffset, filterable=True, sortable=True),
+    SimpleField(name="website", type=SearchFieldDataType.String, filterable=True, sortable=True),
+    SimpleField(name="keyword", type=SearchFieldDataType.String, filterable=True, sortable=True, facetable=True),
+    SimpleField(name="notified_country", type=SearchFieldDataType.String, filterable=True, sortable=True),
+    SimpleField(name="url", type=SearchFieldDataType.String),
+    SimpleField(name="chunk_count", type=SearchFieldDataType.Int32, filterable=True, sortable=True),
+    SimpleField(name="content_hash", type=SearchFieldDataType.String, filterable=True),
+]
+
+# The chunk fields copied to the catalog row of their document
+CATALOG_METADATA_FIELDS = ["title", "date", "website", "keyword", "notified_country", "url"]
+
+
+def does_index_exists(index_name=None):
     """
     Checks if a specific index exists in the search index client.
 
     Args:
-        N/A
+        index_name (str): The name of the index, defaults to the chunk index.
 
     Returns:
         bool: True if the index exists, False otherwise.
@@ -49,7 +82,7 @@ def does_index_exists():
                                      credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
     index_names = list(index_client.list_index_names())
     index_client.close()
-    return COGNITIVE_SEARCH_CONFIG["index_name"] in index_names
+    return (index_name or COGNITIVE_SEARCH_CONFIG["index_name"]) in index_names
 
 
 def create_index():
@@ -88,9 +121,396 @@ def create_index():
         index_client.close()
 
 
+def add_missing_index_fields():
+    """
+    Adds the fields of the schema that an existing search index does not have yet, e.g. after the schema is extended.
+    Existing fields cannot be changed, new fields are added in place.
+
+    Args:
+        N/A
+
+    Returns:
+        N/A
+    """
+    index_client = SearchIndexClient(endpoint=COGNITIVE_SEARCH_CONFIG["endpoint"],
+                                     credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
+    search_index = index_client.get_index(COGNITIVE_SEARCH_CONFIG["index_name"])
+    existing_field_names = {field.name for field in search_index.fields}
+    missing_fields = [field for field in fields if field.name not in existing_field_names]
+    if missing_fields:
+        search_index.fields.extend(missing_fields)
+        index_client.create_or_update_index(search_index)
+        app_logger.info(f"Search Index is updated with the fields {[field.name for field in missing_fields]}.")
+    index_client.close()
+
+
+def create_parent_index():
+    """
+    Creates the index of the parent chunks if it does not already exist.
+
+    Args:
+        N/A
+
+    Returns:
+        N/A
+    """
+    if not does_index_exists(COGNITIVE_SEARCH_CONFIG["parent_index_name"]):
+        index_client = SearchIndexClient(endpoint=COGNITIVE_SEARCH_CONFIG["endpoint"],
+                                         credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
+        index_client.create_index(SearchIndex(name=COGNITIVE_SEARCH_CONFIG["parent_index_name"],
+                                              fields=parent_fields))
+        app_logger.info("Parent Search Index is created successfully!")
+        index_client.close()
+
+
+def split_parent_documents(chunks):
+    """
+    Moves the parent chunk texts out of the child chunks, so that every parent text is uploaded and stored once
+    in the parent index instead of in each of its children.
+
+    Args:
+        chunks (List[Dict]): The chunks of a document, each holding its 'parent_id' and 'parent_chunk'.
+
+    Returns:
+        child_chunks (List[Dict]): The chunks without their 'parent_chunk'.
+        parent_documents (List[Dict]): One document per parent, keyed by the parent_id.
+    """
+    child_chunks = []
+    parent_documents = {}
+    for chunk in chunks:
+        if chunk["parent_id"] not in parent_documents:
+            parent_documents[chunk["parent_id"]] = {
+                "id": chunk["parent_id"],
+                "title": chunk.get("title"),
+                "date": chunk.get("date"),
+                "parent_chunk": chunk["parent_chunk"]
+            }
+        child_chunks.append({key: value for key, value in chunk.items() if key != "parent_chunk"})
+    return child_chunks, list(parent_documents.values())
+
+
+def fetch_parent_chunks(parent_ids):
+    """
+    Fetches the texts of the given parents from the parent index.
+
+    Args:
+        parent_ids (List[str]): The ids of the parents.
+
+    Returns:
+        parent_chunks (Dict[str, str]): The parent texts by their id, missing parents are left out.
+    """
+    parent_ids = list(dict.fromkeys(parent_ids))
+    if not parent_ids:
+        return {}
+
+    search_client = SearchClient(endpoint=COGNITIVE_SEARCH_CONFIG["endpoint"],
+                                 index_name=COGNITIVE_SEARCH_CONFIG["parent_index_name"],
+                                 credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
+    try:
+        results = search_client.search(
+            search_text="*",
+            filter="search.in(id, '{}', ',')".format(",".join(parent_ids)),
+            select=["id", "parent_chunk"],
+            top=len(parent_ids)
+        )
+        return {result["id"]: result["parent_chunk"] for result in results}
+    except ResourceNotFoundError:
+        app_logger.info("Parent Search Index does not exist, only the stored parent chunks are used.")
+        return {}
+    finally:
+        search_client.close()
+
+
+class SearchClientPool:
+    """
+    Keeps one long-lived asynchronous SearchClient per index on a background event loop shared by all threads, so that
+    queries reuse its connections. The coroutines using the clients are run on that loop, with run() or run_async().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._clients = {}
+
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="search-clients", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    def get_client(self, index_name):
+        """
+        Returns the shared client of an index, creating it on first use. Must be called on the loop of the pool.
+
+        Args:
+            index_name (str): The name of the search index.
+
+        Returns:
+            AsyncSearchClient: The client of the index.
+        """
+        search_client = self._clients.get(index_name)
+        if search_client is None:
+            search_client = AsyncSearchClient(endpoint=COGNITIVE_SEARCH_CONFIG["endpoint"],
+                                              index_name=index_name,
+                                              credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
+            self._clients[index_name] = search_client
+        return search_client
+
+    def run(self, coroutine):
+        """
+        Runs a coroutine on the loop of the pool, blocking the calling thread until it is done.
+
+        Args:
+            coroutine (Coroutine): The coroutine using the clients of the pool.
+
+        Returns:
+            The result of the coroutine.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self._get_loop()).result()
+
+    async def run_async(self, coroutine):
+        """
+        Runs a coroutine on the loop of the pool and waits for it from the calling event loop.
+
+        Args:
+            coroutine (Coroutine): The coroutine using the clients of the pool.
+
+        Returns:
+            The result of the coroutine.
+        """
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, self._get_loop()))
+
+    async def _close_clients(self):
+        for search_client in self._clients.values():
+            await search_client.close()
+        self._clients.clear()
+
+    def close(self):
+        """
+        Closes the clients and stops the event loop of the pool. It is started again on the next query.
+
+        Args:
+            N/A
+
+        Returns:
+            N/A
+        """
+        with self._lock:
+            if self._loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._close_clients(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._loop = None
+
+
+search_clients = SearchClientPool()
+
+
+def close_search_clients():
+    """
+    Closes the pooled search clients, called on service shutdown.
+    """
+    search_clients.close()
+
+
+async def fetch_parent_chunks_async(parent_ids):
+    """
+    Asynchronous version of fetch_parent_chunks using the pooled client of the parent index. Must be run on the
+    loop of the search client pool.
+
+    Args:
+        parent_ids (List[str]): The ids of the parents.
+
+    Returns:
+        parent_chunks (Dict[str, str]): The parent texts by their id, missing parents are left out.
+    """
+    parent_ids = list(dict.fromkeys(parent_ids))
+    if not parent_ids:
+        return {}
+
+    search_client = search_clients.get_client(COGNITIVE_SEARCH_CONFIG["parent_index_name"])
+    try:
+        results = await search_client.search(
+            search_text="*",
+            filter="search.in(id, '{}', ',')".format(",".join(parent_ids)),
+            select=["id", "parent_chunk"],
+            top=len(parent_ids)
+        )
+        return {result["id"]: result["parent_chunk"] async for result in results}
+    except ResourceNotFoundError:
+        app_logger.info("Parent Search Index does not exist, only the stored parent chunks are used.")
+        return {}
+
+
+async def attach_parent_chunks_async(contexts):
+    """
+    Asynchronous version of attach_parent_chunks. Must be run on the loop of the search client pool.
+
+    Args:
+        contexts (List[Dict]): The retrieved contexts, each holding its 'parent_id'.
+
+    Returns:
+        contexts (List[Dict]): The same contexts with their 'parent_chunk' set.
+    """
+    parent_chunks = await fetch_parent_chunks_async([context["parent_id"] for context in contexts
+                                                     if not context.get("parent_chunk")])
+    for context in contexts:
+        if not context.get("parent_chunk"):
+            context["parent_chunk"] = parent_chunks.get(context["parent_id"], "")
+    return contexts
+
+
+def attach_parent_chunks(contexts):
+    """
+    Fills the 'parent_chunk' of the retrieved contexts from the parent index. Chunks indexed before the parent
+    index was introduced still hold their own parent_chunk, which is kept.
+
+    Args:
+        contexts (List[Dict]): The retrieved contexts, each holding its 'parent_id'.
+
+    Returns:
+        contexts (List[Dict]): The same contexts with their 'parent_chunk' set.
+    """
+    parent_chunks = fetch_parent_chunks([context["parent_id"] for context in contexts
+                                         if not context.get("parent_chunk")])
+    for context in contexts:
+        if not context.get("parent_chunk"):
+            context["parent_chunk"] = parent_chunks.get(context["parent_id"], "")
+    return contexts
+
+
+def create_catalog_index():
+    """
+    Creates the index of the document catalog if it does not already exist.
+
+    Args:
+        N/A
+
+    Returns:
+        bool: True if the index is created, False if it already existed.
+    """
+    if does_index_exists(COGNITIVE_SEARCH_CONFIG["catalog_index_name"]):
+        return False
+    index_client = SearchIndexClient(endpoint=COGNITIVE_SEARCH_CONFIG["endpoint"],
+                                     credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
+    index_client.create_index(SearchIndex(name=COGNITIVE_SEARCH_CONFIG["catalog_index_name"],
+                                          fields=catalog_fields))
+    app_logger.info("Catalog Search Index is created successfully!")
+    index_client.close()
+    return True
+
+
+def catalog_key(title, date):
+    """
+    Builds the key of the catalog row of a document from its title and date, see document_key.
+
+    Args:
+        title (str): The title of the document.
+        date (str): The date of the document.
+
+    Returns:
+        str: The key of the catalog row.
+    """
+    return make_chunk_id(*document_key(title, date))
+
+
+def _chunk_id_value(chunk_id):
+    return int(hashlib.sha256(chunk_id.encode("utf-8")).hexdigest(), 16)
+
+
+def chunk_set_hash(chunk_ids):
+    """
+    Hashes the chunk ids of a document regardless of their order, so that the hash built while a document is
+    ingested equals the one built from its chunks in the index. The chunk ids depend on the chunk texts, so the
+    hash changes with the content of the document.
+
+    Args:
+        chunk_ids (Iterable[str]): The ids of the chunks of the document.
+
+    Returns:
+        str: The hex hash of the chunk ids.
+    """
+    return format(sum(_chunk_id_value(chunk_id) for chunk_id in set(chunk_ids)) % (1 << 256), "064x")
+
+
+def make_catalog_entry(document, chunk_ids):
+    """
+    Builds the catalog row of a document.
+
+    Args:
+        document (Dict): The fields of CATALOG_METADATA_FIELDS of the document, as in its chunks.
+        chunk_ids (Iterable[str]): The ids of the chunks of the document.
+
+    Returns:
+        entry (Dict): The catalog row.
+    """
+    chunk_ids = set(chunk_ids)
+    entry = {field: document.get(field) for field in CATALOG_METADATA_FIELDS}
+    entry.update(id=catalog_key(document["title"], document["date"]), chunk_count=len(chunk_ids),
+                 content_hash=chunk_set_hash(chunk_ids))
+    return entry
+
+
+def fetch_catalog_entries_from_chunks(page_size=1000, cancel_event=None):
+    """
+    Builds the catalog rows of every document from the chunk index, paging through it once by id, e.g. to fill a
+    new catalog.
+
+    Args:
+        page_size (int): The number of chunks requested per page.
+        cancel_event (threading.Event): Optional event, once it is set no further page is requested.
+
+    Returns:
+        entries (List[Dict]): The catalog rows of the indexed documents, None if the paging is cancelled.
+    """
+    search_client = SearchClient(endpoint=COGNITIVE_SEARCH_CONFIG["endpoint"],
+                                 index_name=COGNITIVE_SEARCH_CONFIG["index_name"],
+                                 credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
+    entries = {}
+    hash_values = {}
+    last_id = None
+    try:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                app_logger.info("Building the catalog entries from the search index is cancelled.")
+                return None
+            page = list(search_client.search(
+                search_text="*",
+                filter="id gt '{}'".format(last_id.replace("'", "''")) if last_id is not None else None,
+                order_by=["id asc"],
+                select=["id"] + CATALOG_METADATA_FIELDS,
+                top=page_size
+            ))
+            for chunk in page:
+                key = catalog_key(chunk["title"], chunk["date"])
+                if key not in entries:
+                    entries[key] = dict({field: chunk.get(field) for field in CATALOG_METADATA_FIELDS},
+                                        id=key, chunk_count=0)
+                    hash_values[key] = 0
+                entries[key]["chunk_count"] += 1
+                # The same sum as chunk_set_hash, without holding every chunk id of the index
+                hash_values[key] += _chunk_id_value(chunk["id"])
+            if len(page) < page_size:
+                break
+            last_id = page[-1]["id"]
+    finally:
+        search_client.close()
+
+    for key, entry in entries.items():
+        entry["content_hash"] = format(hash_values[key] % (1 << 256), "064x")
+    app_logger.info(f"{len(entries)} catalog entries are built from the search index.")
+    return list(entries.values())
+
+
 def check_document_existence_by_title_and_date(title, date):
     """
-    Check if a document with the given title and date exists in the search index.
+    Check if a document with the given title and date exists in the search index, by looking up its catalog row.
+    Without a catalog index, the chunks of the document are looked up instead.
 
     Args:
         title (str): The title of the document to check.
@@ -99,6 +519,17 @@ def check_document_existence_by_title_and_date(title, date):
     Returns:
         bool: True if the document exists, False otherwise.
     """
+    catalog_client = SearchClient(endpoint=COGNITIVE_SEARCH_CONFIG["endpoint"],
+                                  index_name=COGNITIVE_SEARCH_CONFIG["catalog_index_name"],
+                                  credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
+    try:
+        return sum(1 for _ in catalog_client.search(filter="id eq '{}'".format(catalog_key(title, date)),
+                                                    select=["id"], top=1)) > 0
+    except ResourceNotFoundError:
+        app_logger.info("Catalog Search Index does not exist, the chunk index is searched instead.")
+    finally:
+        catalog_client.close()
+
     search_client = SearchClient(endpoint=COGNITIVE_SEARCH_CONFIG["endpoint"],
                                  index_name=COGNITIVE_SEARCH_CONFIG["index_name"],
                                  credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
@@ -107,25 +538,228 @@ def check_document_existence_by_title_and_date(title, date):
     title = title.replace("'", "''")  
     search_results = search_client.search(filter="title eq '{}' and date eq {}".format(title, date),
                                           select=["id"], top=1)
-    return sum(1 for _ in search_results) > 0
+    exists = sum(1 for _ in search_results) > 0
+    search_client.close()
+    return exists
 
 
-def ingest_chunks(chunks):
+def fetch_indexed_documents(page_size=1000, from_catalog=True):
     """
-    Ingests chunks of data into a search index. Prints a success message upon chunks indexing.
+    Pages through the document catalog once, selecting only the title and date of the documents. The rows are
+    paged by their sortable id instead of skip, as skip is limited by the service. While the catalog is not filled
+    yet, the chunk index is paged through instead.
 
     Args:
-        chunks (List) : A list of data chunks to be ingested.
+        page_size (int): The number of documents, or chunks, requested per page.
+        from_catalog (bool): Whether the documents are read from the catalog or from the chunk index.
 
     Returns:
-        N/A
+        documents (Set[tuple]): The (title, date) keys of the indexed documents, see document_key.
     """
-    create_index()
-    with SearchIndexingBufferedSender(COGNITIVE_SEARCH_CONFIG["endpoint"],
-                                      COGNITIVE_SEARCH_CONFIG["index_name"],
-                                      AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"])) as batch_client:
-        batch_client.upload_documents(documents=chunks)
-    app_logger.info("The Chunks are indexed successfully!")
+    index_name = COGNITIVE_SEARCH_CONFIG["catalog_index_name" if from_catalog else "index_name"]
+    search_client = SearchClient(endpoint=COGNITIVE_SEARCH_CONFIG["endpoint"],
+                                 index_name=index_name,
+                                 credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
+    documents = set()
+    last_id = None
+    while True:
+        page = list(search_client.search(
+            search_text="*",
+            filter="id gt '{}'".format(last_id.replace("'", "''")) if last_id is not None else None,
+            order_by=["id asc"],
+            select=["id", "title", "date"],
+            top=page_size
+        ))
+        for entry in page:
+            documents.add(document_key(entry["title"], entry["date"]))
+        if len(page) < page_size:
+            break
+        last_id = page[-1]["id"]
+
+    search_client.close()
+    app_logger.info(f"{len(documents)} indexed documents are fetched from {index_name}.")
+    return documents
+
+
+def fetch_document_chunks(title, date, page_size=1000):
+    """
+    Fetches the id, parent id and content hash of every chunk of a document, paging by id.
+
+    Args:
+        title (str): The title of the document.
+        date (str): The date of the document in the OData V4 format.
+        page_size (int): The number of chunks requested per page.
+
+    Returns:
+        chunks (List[Dict]): The id, parent_id and content_hash of the chunks. The content_hash is None for the
+                             chunks indexed before it was introduced.
+    """
+    search_client = SearchClient(endpoint=COGNITIVE_SEARCH_CONFIG["endpoint"],
+                                 index_name=COGNITIVE_SEARCH_CONFIG["index_name"],
+                                 credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
+    document_filter = "title eq '{}' and date eq {}".format(title.replace("'", "''"), date)
+    chunks = []
+    last_id = None
+    while True:
+        page = list(search_client.search(
+            search_text="*",
+            filter=document_filter + (" and id gt '{}'".format(last_id.replace("'", "''")) if last_id else ""),
+            order_by=["id asc"],
+            select=["id", "parent_id", "content_hash"],
+            top=page_size
+        ))
+        chunks.extend({"id": chunk["id"], "parent_id": chunk["parent_id"], "content_hash": chunk.get("content_hash")}
+                      for chunk in page)
+        if len(page) < page_size:
+            break
+        last_id = page[-1]["id"]
+
+    search_client.close()
+    return chunks
+
+
+def fetch_chunk_vectors(chunk_ids, batch_size=100):
+    """
+    Fetches the stored embedding vectors of the given chunks, so that chunks whose text did not change are not
+    embedded again.
+
+    Args:
+        chunk_ids (List[str]): The ids of the chunks.
+        batch_size (int): The number of chunks requested per query.
+
+    Returns:
+        vectors (Dict[str, list]): The vectors by chunk id.
+    """
+    chunk_ids = list(dict.fromkeys(chunk_ids))
+    if not chunk_ids:
+        return {}
+
+    search_client = SearchClient(endpoint=COGNITIVE_SEARCH_CONFIG["endpoint"],
+                                 index_name=COGNITIVE_SEARCH_CONFIG["index_name"],
+                                 credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
+    vectors = {}
+    for start in range(0, len(chunk_ids), batch_size):
+        batch = chunk_ids[start:start + batch_size]
+        results = search_client.search(
+            search_text="*",
+            filter="search.in(id, '{}', ',')".format(",".join(batch)),
+            select=["id", "chunk_vector"],
+            top=len(batch)
+        )
+        vectors.update({result["id"]: result["chunk_vector"] for result in results if result.get("chunk_vector")})
+
+    search_client.close()
+    return vectors
+
+
+def iter_index_chunks(page_size=500):
+    """
+    Pages through the whole chunk index by id and yields its chunks with every retrievable field, including their
+    vectors, e.g. to fill the vector snapshot.
+
+    Args:
+        page_size (int): The number of chunks requested per page.
+
+    Yields:
+        chunks (List[Dict]): The chunks of the next page.
+    """
+    search_client = SearchClient(endpoint=COGNITIVE_SEARCH_CONFIG["endpoint"],
+                                 index_name=COGNITIVE_SEARCH_CONFIG["index_name"],
+                                 credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
+    last_id = None
+    try:
+        while True:
+            page = [{key: value for key, value in chunk.items() if not key.startswith("@search.")}
+                    for chunk in search_client.search(
+                        search_text="*",
+                        filter="id gt '{}'".format(last_id.replace("'", "''")) if last_id is not None else None,
+                        order_by=["id asc"],
+                        top=page_size
+                    )]
+            if page:
+                yield page
+            if len(page) < page_size:
+                break
+            last_id = page[-1]["id"]
+    finally:
+        search_client.close()
+
+
+def iter_index_ids(index_name, page_size=1000):
+    """
+    Pages through a whole index by id and yields the ids of its documents.
+
+    Args:
+        index_name (str): The name of the index.
+        page_size (int): The number of ids requested per page.
+
+    Yields:
+        ids (List[str]): The ids of the next page.
+    """
+    search_client = SearchClient(endpoint=COGNITIVE_SEARCH_CONFIG["endpoint"], index_name=index_name,
+                                 credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
+    last_id = None
+    try:
+        while True:
+            ids = [document["id"] for document in search_client.search(
+                search_text="*",
+                filter="id gt '{}'".format(last_id.replace("'", "''")) if last_id is not None else None,
+                order_by=["id asc"],
+                select=["id"],
+                top=page_size
+            )]
+            if ids:
+                yield ids
+            if len(ids) < page_size:
+                break
+            last_id = ids[-1]
+    finally:
+        search_client.close()
+
+
+def document_key(title, date):
+    """
+    Builds the key of a document from its title and date. Only the day of the date is kept, so that the
+    OData V4 dates of the metadata and the dates returned by the search index give the same key.
+
+    Args:
+        title (str): The title of the document.
+        date (str): The date of the document.
+
+    Returns:
+        tuple: The (title, day) key of the document.
+    """
+    return title, str(date)[:10]
+
+
+class IndexedDocumentSet:
+    """
+    A run-level, thread-safe set of the documents in the search index, used instead of one existence query per blob.
+    It is filled once from the index by from_index, and kept up to date by adding every ingested document.
+
+    Args:
+        documents (Iterable[tuple]): The initial (title, date) keys of the documents.
+    """
+
+    def __init__(self, documents=None):
+        self._documents = set(documents or ())
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_index(cls, from_catalog=True):
+        return cls(fetch_indexed_documents(from_catalog=from_catalog))
+
+    def contains(self, title, date):
+        with self._lock:
+            return document_key(title, date) in self._documents
+
+    def add(self, title, date):
+        with self._lock:
+            self._documents.add(document_key(title, date))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._documents)
 
 
 def delete_index():
@@ -141,34 +775,101 @@ def delete_index():
     index_client = SearchIndexClient(endpoint=COGNITIVE_SEARCH_CONFIG["endpoint"],
                                      credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
     index_client.delete_index(COGNITIVE_SEARCH_CONFIG["index_name"])
+    if COGNITIVE_SEARCH_CONFIG["parent_index_name"] in index_client.list_index_names():
+        index_client.delete_index(COGNITIVE_SEARCH_CONFIG["parent_index_name"])
     app_logger.info("Search Index is deleted successfully!")
     index_client.close()
 
 
-def search_in_index(query, filters=None, search_parameters=None,sorting=None, top_k=-1, top_k_contexts=6):
+# The number of seconds the marker of the filled document catalog is trusted before it is read again
+CATALOG_MARKER_TTL = 60
+_catalog_marker = {"is_set": False, "read_at": None}
+
+
+def is_catalog_backfilled():
     """
-    Searches related Chunks in the search index using Azure Cognitive Search.
+    Checks whether the document catalog holds every document of the chunk index, as recorded in the ingestion
+    ledger. The marker is read again at most every CATALOG_MARKER_TTL seconds.
 
     Args:
-        query (str): The search query string.
-        filters (dict): A dictionary of filters to apply to the search.
-        sorting (List[str]): Which fields, how to sort the results by.
-        top_k (int): The number of regulations to retrieve information from (default is -1 means all).
-        top_k_contexts (int): The number of top results to retrieve (default is 6).
+        N/A
 
     Returns:
-        contexts (List) : A list of contexts containing search results.
+        bool: True if the catalog is filled, False otherwise.
     """
-    search_client = SearchClient(endpoint=COGNITIVE_SEARCH_CONFIG["endpoint"],
-                                 index_name=COGNITIVE_SEARCH_CONFIG["index_name"],
-                                 credential=AzureKeyCredential(COGNITIVE_SEARCH_CONFIG["api_key"]))
-    vector = VectorizedQuery(
-        vector=get_embedding(query),
-        k_nearest_neighbors=top_k_contexts,
-        fields="chunk_vector",
-        exhaustive=True
-    )
-    
+    now = time.monotonic()
+    if _catalog_marker["read_at"] is None or now - _catalog_marker["read_at"] >= CATALOG_MARKER_TTL:
+        _catalog_marker["is_set"] = read_marker(LEDGER_PATH, MARKER_CATALOG_BACKFILLED)
+        _catalog_marker["read_at"] = now
+    return _catalog_marker["is_set"]
+
+
+async def fetch_latest_titles_async(search_client, top_k, filter_string=None, sorting=None, page_size=50):
+    """
+    Fetches the titles of the first top_k distinct documents in the given order, the newest ones by default. They are
+    read from the document catalog once it is filled, otherwise from the chunk index, leaving out the titles already
+    found in every request. Must be run on the loop of the search client pool.
+
+    Args:
+        search_client (AsyncSearchClient): The pooled client of the chunk index.
+        top_k (int): The number of documents.
+        filter_string (str): Optional filter of the documents, e.g. their date range.
+        sorting (List[str]): The order of the documents, defaults to the newest first.
+        page_size (int): The maximum number of chunks returned per request, and the minimum number of catalog rows.
+
+    Returns:
+        titles (List[str]): The distinct titles in the given order.
+    """
+    if is_catalog_backfilled():
+        catalog_client = search_clients.get_client(COGNITIVE_SEARCH_CONFIG["catalog_index_name"])
+        catalog_page_size = max(top_k, page_size)
+        try:
+            titles = {}
+            skip = 0
+            while len(titles) < top_k:
+                results = await catalog_client.search(
+                    search_text="*",
+                    select=["title"],
+                    filter=filter_string or None,
+                    # The id breaks the ties of the order, so that the pages do not overlap
+                    order_by=list(sorting or ["date desc"]) + ["id asc"],
+                    top=catalog_page_size,
+                    skip=skip or None
+                )
+                page = [result["title"] async for result in results]
+                for title in page:
+                    titles.setdefault(title)
+                    if len(titles) >= top_k:
+                        break
+                if len(page) < catalog_page_size:
+                    break
+                skip += len(page)
+            return list(titles)
+        except ResourceNotFoundError:
+            app_logger.info("Catalog Search Index does not exist, the chunk index is searched instead.")
+
+    titles = []
+    for _ in range(top_k):
+        filters = [f"({filter_string})"] if filter_string else []
+        filters += ["title ne '{}'".format(title.replace("'", "''")) for title in titles]
+        results = await search_client.search(
+            search_text="*",
+            select=["title"],
+            filter=" and ".join(filters) or None,
+            order_by=sorting or ["date desc"],
+            top=page_size
+        )
+        found_new_title = False
+        async for result in results:
+            if len(titles) < top_k and result["title"] not in titles:
+                titles.append(result["title"])
+                found_new_title = True
+        if not found_new_title or len(titles) >= top_k:
+            break
+    return titles
+
+
+def _get_filter_string(filters):
     filter_string = ""
     if filters:
         dates = []
@@ -177,65 +878,187 @@ def search_in_index(query, filters=None, search_parameters=None,sorting=None, to
         if filters.get("end_date"):
             dates.append("date le {}".format(filters["end_date"]))
         filter_string = " and ".join(dates)
+    return filter_string
+
 
+def _get_search_string(search_parameters):
     search_string = ''
     if search_parameters:
         for idx, parameter in enumerate(search_parameters):
             if idx >=1: search_string += ' OR '
             search_string +=  '"' + str(parameter) + '"' +'^4'
+    return search_string
 
-    if top_k != -1 and top_k > 0:
-        # Fetching top_k documents
-        titles_data = list(search_client.search(
-            select=["title", "date"],
-            filter=filter_string if filters else None,
-            order_by=sorting,
-        ))
-        if sorting:
-            reverse_sorting = True if "desc" in sorting[0] else False
-        else:
-            reverse_sorting = False 
-        sorted_titles_data = sorted(titles_data, key=lambda x: x["date"], reverse=reverse_sorting)
-
-        distinct_titles = []
-        for title_dict in sorted_titles_data:
-            if len(distinct_titles) < 3:
-                if title_dict["title"] not in distinct_titles:
-                    distinct_titles.append(title_dict["title"])
-            else:
-                break
 
-        filter_string_titles = " or ".join(["title eq '{}'".format(title) for title in distinct_titles])
+async def _search_contexts(search_client, query, embedding, filter_string, search_string, sorting, titles,
+                           top_k_contexts):
+    # Runs the search of one query, only inside the documents of the given titles if they are not None
+    vector_queries = None
+    if embedding is not None:
+        vector_queries = [VectorizedQuery(
+            vector=embedding,
+            k_nearest_neighbors=top_k_contexts,
+            fields="chunk_vector",
+            exhaustive=True
+        )]
+    else:
+        app_logger.error("The query could not be embedded, only the text search is used.")
+
+    if titles is not None:
+        filter_string_titles = " or ".join(["title eq '{}'".format(title.replace("'", "''")) for title in titles])
         if filter_string != "":
             filter_string_with_titles = f" {filter_string} and ({filter_string_titles})"
         else:
             filter_string_with_titles = filter_string_titles
         
         # Searching inside the top_k documents
-        contexts = list(search_client.search(
-            search_text=search_string if search_parameters else query,
+        results = await search_client.search(
+            search_text=search_string or query,
             search_fields=["title", "chunk"],
-            vector_queries=[vector],
+            vector_queries=vector_queries,
             filter=filter_string_with_titles,
             select=["parent_id", "parent_chunk", "title", "website", "keyword", "date"],
             top=top_k_contexts
-        ))
+        )
     else:
-        contexts = list(search_client.search(
-            search_text = search_string if search_parameters else query,
+        results = await search_client.search(
+            search_text = search_string or query,
             search_fields=["title", "chunk"],
-            vector_queries=[vector],
-            filter=filter_string if filters else None,
+            vector_queries=vector_queries,
+            filter=filter_string or None,
             select=["parent_id", "parent_chunk", "title", "website", "keyword", "date"],
             order_by=sorting,
             top=top_k_contexts
-        ))
+        )
+    return remove_duplicate_contexts([context async for context in results])
 
-    unique_contexts = remove_duplicate_contexts(contexts)
 
-    search_client.close()
+async def _search_in_index(queries, filters=None, search_parameters=None, sorting=None, top_k=-1, top_k_contexts=6):
+    # Must be run on the loop of the search client pool, which the clients are bound to
+    search_client = search_clients.get_client(COGNITIVE_SEARCH_CONFIG["index_name"])
+    filter_string = _get_filter_string(filters)
+    search_string = _get_search_string(search_parameters)
+
+    if top_k != -1 and top_k > 0:
+        # The queries are embedded in one batch while the titles of the top_k documents are fetched
+        embeddings, titles = await asyncio.gather(
+            get_query_embeddings_async(queries),
+            fetch_latest_titles_async(search_client, top_k, filter_string, sorting)
+        )
+        if not titles:
+            app_logger.info("No document matches the filters of the search.")
+            return []
+    else:
+        embeddings, titles = await get_query_embeddings_async(queries), None
+
+    rankings = await asyncio.gather(*[
+        _search_contexts(search_client, query, embedding, filter_string, search_string, sorting, titles,
+                         top_k_contexts)
+        for query, embedding in zip(queries, embeddings)
+    ])
+    if len(rankings) == 1:
+        contexts = rankings[0]
+    else:
+        contexts = rerank_contexts(rankings)[:top_k_contexts]
+        for ranking, context in enumerate(contexts, start=1):
+            context["ranking"] = ranking
+
+    unique_contexts = await attach_parent_chunks_async(contexts)
+
     app_logger.info("The Searching Process is done successfully!")
-    return unique_contexts    
+    return unique_contexts
+
+
+async def search_in_index_async(query, filters=None, search_parameters=None, sorting=None, top_k=-1,
+                                top_k_contexts=6):
+    """
+    Searches related Chunks in the search index using Azure Cognitive Search. The parent chunks of the results
+    are fetched from the parent index. The queries go through the pooled client of each index. When top_k is set,
+    only the top_k newest documents, or the first ones in the given sorting, are searched; the query is embedded
+    while their titles are fetched.
+
+    Args:
+        query (str): The search query string.
+        filters (dict): A dictionary of filters to apply to the search.
+        search_parameters (List[str]): Optional terms searched instead of the query text.
+        sorting (List[str]): Which fields, how to sort the results by.
+        top_k (int): The number of regulations to retrieve information from (default is -1 means all).
+        top_k_contexts (int): The number of top results to retrieve (default is 6).
+
+    Returns:
+        contexts (List) : A list of contexts containing search results.
+    """
+    return await search_clients.run_async(_search_in_index([query], filters, search_parameters, sorting, top_k,
+                                                           top_k_contexts))
+
+
+def search_in_index(query, filters=None, search_parameters=None,sorting=None, top_k=-1, top_k_contexts=6):
+    """
+    Synchronous wrapper of search_in_index_async, blocking the calling thread until the search is done.
+
+    Args:
+        query (str): The search query string.
+        filters (dict): A dictionary of filters to apply to the search.
+        search_parameters (List[str]): Optional terms searched instead of the query text.
+        sorting (List[str]): Which fields, how to sort the results by.
+        top_k (int): The number of regulations to retrieve information from (default is -1 means all).
+        top_k_contexts (int): The number of top results to retrieve (default is 6).
+
+    Returns:
+        contexts (List) : A list of contexts containing search results.
+    """
+    return search_clients.run(_search_in_index([query], filters, search_parameters, sorting, top_k,
+                                               top_k_contexts))
+
+
+async def multi_query_search_in_index_async(queries, filters=None, search_parameters=None, sorting=None, top_k=-1,
+                                            top_k_contexts=6):
+    """
+    Searches related Chunks for several phrasings of the same question, e.g. the paraphrased queries of the
+    feature extraction, and fuses their rankings with Reciprocal Rank Fusion. All queries are embedded in one
+    batch, the searches run concurrently, and the titles of the top_k documents and the parent chunks are fetched
+    once for all queries, so the latency is close to that of a single query.
+
+    Args:
+        queries (List[str]): The search queries.
+        filters (dict): A dictionary of filters to apply to the search.
+        search_parameters (List[str]): Optional terms searched instead of the query texts.
+        sorting (List[str]): Which fields, how to sort the results by.
+        top_k (int): The number of regulations to retrieve information from (default is -1 means all).
+        top_k_contexts (int): The number of top results to retrieve per query and after the fusion (default is 6).
+
+    Returns:
+        contexts (List) : The fused contexts, ranked from 1.
+    """
+    queries = [query for query in dict.fromkeys(queries) if query]
+    if not queries:
+        return []
+    return await search_clients.run_async(_search_in_index(queries, filters, search_parameters, sorting, top_k,
+                                                           top_k_contexts))
+
+
+def multi_query_search_in_index(queries, filters=None, search_parameters=None, sorting=None, top_k=-1,
+                                top_k_contexts=6):
+    """
+    Synchronous wrapper of multi_query_search_in_index_async, blocking the calling thread until the search is done.
+
+    Args:
+        queries (List[str]): The search queries.
+        filters (dict): A dictionary of filters to apply to the search.
+        search_parameters (List[str]): Optional terms searched instead of the query texts.
+        sorting (List[str]): Which fields, how to sort the results by.
+        top_k (int): The number of regulations to retrieve information from (default is -1 means all).
+        top_k_contexts (int): The number of top results to retrieve per query and after the fusion (default is 6).
+
+    Returns:
+        contexts (List) : The fused contexts, ranked from 1.
+    """
+    queries = [query for query in dict.fromkeys(queries) if query]
+    if not queries:
+        return []
+    return search_clients.run(_search_in_index(queries, filters, search_parameters, sorting, top_k,
+                                               top_k_contexts))
+
 
 def remove_duplicate_contexts(contexts: list) -> list: 
     
@@ -0,0 +1,142 @@
+import os
+import re
+import sys
+import tempfile
+
+import pytest
+
+# The settings are read from the environment when config is imported, the services are never called by the tests
+for name, value in {
+    "AUTHORIZATION_TOKEN": "test",
+    "COGNITIVE_SEARCH_API_KEY": "test",
+    "COGNITIVE_SEARCH_ENDPOINT": "https://test.search.windows.net",
+    "COGNITIVE_SEARCH_INDEX_NAME": "test-index",
+    "OPENAI_API_KEY": "test",
+    "OPENAI_API_BASE": "https://test.openai.azure.com",
+    "ADA_API_VERSION": "2024-02-01",
+    "ADA_MODEL": "text-embedding-ada-002",
+    "ADA_DEPLOYMENT_NAME": "ada",
+    "GPT_API_VERSION": "2024-02-01",
+    "GPT_MODEL": "gpt-4",
+    "GPT_DEPLOYMENT_NAME": "gpt",
+    "ADA_REQUESTS_PER_MINUTE": "720",
+    "ADA_TOKENS_PER_MINUTE": "120000",
+    "GPT_REQUESTS_PER_MINUTE": "480",
+    "GPT_TOKENS_PER_MINUTE": "80000",
+    "BLOB_STORAGE_CONNECTION_STRING": "DefaultEndpointsProtocol=https;AccountName=test;AccountKey=dGVzdA==;"
+                                      "EndpointSuffix=core.windows.net",
+    "BLOB_STORAGE_CONTAINER_NAME": "test",
+    "DATA_DIR": tempfile.mkdtemp(prefix="indexer-tests-"),
+    "EMBEDDING_CACHE_ENABLED": "false",
+    "VECTOR_SNAPSHOT_ENABLED": "false",
+}.items():
+    os.environ.setdefault(name, value)
+
+SERVICES = ("indexer-kalite", "indexer-hukuk", "indexer-cevre")
+
+
+def pytest_addoption(parser):
+    # The services share their modules, the tests run against one of them at a time
+    parser.addoption("--service", default=SERVICES[0], choices=SERVICES, help="The service whose modules are tested.")
+
+
+def pytest_configure(config):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.path.join(root, config.getoption("--service")))
+
+
+class WordTokenizer:
+    """
+    A stand-in for the tiktoken encoding with the same interface, whose tokens are words with their leading space,
+    punctuation and runs of whitespace, like the pre-tokens of cl100k_base. It needs no encoding file.
+    """
+
+    PATTERN = re.compile(r" ?[^\s\W]+| ?[^\s\w]+|\s+(?!\S)|\s+")
+
+    def __init__(self):
+        self._ids = {}
+        self._strings = []
+
+    def _token(self, string):
+        if string not in self._ids:
+            self._ids[string] = len(self._strings)
+            self._strings.append(string)
+        return self._ids[string]
+
+    def encode_ordinary(self, text):
+        return [self._token(match.group()) for match in self.PATTERN.finditer(text)]
+
+    def encode(self, text, disallowed_special=()):
+        return self.encode_ordinary(text)
+
+    def decode_tokens_bytes(self, tokens):
+        return [self._strings[token].encode("utf-8") for token in tokens]
+
+    def decode_with_offsets(self, tokens):
+        offsets = []
+        position = 0
+        for token in tokens:
+            offsets.append(position)
+            position += len(self._strings[token])
+        return "".join(self._strings[token] for token in tokens), offsets
+
+
+@pytest.fixture(scope="session")
+def model_tokenizer():
+    """
+    The tokenizer of the embedding model, the tests using it are skipped if its encoding is not available.
+    """
+    from utils.utils import get_tokenizer
+    try:
+        return get_tokenizer()
+    except RuntimeError as e:
+        pytest.skip(str(e))
+
+
+@pytest.fixture(params=["words", "cl100k_base"])
+def tokenizer(request):
+    """
+    The word tokenizer, and the tokenizer of the embedding model if its encoding is available.
+    """
+    if request.param == "words":
+        return WordTokenizer()
+    return request.getfixturevalue("model_tokenizer")
+
+
+@pytest.fixture
+def word_tokenizer(monkeypatch):
+    """
+    Makes the word tokenizer the tokenizer of the embedding model, for the tests splitting whole regulations.
+    """
+    import utils.utils as utils
+    tokenizer = WordTokenizer()
+    monkeypatch.setattr(utils, "_tokenizer", tokenizer)
+    return tokenizer
+
+
+class FakeClock:
+    """
+    A stand-in for the time module whose clock only moves when the test advances it or sleeps.
+    """
+
+    def __init__(self, now=1_700_000_000.0):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
@@ -0,0 +1,177 @@
+import asyncio
+import sqlite3
+from array import array
+
+import pytest
+
+import utils.embedding_cache as embedding_cache
+from utils.embedding_cache import EmbeddingCache, QueryEmbeddingCache
+
+ADA_CONFIG = {"deployment_name": "ada", "model": "text-embedding-ada-002"}
+# A vector of 4 float32 values takes 16 bytes
+VECTOR_SIZE = 16
+
+
+def vector(value):
+    return [value, value + 0.5, -value, 0.25]
+
+
+@pytest.fixture(autouse=True)
+def fake_clock(monkeypatch, clock):
+    monkeypatch.setattr(embedding_cache, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def disk_cache(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embedding_cache.db"), 4 * VECTOR_SIZE)
+    yield cache
+    cache.close()
+
+
+def test_keys_ignore_whitespace_but_not_the_deployment():
+    key = EmbeddingCache.make_key(ADA_CONFIG, "Article 1\n\n shall  apply")
+    assert key == EmbeddingCache.make_key(ADA_CONFIG, "Article 1 shall apply")
+    assert key != EmbeddingCache.make_key(ADA_CONFIG, "article 1 shall apply")
+    assert key != EmbeddingCache.make_key({**ADA_CONFIG, "deployment_name": "ada-2"}, "Article 1 shall apply")
+
+
+
+def test_query_keys_ignore_case():
+    assert QueryEmbeddingCache.make_key(ADA_CONFIG, "What is  the RoHS limit?") == \
+        QueryEmbeddingCache.make_key(ADA_CONFIG, "what is the rohs limit?")
+
+
+def test_query_keys_never_match_the_keys_of_ingested_texts():
+    assert QueryEmbeddingCache.make_key(ADA_CONFIG, "article 1 shall apply") != \
+        EmbeddingCache.make_key(ADA_CONFIG, "article 1 shall apply")
+
+
+def test_disk_cache_keeps_vectors_as_float32(disk_cache):
+    disk_cache.put("key", vector(1))
+    assert disk_cache.get("key") == vector(1)
+    assert disk_cache.get("other") is None
+    assert disk_cache.stats() == {"hits": 1, "misses": 1, "hit_ratio": 0.5, "evictions": 0,
+                                  "size_bytes": VECTOR_SIZE}
+
+
+def test_disk_cache_is_kept_on_restart(tmp_path):
+    cache_path = str(tmp_path / "embedding_cache.db")
+    cache = EmbeddingCache(cache_path, 100 * VECTOR_SIZE)
+    cache.put_many({"a": vector(1), "b": vector(2)})
+    cache.close()
+
+    cache = EmbeddingCache(cache_path, 100 * VECTOR_SIZE)
+    try:
+        assert cache.get_many(["a", "b"]) == {"a": vector(1), "b": vector(2)}
+        assert cache.stats()["size_bytes"] == 2 * VECTOR_SIZE
+    finally:
+        cache.close()
+
+
+def test_disk_cache_evicts_the_least_recently_used_vectors(disk_cache, fake_clock):
+    for key in "abcd":
+        disk_cache.put(key, vector(1))
+        fake_clock.advance(1)
+    # Reading a marks it as recently used, so b and c are the oldest
+    assert disk_cache.get("a") is not None
+    fake_clock.advance(1)
+
+    disk_cache.put("e", vector(5))
+    # The cache is trimmed to 90% of its maximum size
+    assert set(disk_cache.get_many(list("abcde"))) == {"a", "d", "e"}
+    assert disk_cache.stats()["evictions"] == 2
+    assert disk_cache.stats()["size_bytes"] == 3 * VECTOR_SIZE
+
+
+def test_replacing_a_vector_does_not_grow_the_disk_cache(disk_cache):
+    for _ in range(10):
+        disk_cache.put("a", vector(1))
+    assert disk_cache.stats()["size_bytes"] == VECTOR_SIZE
+    assert disk_cache.stats()["evictions"] == 0
+
+
+def test_a_disk_cache_without_storage_times_is_upgraded(tmp_path):
+    cache_path = str(tmp_path / "embedding_cache.db")
+    connection = sqlite3.connect(cache_path)
+    connection.execute("CREATE TABLE embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, size INTEGER NOT NULL, "
+                       "last_used REAL NOT NULL)")
+    connection.execute("INSERT INTO embeddings VALUES (?, ?, ?, ?)", ("a", array("f", vector(1)).tobytes(), 16, 1))
+    connection.commit()
+    connection.close()
+
+    cache = EmbeddingCache(cache_path, 100 * VECTOR_SIZE)
+    try:
+        assert cache.get_entries(["a"]) == {"a": (vector(1), 0)}
+        cache.put("b", vector(2))
+        assert cache.get_entries(["b"])["b"][1] > 0
+    finally:
+        cache.close()
+
+
+def test_the_hits_of_a_lookup_are_marked_as_used_in_one_transaction(disk_cache):
+    disk_cache.put_many({key: vector(1) for key in "abc"})
+    statements = []
+    disk_cache._connection.set_trace_callback(statements.append)
+    assert len(disk_cache.get_many(list("abcd"))) == 3
+    assert [statement.split()[0] for statement in statements if not statement.startswith("SELECT")] == \
+        ["BEGIN", "UPDATE", "UPDATE", "UPDATE", "COMMIT"]
+
+
+def test_query_vectors_expire_after_the_ttl(fake_clock):
+    cache = QueryEmbeddingCache(max_entries=10, max_size_bytes=10 * VECTOR_SIZE, ttl_seconds=60)
+    cache.put_many({"a": vector(1)})
+    fake_clock.advance(59)
+    assert cache.get_many(["a"]) == {"a": vector(1)}
+    fake_clock.advance(1)
+    assert cache.get_many(["a"]) == {}
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["expirations"], stats["entries"]) == (1, 1, 1, 0)
+    assert stats["size_bytes"] == 0
+
+
+def test_query_vectors_are_evicted_beyond_max_entries():
+    cache = QueryEmbeddingCache(max_entries=3, max_size_bytes=100 * VECTOR_SIZE, ttl_seconds=60)
+    cache.put_many({"a": vector(1), "b": vector(2), "c": vector(3)})
+    # Reading a marks it as recently used, so b is the oldest
+    cache.get_many(["a"])
+    cache.put_many({"d": vector(4)})
+    assert set(cache.get_many(list("abcd"))) == {"a", "c", "d"}
+    assert cache.stats()["evictions"] == 1
+
+
+def test_query_vectors_are_evicted_beyond_max_size():
+    cache = QueryEmbeddingCache(max_entries=100, max_size_bytes=2 * VECTOR_SIZE, ttl_seconds=60)
+    cache.put_many({"a": vector(1), "b": vector(2), "c": vector(3)})
+    assert set(cache.get_many(list("abc"))) == {"b", "c"}
+    assert cache.stats()["size_bytes"] == 2 * VECTOR_SIZE
+
+
+def query_cache(disk_cache):
+    return QueryEmbeddingCache(max_entries=10, max_size_bytes=10 * VECTOR_SIZE, ttl_seconds=60, disk_cache=disk_cache)
+
+
+def test_query_vectors_fall_back_to_the_disk_tier(disk_cache, fake_clock):
+    query_cache(disk_cache).put_many({"a": vector(1)})
+    fake_clock.advance(30)
+
+    # Another process finds the vector on disk, and keeps it in memory
+    cache = query_cache(disk_cache)
+    assert cache.get_many(["a", "b"]) == {"a": vector(1)}
+    assert asyncio.run(cache.get_many_async(["a"])) == {"a": vector(1)}
+    stats = cache.stats()
+    assert (stats["hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["hit_ratio"] == round(2 / 3, 4)
+
+
+def test_query_vectors_read_from_disk_expire_with_their_embedding_time(disk_cache, fake_clock):
+    query_cache(disk_cache).put_many({"a": vector(1)})
+    fake_clock.advance(30)
+    cache = query_cache(disk_cache)
+    assert cache.get_many(["a"]) == {"a": vector(1)}
+
+    fake_clock.advance(30)
+    assert cache.get_many(["a"]) == {}
+    # The disk tier has expired as well
+    assert query_cache(disk_cache).get_many(["a"]) == {}
+    assert cache.stats()["expirations"] == 2
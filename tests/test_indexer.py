@@ -0,0 +1,335 @@
+import contextlib
+import hashlib
+import io
+import json
+import threading
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+
+import indexer
+import utils.utils as utils
+from utils.ledger import IngestionLedger, STATUS_DONE, STATUS_FAILED, STATUS_SKIPPED
+from utils.search import IndexedDocumentSet, document_key
+from utils.utils import TokenChunker
+from utils.vector_snapshot import VectorSnapshot
+
+BLOB_NAME = "wto/kw/2023-02-01_Regulation.zip"
+WORDS = ["regulation", "article", "annex", "limit", "member", "state", "product", "label", "shall", "apply"]
+
+
+def make_paragraphs(count, seed=0):
+    return [" ".join(f"{WORDS[(seed + index * 7 + position) % len(WORDS)]}{index}-{position}"
+                     for position in range(12)) for index in range(count)]
+
+
+def make_zip(paragraphs, tables=(), pdf_pages=()):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        zip_file.writestr("metadata.json", json.dumps({"name": "Regulation", "notified_country": "TR", "URL": "u"}))
+        zip_file.writestr("content.txt", "\n\n".join(paragraphs))
+        for table_index, table in enumerate(tables):
+            zip_file.writestr(f"table_{table_index}.json", json.dumps(table))
+        if pdf_pages:
+            # The fake PDF parser reads the pages separated by form feeds
+            zip_file.writestr("annex.pdf", "\f".join(pdf_pages))
+    return buffer.getvalue()
+
+
+class FakeDownloader:
+
+    def __init__(self, data):
+        self.data = data
+
+    def readall(self):
+        return self.data
+
+    def readinto(self, stream):
+        stream.write(self.data)
+        return len(self.data)
+
+
+class FakeStorage:
+    """
+    A stand-in for the storage account and its container, holding the content of the blobs by name.
+    """
+
+    def __init__(self):
+        self.blobs = {}
+
+    def get_container_client(self, container):
+        return self
+
+    def get_blob_client(self, container, blob):
+        return SimpleNamespace(download_blob=lambda offset=None, length=None: FakeDownloader(
+            self.blobs[blob] if offset is None else self.blobs[blob][offset:offset + length]))
+
+    def list_blobs(self):
+        for name, data in self.blobs.items():
+            digest = hashlib.md5(data).digest()
+            yield SimpleNamespace(name=name, size=len(data), etag=f'"{digest.hex()}"',
+                                  content_settings=SimpleNamespace(content_md5=bytearray(digest)))
+
+
+class FakeSink:
+    """
+    A stand-in for IngestionSink writing the documents to the in-memory indexes, which completes the documents
+    once it is flushed.
+    """
+
+    indexes = {}
+
+    def __init__(self, index_name, **kwargs):
+        self.documents = FakeSink.indexes.setdefault(index_name, {})
+        self.pending = []
+        self.uploaded = 0
+        self.deleted = 0
+
+    def add(self, document_id, chunks, on_complete=None, deleted_keys=()):
+        for chunk in chunks:
+            self.documents[chunk["id"]] = chunk
+        for key in deleted_keys:
+            self.documents.pop(key, None)
+        self.uploaded += len(chunks)
+        self.deleted += len(deleted_keys)
+        if on_complete is not None:
+            self.pending.append(on_complete)
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        for on_complete in pending:
+            on_complete(0)
+
+    def stats(self):
+        return {"succeeded": self.uploaded, "deleted": self.deleted, "failed": 0}
+
+    def close(self):
+        self.flush()
+
+
+@pytest.fixture
+def storage(monkeypatch, tmp_path, word_tokenizer):
+    storage = FakeStorage()
+    monkeypatch.setattr(indexer, "BlobServiceClient", SimpleNamespace(from_connection_string=lambda _: storage))
+    monkeypatch.setattr(indexer, "LEDGER_PATH", str(tmp_path / "ingestion_ledger.db"))
+    monkeypatch.setattr(indexer, "create_index_if_not_exists", lambda ledger: True)
+    monkeypatch.setattr(FakeSink, "indexes", {})
+    monkeypatch.setattr(indexer, "IngestionSink", FakeSink)
+    monkeypatch.setattr(IndexedDocumentSet, "from_index", classmethod(lambda cls, from_catalog=True: cls(
+        {document_key(chunk["title"], chunk["date"]) for chunk in chunk_index().values()})))
+    monkeypatch.setattr(indexer, "fetch_document_chunks", lambda title, date: [
+        {"id": chunk["id"], "parent_id": chunk["parent_id"], "content_hash": chunk["content_hash"]}
+        for chunk in chunk_index().values() if (chunk["title"], chunk["date"]) == (title, date)])
+    monkeypatch.setattr(indexer, "fetch_chunk_vectors", lambda ids: {
+        chunk_id: chunk_index()[chunk_id]["chunk_vector"] for chunk_id in ids if chunk_id in chunk_index()})
+    # Small chunks, so that a regulation of a few paragraphs spans several parents and windows
+    monkeypatch.setattr(utils, "parent_chunker", TokenChunker(60, 0))
+    monkeypatch.setattr(utils, "child_chunker", TokenChunker(20, 0))
+    monkeypatch.setattr(indexer, "UPDATE_MODE", True)
+    return storage
+
+
+@pytest.fixture
+def fake_pdf(monkeypatch):
+    def parse_pdf_pages(pdf_file, start_page, end_page):
+        pages = pdf_file.decode("utf-8").split("\f")[start_page:end_page]
+        if "BROKEN" in pages:
+            raise ValueError("broken page")
+        return pages
+
+    monkeypatch.setitem(utils.PDF_PARSE_CONFIG, "workers", 1)
+    monkeypatch.setitem(utils.PDF_PARSE_CONFIG, "pages_per_task", 2)
+    monkeypatch.setattr(utils, "open_pdf", lambda pdf_file, pages=None: contextlib.nullcontext(
+        SimpleNamespace(pages=pdf_file.decode("utf-8").split("\f"))))
+    monkeypatch.setattr(utils, "parse_pdf_pages", parse_pdf_pages)
+
+
+@pytest.fixture
+def embedded_texts(monkeypatch):
+    texts = []
+
+    def embed_chunks(chunks):
+        texts.extend(chunk["chunk"] for chunk in chunks)
+        for chunk in chunks:
+            chunk["chunk_vector"] = [float(len(chunk["chunk"]))] * 4
+        return chunks
+
+    monkeypatch.setattr(indexer, "embed_chunks", embed_chunks)
+    return texts
+
+
+def chunk_index():
+    return FakeSink.indexes.get(indexer.COGNITIVE_SEARCH_CONFIG["index_name"], {})
+
+
+def parent_index():
+    return FakeSink.indexes.get(indexer.COGNITIVE_SEARCH_CONFIG["parent_index_name"], {})
+
+
+def ledger_counts():
+    ledger = IngestionLedger(indexer.LEDGER_PATH)
+    try:
+        return ledger.status_counts()
+    finally:
+        ledger.close()
+
+
+def fresh_chunks(paragraphs):
+    groups = indexer.split_regulation(["\n\n".join(paragraphs)], [], [], source_key="Regulation|2023-02-01")
+    return {chunk["id"]: chunk for group in groups for chunks in group.values() for chunk in chunks}
+
+
+def test_main_indexes_every_new_regulation(storage, embedded_texts):
+    paragraphs = make_paragraphs(30)
+    storage.blobs[BLOB_NAME] = make_zip(paragraphs, tables=[{"limit": "0.1%"}])
+
+    stats = indexer.main()
+    assert stats["listed"] == 1 and not stats["cancelled"]
+    assert ledger_counts() == {STATUS_DONE: 1}
+    # Every child chunk is embedded once, and every parent is stored once in the parent index
+    assert len(embedded_texts) == len(chunk_index())
+    assert {chunk["parent_id"] for chunk in chunk_index().values()} == set(parent_index())
+    assert {chunk["title"] for chunk in chunk_index().values()} == {"Regulation"}
+    assert any(chunk["chunk"].startswith("Table: ") for chunk in chunk_index().values())
+    assert len(FakeSink.indexes[indexer.COGNITIVE_SEARCH_CONFIG["catalog_index_name"]]) == 1
+
+
+def test_a_finished_regulation_is_not_processed_again(storage, embedded_texts):
+    storage.blobs[BLOB_NAME] = make_zip(make_paragraphs(10))
+    indexer.main()
+    embedded_count = len(embedded_texts)
+
+    stats = indexer.main()
+    assert stats["listed"] == 0
+    assert len(embedded_texts) == embedded_count
+
+
+def test_an_indexed_regulation_in_a_new_blob_is_skipped(storage, embedded_texts, monkeypatch):
+    monkeypatch.setattr(indexer, "UPDATE_MODE", False)
+    storage.blobs[BLOB_NAME] = make_zip(make_paragraphs(10))
+    indexer.main()
+    storage.blobs[BLOB_NAME] = make_zip(make_paragraphs(10, seed=3))
+    embedded_count = len(embedded_texts)
+
+    indexer.main()
+    assert ledger_counts() == {STATUS_DONE: 1, STATUS_SKIPPED: 1}
+    assert len(embedded_texts) == embedded_count
+
+
+def test_an_update_only_embeds_the_changed_chunks(storage, embedded_texts):
+    paragraphs = make_paragraphs(40)
+    storage.blobs[BLOB_NAME] = make_zip(paragraphs)
+    indexer.main()
+    embedded_texts.clear()
+
+    new_paragraphs = list(paragraphs)
+    new_paragraphs[20] = "changed " + new_paragraphs[20]
+    del new_paragraphs[30]
+    storage.blobs[BLOB_NAME] = make_zip(new_paragraphs)
+    indexer.main()
+
+    assert ledger_counts() == {STATUS_DONE: 2}
+    # The index holds the chunks of the new version only, as if it was indexed from scratch
+    expected_chunks = fresh_chunks(new_paragraphs)
+    assert set(chunk_index()) == set(expected_chunks)
+    assert {chunk["parent_id"] for chunk in chunk_index().values()} == set(parent_index())
+    assert all(chunk_index()[chunk_id]["chunk"] == chunk["chunk"] for chunk_id, chunk in expected_chunks.items())
+    # Only texts that were not indexed before are embedded again
+    assert 0 < len(embedded_texts) < len(expected_chunks)
+    assert any("changed" in text for text in embedded_texts)
+
+
+def test_a_regulation_failing_to_embed_is_marked_as_failed(storage, monkeypatch):
+    monkeypatch.setattr(indexer, "embed_chunks", lambda chunks: chunks[1:])
+    storage.blobs[BLOB_NAME] = make_zip(make_paragraphs(10))
+
+    indexer.main()
+    assert ledger_counts() == {STATUS_FAILED: 1}
+
+
+def test_a_partly_parsed_update_fails_without_deleting_chunks(storage, embedded_texts, fake_pdf):
+    paragraphs = make_paragraphs(10)
+    pages = ["\n\n".join(make_paragraphs(3, seed=page)) for page in range(6)]
+    storage.blobs[BLOB_NAME] = make_zip(paragraphs, pdf_pages=pages)
+    indexer.main()
+    indexed_chunks = dict(chunk_index())
+    indexed_parents = dict(parent_index())
+
+    storage.blobs[BLOB_NAME] = make_zip(paragraphs, pdf_pages=pages[:4] + ["BROKEN"] + pages[5:])
+    indexer.main()
+    assert ledger_counts() == {STATUS_DONE: 1, STATUS_FAILED: 1}
+    assert chunk_index() == indexed_chunks
+    assert parent_index() == indexed_parents
+
+
+def test_an_inserted_paragraph_keeps_the_ids_of_the_later_chunks(storage, embedded_texts, monkeypatch):
+    monkeypatch.setattr(utils, "parent_chunker", TokenChunker(200, 0, boundary_tokens=400))
+    paragraphs = make_paragraphs(80)
+    storage.blobs[BLOB_NAME] = make_zip(paragraphs)
+    indexer.main()
+    indexed_ids = set(chunk_index())
+    embedded_texts.clear()
+
+    storage.blobs[BLOB_NAME] = make_zip(paragraphs[:5] + make_paragraphs(1, seed=3) + paragraphs[5:])
+    indexer.main()
+    assert set(chunk_index()) == set(fresh_chunks(paragraphs[:5] + make_paragraphs(1, seed=3) + paragraphs[5:]))
+    # The parents re-synchronize at the next content-defined boundary after the insertion
+    assert len(indexed_ids & set(chunk_index())) > 0.75 * len(indexed_ids)
+    assert len(embedded_texts) < 0.25 * len(indexed_ids)
+
+
+@pytest.fixture
+def snapshot_index(monkeypatch, tmp_path):
+    snapshot = VectorSnapshot(str(tmp_path / "vector_snapshot.db"))
+    snapshot.put_many("parents", [{"id": f"p{index}", "parent_chunk": "text"} for index in range(3)])
+    snapshot.put_many("chunks", [{"id": f"c{index}", "chunk": "text", "chunk_vector": [0.5] * 4}
+                                 for index in range(5)])
+    deleted_indexes = []
+    monkeypatch.setattr(indexer, "vector_snapshot", snapshot)
+    monkeypatch.setattr(FakeSink, "indexes", {})
+    monkeypatch.setattr(indexer, "IngestionSink", FakeSink)
+    monkeypatch.setattr(indexer, "does_index_exists", lambda: True)
+    monkeypatch.setattr(indexer, "delete_index", lambda: deleted_indexes.append(True) or FakeSink.indexes.clear())
+    for name in ("create_index", "create_parent_index", "add_missing_index_fields"):
+        monkeypatch.setattr(indexer, name, lambda: None)
+    monkeypatch.setattr(indexer, "iter_index_ids", lambda index_name: iter([sorted(FakeSink.indexes[index_name])]))
+    yield deleted_indexes
+    snapshot.close()
+
+
+def test_rebuild_index_updates_the_live_indexes_in_place(snapshot_index):
+    FakeSink.indexes[indexer.COGNITIVE_SEARCH_CONFIG["index_name"]] = {"c0": {"id": "c0"}, "old": {"id": "old"}}
+    FakeSink.indexes[indexer.COGNITIVE_SEARCH_CONFIG["parent_index_name"]] = {"p-old": {"id": "p-old"}}
+
+    stats = indexer.rebuild_index(batch_size=2)
+    assert not snapshot_index
+    assert set(chunk_index()) == {f"c{index}" for index in range(5)}
+    assert set(parent_index()) == {f"p{index}" for index in range(3)}
+    assert chunk_index()["c0"]["chunk_vector"] == [0.5] * 4
+    assert stats["stale_deleted"] == {"parents": 1, "chunks": 1} and not stats["cancelled"]
+
+
+def test_rebuild_index_recreates_the_indexes_on_request(snapshot_index):
+    FakeSink.indexes[indexer.COGNITIVE_SEARCH_CONFIG["index_name"]] = {"old": {"id": "old"}}
+
+    indexer.rebuild_index(batch_size=2, recreate=True)
+    assert snapshot_index
+    assert set(chunk_index()) == {f"c{index}" for index in range(5)}
+
+
+def test_a_cancelled_rebuild_stops_both_indexes(snapshot_index, monkeypatch):
+    FakeSink.indexes[indexer.COGNITIVE_SEARCH_CONFIG["index_name"]] = {"old": {"id": "old"}}
+    job = SimpleNamespace(cancel_event=threading.Event())
+    add = FakeSink.add
+
+    def add_and_cancel(self, document_id, chunks, on_complete=None, deleted_keys=()):
+        add(self, document_id, chunks, on_complete, deleted_keys)
+        job.cancel_event.set()
+
+    monkeypatch.setattr(FakeSink, "add", add_and_cancel)
+    stats = indexer.rebuild_index(batch_size=2, job=job)
+    assert stats["cancelled"]
+    assert len(parent_index()) == 2
+    # No chunk batch is uploaded after the cancel, and the stale documents are kept
+    assert set(chunk_index()) == {"old"}
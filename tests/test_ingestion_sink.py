@@ -0,0 +1,222 @@
+import time
+
+import pytest
+
+import utils.ingestion_sink as ingestion_sink
+from utils.ingestion_sink import IngestionSink, DocumentProgress
+
+
+class FakeAction:
+
+    def __init__(self, chunk, action_type):
+        self.additional_properties = chunk
+        self.action_type = action_type
+
+
+class FakeSender:
+    """
+    A stand-in for SearchIndexingBufferedSender that keeps the queued actions until flushed. The chunks whose "doc"
+    is in failing_docs are reported as failed, and the ones in dropped_docs are dropped once without any callback,
+    like the chunks of a failed batch request.
+    """
+
+    failing_docs = set()
+    dropped_docs = set()
+    instances = []
+
+    def __init__(self, endpoint, index_name, credential, on_new, on_progress, on_error, **kwargs):
+        self.on_new = on_new
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.actions = []
+        self.sent = []
+        FakeSender.instances.append(self)
+
+    def _queue(self, chunks, action_type):
+        for chunk in chunks:
+            action = FakeAction(chunk, action_type)
+            self.on_new(action)
+            self.actions.append(action)
+
+    def merge_or_upload_documents(self, documents):
+        self._queue(documents, "mergeOrUpload")
+
+    def delete_documents(self, documents):
+        self._queue(documents, "delete")
+
+    def flush(self):
+        actions, self.actions = self.actions, []
+        for action in actions:
+            self.sent.append((action.action_type, dict(action.additional_properties)))
+            doc = action.additional_properties.get("doc")
+            if doc in FakeSender.dropped_docs:
+                FakeSender.dropped_docs.discard(doc)
+            elif doc in FakeSender.failing_docs:
+                self.on_error(action)
+            else:
+                self.on_progress(action)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def fake_sender(monkeypatch):
+    monkeypatch.setattr(FakeSender, "failing_docs", set())
+    monkeypatch.setattr(FakeSender, "dropped_docs", set())
+    monkeypatch.setattr(FakeSender, "instances", [])
+    monkeypatch.setattr(ingestion_sink, "SearchIndexingBufferedSender", FakeSender)
+    monkeypatch.setattr(ingestion_sink, "AzureKeyCredential", lambda api_key: None)
+    return FakeSender
+
+
+def make_chunks(doc, *keys):
+    return [{"id": key, "doc": doc} for key in keys]
+
+
+def test_documents_complete_with_their_failed_chunks(fake_sender):
+    fake_sender.failing_docs = {"B"}
+    completed = {}
+    sink = IngestionSink("test-index", upload_concurrency=2)
+    sink.add("a.zip", make_chunks("A", "1", "2"), lambda failed: completed.setdefault("a.zip", failed))
+    sink.add("b.zip", make_chunks("B", "3", "4"), lambda failed: completed.setdefault("b.zip", failed))
+    assert completed == {}
+    sink.close()
+    assert completed == {"a.zip": 0, "b.zip": 2}
+    assert sink.stats() == {"queued": 4, "succeeded": 2, "failed": 2, "requeued": 0, "pending_documents": 0}
+
+
+def test_documents_with_the_same_chunk_keys_complete_independently(fake_sender):
+    fake_sender.failing_docs = {"new"}
+    completed = {}
+    sink = IngestionSink("test-index", upload_concurrency=1)
+    sink.add("regulation.zip", make_chunks("old", "1", "2"), lambda failed: completed.setdefault("old", failed))
+    sink.add("regulation-v2.zip", make_chunks("new", "1", "2"), lambda failed: completed.setdefault("new", failed))
+    sink.flush()
+    assert completed == {"old": 0, "new": 2}
+
+
+def test_the_same_chunk_object_is_queued_for_every_document():
+    chunk = {"id": "1"}
+    completed = {}
+    sink = IngestionSink("test-index", upload_concurrency=1)
+    sink.add("a.zip", [chunk], lambda failed: completed.setdefault("a.zip", failed))
+    # A chunk given twice for the same document is indexed once
+    sink.add("b.zip", [chunk, chunk], lambda failed: completed.setdefault("b.zip", failed))
+    sink.flush()
+    assert completed == {"a.zip": 0, "b.zip": 0}
+    assert sink.stats()["succeeded"] == 2
+
+
+def test_removed_chunks_are_deleted(fake_sender):
+    completed = []
+    sink = IngestionSink("test-index", upload_concurrency=1)
+    sink.add("a.zip", make_chunks("A", "1"), completed.append, deleted_keys=["2", "3"])
+    sink.flush()
+    assert completed == [0]
+    assert fake_sender.instances[0].sent == [("mergeOrUpload", {"id": "1", "doc": "A"}),
+                                             ("delete", {"id": "2"}), ("delete", {"id": "3"})]
+
+
+def test_a_document_without_chunks_completes_at_once():
+    completed = []
+    sink = IngestionSink("test-index", upload_concurrency=1)
+    sink.add("empty.zip", [], completed.append)
+    assert completed == [0]
+
+
+def test_lost_chunks_are_queued_again(fake_sender):
+    fake_sender.dropped_docs = {"A"}
+    completed = []
+    sink = IngestionSink("test-index", upload_concurrency=1)
+    sink.add("a.zip", make_chunks("A", "1"), completed.append)
+    sink.flush()
+    assert completed == [0]
+    assert sink.stats()["requeued"] == 1
+    assert len(fake_sender.instances[0].sent) == 2
+
+
+def test_chunks_lost_too_often_fail(fake_sender):
+    class AlwaysDropped(set):
+        def discard(self, doc):
+            pass
+
+    fake_sender.dropped_docs = AlwaysDropped({"A"})
+    completed = []
+    sink = IngestionSink("test-index", upload_concurrency=1, max_retries_per_action=2)
+    sink.add("a.zip", make_chunks("A", "1"), completed.append)
+    sink.flush()
+    assert completed == [1]
+    assert sink.stats()["requeued"] == 2 and sink.stats()["failed"] == 1
+
+
+def test_a_failing_completion_callback_does_not_stop_the_sink():
+    def on_complete(failed):
+        raise RuntimeError("callback failed")
+
+    completed = []
+    sink = IngestionSink("test-index", upload_concurrency=1)
+    sink.add("a.zip", make_chunks("A", "1"), on_complete)
+    sink.add("b.zip", make_chunks("B", "2"), completed.append)
+    sink.flush()
+    assert completed == [0]
+
+
+def test_lost_chunks_are_queued_again_without_a_flush(fake_sender):
+    fake_sender.dropped_docs = {"A"}
+    completed = []
+    sink = IngestionSink("test-index", upload_concurrency=1, auto_flush_interval=0.01)
+    sink.add("a.zip", make_chunks("A", "1"), completed.append)
+    # The sender flushes on its own, like its auto flush, and drops the chunk
+    fake_sender.instances[0].flush()
+    deadline = time.monotonic() + 5
+    while sink.stats()["requeued"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert sink.stats()["requeued"] == 1
+    fake_sender.instances[0].flush()
+    assert completed == [0]
+    sink.close()
+
+
+def test_a_chunk_in_flight_is_not_queued_again_at_the_first_check(fake_sender):
+    sink = IngestionSink("test-index", upload_concurrency=1)
+    sink.add("a.zip", make_chunks("A", "1"), lambda failed: None)
+    # The chunk is taken from the queue, as by a batch request that has not returned yet
+    in_flight = fake_sender.instances[0].actions.pop()
+    assert sink._requeue_lost_chunks(0, is_flushed=False) == 0
+    assert sink._requeue_lost_chunks(0, is_flushed=False) == 1
+    # The answer of the first request resolves the chunk, the second one is ignored
+    fake_sender.instances[0].on_progress(in_flight)
+    sink.close()
+    assert sink.stats()["succeeded"] == 1 and sink.stats()["pending_documents"] == 0
+
+
+def test_a_document_completes_once_all_its_parts_are_uploaded():
+    completed = []
+    progress = DocumentProgress(completed.append)
+    progress.complete_part(1)
+    progress.complete_part(0)
+    assert completed == []
+    progress.set_part_count(3)
+    assert completed == []
+    progress.complete_part(2)
+    assert completed == [3]
+
+
+def test_parts_may_complete_before_the_part_count_is_known():
+    completed = []
+    progress = DocumentProgress(completed.append)
+    progress.complete_part()
+    progress.complete_part()
+    progress.set_part_count(2)
+    assert completed == [0]
+
+
+def test_a_failed_document_never_completes():
+    completed = []
+    progress = DocumentProgress(completed.append)
+    progress.complete_part()
+    progress.fail()
+    progress.set_part_count(2)
+    progress.complete_part()
+    assert completed == []
@@ -0,0 +1,55 @@
+import threading
+
+import pytest
+
+from utils.jobs import JobManager, JobConflictError, JOB_CANCELLED, JOB_FAILED, JOB_SUCCEEDED
+
+
+def run(manager, func):
+    job = manager.submit("task", func)
+    job._thread.join(5)
+    return job
+
+
+def test_a_job_returns_its_result():
+    job = run(JobManager(), lambda job: {"count": 3})
+    assert job.to_dict()["status"] == JOB_SUCCEEDED
+    assert job.to_dict()["result"] == {"count": 3}
+
+
+def test_a_failing_job_keeps_its_error():
+    def fail(job):
+        raise ValueError("broken")
+
+    job = run(JobManager(), fail)
+    assert job.status == JOB_FAILED and job.error == "broken"
+
+
+def test_a_second_job_is_rejected_while_the_first_runs():
+    manager = JobManager()
+    release = threading.Event()
+    job = manager.submit("task", lambda job: release.wait(5))
+    with pytest.raises(JobConflictError):
+        manager.submit("task", lambda job: None)
+    release.set()
+    job._thread.join(5)
+
+
+def test_a_cancelled_job_stops():
+    manager = JobManager()
+    job = manager.submit("task", lambda job: job.cancel_event.wait(5))
+    job.cancel()
+    job._thread.join(5)
+    assert job.status == JOB_CANCELLED
+
+
+def test_a_cancel_at_the_end_of_the_job_does_not_leave_it_cancelling():
+    def task(job):
+        # The progress is read once more when the task returns, cancel the job right then
+        job.track(lambda: job.cancel() or {})
+
+    job = run(JobManager(), task)
+    assert not job.is_running
+    assert job.status == JOB_CANCELLED
+    job.cancel()
+    assert job.status == JOB_CANCELLED
@@ -0,0 +1,109 @@
+import pytest
+
+from utils.ledger import IngestionLedger, STATUS_IN_PROGRESS, STATUS_DONE, STATUS_FAILED, STATUS_SKIPPED, \
+    REASON_ALREADY_INDEXED, MARKER_CATALOG_BACKFILLED, read_marker
+
+BLOB = ("wto/kw/2023-02-01_Regulation.zip", '"etag-1"', "hash-1")
+NEW_VERSION = ("wto/kw/2023-02-01_Regulation.zip", '"etag-2"', "hash-2")
+
+
+@pytest.fixture
+def ledger_path(tmp_path):
+    return str(tmp_path / "ingestion_ledger.db")
+
+
+@pytest.fixture
+def ledger(ledger_path):
+    ledger = IngestionLedger(ledger_path)
+    yield ledger
+    ledger.close()
+
+
+@pytest.mark.parametrize("status, is_finished", [
+    (STATUS_IN_PROGRESS, False),
+    (STATUS_FAILED, False),
+    (STATUS_DONE, True),
+    (STATUS_SKIPPED, True),
+])
+def test_only_done_and_skipped_blobs_are_finished(ledger, status, is_finished):
+    ledger.mark(*BLOB, status)
+    assert ledger.is_finished(*BLOB) is is_finished
+
+
+def test_a_blob_is_processed_again_after_it_failed(ledger):
+    ledger.mark(*BLOB, STATUS_DONE)
+    ledger.mark(*BLOB, STATUS_IN_PROGRESS)
+    assert not ledger.is_finished(*BLOB)
+    ledger.mark(*BLOB, STATUS_FAILED, "embed: timeout")
+    assert not ledger.is_finished(*BLOB)
+    ledger.mark(*BLOB, STATUS_DONE)
+    assert ledger.is_finished(*BLOB)
+
+
+def test_a_new_version_of_a_blob_is_not_finished(ledger):
+    ledger.mark(*BLOB, STATUS_DONE)
+    assert not ledger.is_finished(*NEW_VERSION)
+
+
+def test_finished_blobs_are_loaded_on_restart(ledger_path):
+    ledger = IngestionLedger(ledger_path)
+    ledger.mark(*BLOB, STATUS_DONE)
+    ledger.mark(*NEW_VERSION, STATUS_IN_PROGRESS)
+    ledger.close()
+
+    ledger = IngestionLedger(ledger_path)
+    try:
+        assert ledger.is_finished(*BLOB)
+        assert not ledger.is_finished(*NEW_VERSION)
+        assert ledger.status_counts() == {STATUS_DONE: 1, STATUS_IN_PROGRESS: 1}
+        assert ledger.session_status_counts() == {}
+    finally:
+        ledger.close()
+
+
+@pytest.mark.parametrize("status, reason, has_other_version", [
+    (STATUS_DONE, None, True),
+    (STATUS_SKIPPED, REASON_ALREADY_INDEXED, True),
+    (STATUS_SKIPPED, "empty chunks", False),
+    (STATUS_FAILED, "upload: 3 chunks could not be indexed", False),
+    (STATUS_IN_PROGRESS, None, False),
+])
+def test_a_replaced_blob_has_an_indexed_version(ledger, status, reason, has_other_version):
+    ledger.mark(*BLOB, status, reason)
+    assert ledger.has_other_version(*NEW_VERSION) is has_other_version
+    assert not ledger.has_other_version(*BLOB)
+
+
+def test_session_counts_keep_the_last_status_of_every_blob(ledger):
+    ledger.mark(*BLOB, STATUS_IN_PROGRESS)
+    ledger.mark(*BLOB, STATUS_DONE)
+    ledger.mark(*NEW_VERSION, STATUS_IN_PROGRESS)
+    ledger.mark(*NEW_VERSION, STATUS_FAILED, "parse: invalid zip")
+    assert ledger.session_status_counts() == {STATUS_DONE: 1, STATUS_FAILED: 1}
+
+
+def test_markers_are_kept_until_they_are_cleared(ledger_path):
+    ledger = IngestionLedger(ledger_path)
+    assert not ledger.has_marker(MARKER_CATALOG_BACKFILLED)
+    ledger.set_marker(MARKER_CATALOG_BACKFILLED)
+    ledger.close()
+
+    ledger = IngestionLedger(ledger_path)
+    try:
+        assert ledger.has_marker(MARKER_CATALOG_BACKFILLED)
+        ledger.set_marker(MARKER_CATALOG_BACKFILLED, False)
+        assert not ledger.has_marker(MARKER_CATALOG_BACKFILLED)
+    finally:
+        ledger.close()
+
+
+def test_a_marker_is_read_without_opening_the_ledger(ledger, ledger_path):
+    assert not read_marker(ledger_path, MARKER_CATALOG_BACKFILLED)
+    ledger.set_marker(MARKER_CATALOG_BACKFILLED)
+    assert read_marker(ledger_path, MARKER_CATALOG_BACKFILLED)
+
+
+def test_a_missing_ledger_has_no_marker_and_is_not_created(tmp_path):
+    ledger_path = tmp_path / "ingestion_ledger.db"
+    assert not read_marker(str(ledger_path), MARKER_CATALOG_BACKFILLED)
+    assert not ledger_path.exists()
@@ -0,0 +1,93 @@
+import threading
+
+from utils.pipeline import Pipeline, Stage
+
+
+def test_every_item_goes_through_every_stage():
+    outputs = []
+    lock = threading.Lock()
+
+    def collect(item):
+        with lock:
+            outputs.append(item)
+        return item
+
+    pipeline = Pipeline([Stage("double", lambda item: item * 2, workers=3), Stage("collect", collect, workers=2)],
+                        queue_size=2)
+    stats = pipeline.run(range(50))
+    assert sorted(outputs) == [item * 2 for item in range(50)]
+    assert stats["listed"] == 50
+    assert stats["double"]["processed"] == 50 and stats["collect"]["processed"] == 50
+    assert pipeline.listing_finished
+
+
+def test_a_failed_item_is_reported_and_the_others_go_on():
+    errors = []
+    outputs = []
+
+    def parse(item):
+        if item % 3 == 0:
+            raise ValueError(f"item {item} is invalid")
+        return item
+
+    pipeline = Pipeline([Stage("parse", parse, workers=2), Stage("collect", outputs.append)],
+                        on_error=lambda stage_name, item, error: errors.append((stage_name, item, str(error))))
+    stats = pipeline.run(range(10))
+    assert sorted(errors) == [("parse", item, f"item {item} is invalid") for item in (0, 3, 6, 9)]
+    assert sorted(outputs) == [1, 2, 4, 5, 7, 8]
+    assert stats["parse"]["failed"] == 4 and stats["parse"]["processed"] == 6
+    # The last stage returns None, so its items count as dropped
+    assert stats["collect"]["dropped"] == 6
+
+
+def test_a_failing_error_callback_does_not_stop_the_pipeline():
+    def on_error(stage_name, item, error):
+        raise RuntimeError("callback failed")
+
+    def fail(item):
+        raise ValueError("stage failed")
+
+    stats = Pipeline([Stage("fail", fail)], on_error=on_error).run(range(5))
+    assert stats["fail"]["failed"] == 5
+
+
+def test_a_generator_stage_fails_after_its_first_outputs():
+    errors = []
+    outputs = []
+
+    def split(item):
+        yield f"{item}-0"
+        yield f"{item}-1"
+        raise ValueError("window could not be split")
+
+    pipeline = Pipeline([Stage("split", split), Stage("collect", outputs.append)],
+                        on_error=lambda stage_name, item, error: errors.append((stage_name, item)))
+    stats = pipeline.run(["a"])
+    assert outputs == ["a-0", "a-1"]
+    assert errors == [("split", "a")]
+    assert stats["split"]["failed"] == 1
+
+
+def test_none_drops_the_item():
+    outputs = []
+    stats = Pipeline([Stage("filter", lambda item: item if item % 2 else None),
+                      Stage("collect", outputs.append)]).run(range(6))
+    assert sorted(outputs) == [1, 3, 5]
+    assert stats["filter"]["dropped"] == 3
+
+
+def test_a_cancelled_pipeline_stops_listing():
+    cancel_event = threading.Event()
+    outputs = []
+
+    def source():
+        for item in range(100):
+            if item == 5:
+                cancel_event.set()
+            yield item
+
+    pipeline = Pipeline([Stage("collect", outputs.append)], cancel_event=cancel_event)
+    stats = pipeline.run(source())
+    assert pipeline.cancelled and not pipeline.listing_finished
+    assert stats["listed"] == 5
+    assert len(outputs) + stats["collect"]["cancelled"] == 5
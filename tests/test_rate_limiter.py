@@ -0,0 +1,125 @@
+import httpx
+import openai
+import pytest
+
+import utils.rate_limiter as rate_limiter
+from utils.rate_limiter import RateLimiter, get_retry_after
+
+
+class FakeRawResponse:
+
+    def __init__(self, headers, result="result"):
+        self.headers = headers
+        self.result = result
+
+    def parse(self):
+        return self.result
+
+
+def rate_limit_error(headers):
+    request = httpx.Request("POST", "https://test.openai.azure.com/openai/deployments/ada/embeddings")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("Rate limit is exceeded.", response=response, body=None)
+
+
+@pytest.fixture(autouse=True)
+def fake_clock(monkeypatch, clock):
+    monkeypatch.setattr(rate_limiter, "time", clock)
+    return clock
+
+
+def test_requests_within_the_quota_do_not_wait(fake_clock):
+    limiter = RateLimiter("ada", requests_per_minute=3, tokens_per_minute=3000)
+    for _ in range(3):
+        limiter.acquire(1000)
+    assert fake_clock.sleeps == []
+
+
+def test_a_request_waits_until_the_tokens_are_refilled(fake_clock):
+    limiter = RateLimiter("ada", requests_per_minute=100, tokens_per_minute=6000)
+    limiter.acquire(6000)
+    start = fake_clock.now
+    limiter.acquire(600)
+    # 600 tokens are refilled in 6 seconds
+    assert fake_clock.now - start == pytest.approx(6)
+
+
+def test_a_request_waits_until_a_request_is_refilled(fake_clock):
+    limiter = RateLimiter("ada", requests_per_minute=2, tokens_per_minute=100000)
+    limiter.acquire(1)
+    limiter.acquire(1)
+    start = fake_clock.now
+    limiter.acquire(1)
+    assert fake_clock.now - start == pytest.approx(30)
+
+
+def test_a_request_larger_than_the_quota_waits_for_a_full_bucket(fake_clock):
+    limiter = RateLimiter("ada", requests_per_minute=100, tokens_per_minute=1000)
+    limiter.acquire(500)
+    start = fake_clock.now
+    limiter.acquire(5000)
+    assert fake_clock.now - start == pytest.approx(30)
+
+
+def test_block_delays_every_request(fake_clock):
+    limiter = RateLimiter("ada", requests_per_minute=100, tokens_per_minute=6000)
+    limiter.block(10)
+    start = fake_clock.now
+    limiter.acquire(1)
+    assert fake_clock.now - start >= 10
+
+
+def test_the_buckets_are_lowered_to_the_remaining_quota(fake_clock):
+    limiter = RateLimiter("ada", requests_per_minute=100, tokens_per_minute=6000)
+    limiter.update_from_headers({"x-ratelimit-remaining-requests": "100", "x-ratelimit-remaining-tokens": "0"})
+    start = fake_clock.now
+    limiter.acquire(100)
+    assert fake_clock.now - start == pytest.approx(1)
+
+
+def test_headers_never_raise_the_buckets(fake_clock):
+    limiter = RateLimiter("ada", requests_per_minute=100, tokens_per_minute=6000)
+    limiter.acquire(6000)
+    limiter.update_from_headers({"x-ratelimit-remaining-tokens": "6000", "x-ratelimit-remaining-requests": "x"})
+    start = fake_clock.now
+    limiter.acquire(600)
+    assert fake_clock.now - start == pytest.approx(6)
+
+
+def test_a_rate_limited_request_is_retried_after_the_requested_delay(fake_clock):
+    limiter = RateLimiter("ada", requests_per_minute=100, tokens_per_minute=6000)
+    responses = [rate_limit_error({"retry-after": "7"}), FakeRawResponse({})]
+
+    def request():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    start = fake_clock.now
+    assert limiter.call(10, request) == "result"
+    assert fake_clock.now - start >= 7
+    assert limiter.throttled_count == 1
+
+
+def test_a_request_fails_once_it_is_out_of_retries():
+    limiter = RateLimiter("ada", requests_per_minute=100, tokens_per_minute=6000, max_retries=2)
+    attempts = []
+
+    def request():
+        attempts.append(1)
+        raise rate_limit_error({"retry-after-ms": "10"})
+
+    with pytest.raises(openai.RateLimitError):
+        limiter.call(10, request)
+    assert len(attempts) == 3
+
+
+@pytest.mark.parametrize("headers, delay", [
+    ({"retry-after-ms": "1500", "retry-after": "2"}, 1.5),
+    ({"retry-after": "2"}, 2),
+    ({"retry-after": "Wed, 21 Oct 2026 07:28:00 GMT"}, None),
+    ({}, None),
+])
+def test_get_retry_after(headers, delay):
+    assert get_retry_after(headers) == delay
@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+import utils.search as search
+from utils.ledger import IngestionLedger, MARKER_CATALOG_BACKFILLED
+
+CATALOG = [{"id": f"{index}", "title": f"Catalog {index // 2}"} for index in range(10)]
+CHUNKS = [{"title": "Chunk 0"}, {"title": "Chunk 0"}, {"title": "Chunk 1"}]
+
+
+class FakeResults:
+
+    def __init__(self, results):
+        self.results = results
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for result in self.results:
+            yield result
+
+
+class FakeSearchClient:
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.requests = 0
+
+    async def search(self, filter=None, top=50, skip=None, **kwargs):
+        self.requests += 1
+        documents = [document for document in self.documents
+                     if not filter or f"title ne '{document['title']}'" not in filter]
+        return FakeResults(documents[skip or 0:(skip or 0) + top])
+
+
+@pytest.fixture
+def clients(monkeypatch, tmp_path):
+    catalog_client = FakeSearchClient(CATALOG)
+    monkeypatch.setattr(search.search_clients, "get_client", lambda index_name: catalog_client)
+    monkeypatch.setattr(search, "LEDGER_PATH", str(tmp_path / "ingestion_ledger.db"))
+    monkeypatch.setattr(search, "_catalog_marker", {"is_set": False, "read_at": None})
+    return catalog_client, FakeSearchClient(CHUNKS)
+
+
+def set_catalog_marker(is_set=True):
+    ledger = IngestionLedger(search.LEDGER_PATH)
+    try:
+        ledger.set_marker(MARKER_CATALOG_BACKFILLED, is_set)
+    finally:
+        ledger.close()
+
+
+def test_the_chunk_index_is_searched_until_the_catalog_is_filled(clients):
+    catalog_client, chunk_client = clients
+    titles = asyncio.run(search.fetch_latest_titles_async(chunk_client, 2))
+    assert titles == ["Chunk 0", "Chunk 1"]
+    assert catalog_client.requests == 0
+
+
+def test_the_filled_catalog_is_searched(clients):
+    catalog_client, chunk_client = clients
+    set_catalog_marker()
+    titles = asyncio.run(search.fetch_latest_titles_async(chunk_client, 3, page_size=2))
+    assert titles == ["Catalog 0", "Catalog 1", "Catalog 2"]
+    assert chunk_client.requests == 0
+
+
+def test_the_catalog_marker_is_read_again_after_its_ttl(clients, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(search.time, "monotonic", lambda: now[0])
+    assert not search.is_catalog_backfilled()
+    set_catalog_marker()
+    assert not search.is_catalog_backfilled()
+    now[0] += search.CATALOG_MARKER_TTL
+    assert search.is_catalog_backfilled()
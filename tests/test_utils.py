@@ -0,0 +1,266 @@
+import asyncio
+import random
+import threading
+from types import SimpleNamespace
+
+import pytest
+import tiktoken
+
+import utils.utils as utils
+from utils.utils import TokenChunker, split_text_to_chunks, iter_pdf_pages, parse_pdf_with_path, \
+    shutdown_pdf_process_pool, rerank_contexts
+from utils.embedding_cache import QueryEmbeddingCache
+
+WORDS = ["regulation", "article", "the", "of", "shall", "be", "Türkiye", "çevre", "(a)", "1.2", "e.g.", "§4"]
+SEPARATORS = [" "] * 12 + [". ", "; ", "\n", "\n\n", " \n \n ", "\t", "  "]
+
+
+def make_text(rng, word_count):
+    return "".join(rng.choice(WORDS) + rng.choice(SEPARATORS) for _ in range(word_count))
+
+
+def split_into_parts(rng, text, part_count):
+    cuts = sorted(rng.sample(range(len(text) + 1), min(part_count, len(text) + 1)))
+    return [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+
+
+def make_pdf(page_texts):
+    # A minimal PDF file with one line of text per page
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_numbers = []
+    for text in page_texts:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {len(objects)} 0 R "
+                       f"/Resources << /Font << /F1 3 0 R >> >> >>")
+        page_numbers.append(len(objects))
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{number} 0 R' for number in page_numbers)}] " \
+                 f"/Count {len(page_numbers)} >>"
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n{body}\nendobj\n".encode("ascii")
+    xref_offset = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("ascii")
+    pdf += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("ascii")
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("ascii")
+    return pdf
+
+
+def test_chunks_fit_the_chunk_size(tokenizer):
+    rng = random.Random(1)
+    text = make_text(rng, 3000)
+    for chunk_size in (5, 50, 500):
+        chunker = TokenChunker(chunk_size, chunk_size // 5, tokenizer=tokenizer)
+        chunks = chunker.split(text)
+        assert chunks
+        for chunk in chunks:
+            assert 0 < chunk.token_count <= chunk_size
+            assert text[chunk.start:chunk.end].strip() == chunk.text
+
+
+def test_chunks_cover_the_text_in_order(tokenizer):
+    rng = random.Random(2)
+    text = make_text(rng, 2000)
+    chunks = TokenChunker(40, 0, tokenizer=tokenizer).split(text)
+    assert "".join(text[chunk.start:chunk.end] for chunk in chunks).split() == text.split()
+    assert all(not text[chunk.start:previous.end].strip() for previous, chunk in zip(chunks, chunks[1:]))
+
+
+def test_chunks_overlap_with_the_previous_chunk(tokenizer):
+    rng = random.Random(3)
+    text = " ".join(rng.choice([word for word in WORDS if word.isalpha()]) for _ in range(2000))
+    chunks = TokenChunker(60, 15, tokenizer=tokenizer).split(text)
+    assert len(chunks) > 2
+    for previous, chunk in zip(chunks, chunks[1:]):
+        overlap = text[chunk.start:previous.end].strip()
+        assert overlap and previous.text.endswith(overlap) and chunk.text.startswith(overlap)
+
+
+def test_paragraphs_are_kept_together_when_they_fit(tokenizer):
+    paragraphs = ["first paragraph of the text", "second paragraph of the text", "third paragraph of the text"]
+    chunks = TokenChunker(8, 0, tokenizer=tokenizer).split("\n\n".join(paragraphs))
+    assert [chunk.text for chunk in chunks] == paragraphs
+
+
+def test_text_without_separators_is_cut_at_the_token_limit(tokenizer):
+    text = "a." * 2500
+    chunks = TokenChunker(20, 0, tokenizer=tokenizer).split(text)
+    assert "".join(chunk.text for chunk in chunks) == text
+    assert all(chunk.token_count <= 20 for chunk in chunks)
+
+
+@pytest.mark.parametrize("text", ["", "   ", "\n\n \n"])
+def test_blank_text_has_no_chunks(tokenizer, text):
+    chunker = TokenChunker(10, 2, tokenizer=tokenizer)
+    assert chunker.split(text) == []
+    assert list(chunker.split_stream([text, text])) == []
+
+
+@pytest.mark.parametrize("chunk_size, chunk_overlap", [(1, 0), (3, 1), (10, 2), (100, 20), (500, 100), (2500, 100)])
+def test_split_stream_matches_split(tokenizer, chunk_size, chunk_overlap):
+    rng = random.Random(chunk_size)
+    chunker = TokenChunker(chunk_size, chunk_overlap, tokenizer=tokenizer)
+    for _ in range(20):
+        text = make_text(rng, rng.randint(1, 1500))
+        parts = split_into_parts(rng, text, rng.randint(0, 12))
+        assert list(chunker.split_stream(parts)) == [chunk.text for chunk in chunker.split(text)]
+
+
+def test_split_stream_matches_split_at_page_boundaries(tokenizer):
+    rng = random.Random(4)
+    pages = [make_text(rng, 300).strip() + "\n" for _ in range(10)]
+    chunker = TokenChunker(100, 20, tokenizer=tokenizer)
+    assert list(chunker.split_stream(pages)) == [chunk.text for chunk in chunker.split("".join(pages))]
+
+
+def test_split_is_deterministic(tokenizer):
+    text = make_text(random.Random(5), 1000)
+    chunker = TokenChunker(50, 10, tokenizer=tokenizer)
+    assert chunker.split(text) == TokenChunker(50, 10, tokenizer=tokenizer).split(text)
+
+
+def test_get_tokenizer_fails_without_the_encoding(monkeypatch):
+    def get_encoding(name):
+        raise ValueError("encoding file is not available")
+
+    monkeypatch.setattr(utils, "_tokenizer", None)
+    monkeypatch.setattr(tiktoken, "get_encoding", get_encoding)
+    with pytest.raises(RuntimeError, match="cl100k_base"):
+        utils.get_tokenizer()
+    with pytest.raises(RuntimeError):
+        utils.count_tokens("some text")
+
+
+def test_split_text_to_chunks_derives_the_ids_from_the_content(word_tokenizer):
+    text = make_text(random.Random(7), 3000)
+    parent_child_chunks = split_text_to_chunks(text, source_key="Regulation|2023-02-01|txt")
+    assert list(parent_child_chunks) == list(split_text_to_chunks(text, source_key="Regulation|2023-02-01|txt"))
+    assert [chunks[0]["parent_chunk"] for chunks in parent_child_chunks.values()] == \
+        [chunk.text for chunk in utils.parent_chunker.split(text)]
+    for parent_id, chunks in parent_child_chunks.items():
+        assert [chunk["chunk"] for chunk in chunks] == \
+            [chunk.text for chunk in utils.child_chunker.split(chunks[0]["parent_chunk"])]
+        assert all(chunk["parent_id"] == parent_id for chunk in chunks)
+
+
+@pytest.mark.parametrize("chunk_size, chunk_overlap, boundary_tokens", [(10, 2, 5), (100, 20, 150), (500, 50, 1000)])
+def test_content_defined_boundaries_keep_split_stream_and_the_chunk_size(tokenizer, chunk_size, chunk_overlap,
+                                                                         boundary_tokens):
+    rng = random.Random(chunk_size)
+    chunker = TokenChunker(chunk_size, chunk_overlap, tokenizer=tokenizer, boundary_tokens=boundary_tokens)
+    for _ in range(10):
+        text = make_text(rng, rng.randint(1, 3000))
+        chunks = chunker.split(text)
+        assert all(0 < chunk.token_count <= chunk_size for chunk in chunks)
+        assert list(chunker.split_stream(split_into_parts(rng, text, 8))) == [chunk.text for chunk in chunks]
+
+
+def test_content_defined_boundaries_resynchronize_after_an_edit(tokenizer):
+    # Paragraphs of the same size, so that packing by size alone moves every chunk after the edit
+    paragraphs = [f"article {number} of the regulation shall be applied by the member states"
+                  for number in range(100, 500)]
+    edited = paragraphs[:10] + ["an inserted paragraph"] + paragraphs[10:]
+
+    def changed_chunks(chunker):
+        chunks = {chunk.text for chunk in chunker.split("\n\n".join(paragraphs))}
+        return len({chunk.text for chunk in chunker.split("\n\n".join(edited))} - chunks), len(chunks)
+
+    changed_count, chunk_count = changed_chunks(TokenChunker(300, 30, tokenizer=tokenizer))
+    assert changed_count > chunk_count // 2
+    changed_count, _ = changed_chunks(TokenChunker(300, 30, tokenizer=tokenizer, boundary_tokens=600))
+    assert changed_count <= 3
+
+
+def test_pdf_pages_are_parsed_from_shared_memory_in_the_process_pool(monkeypatch):
+    monkeypatch.setitem(utils.PDF_PARSE_CONFIG, "workers", 2)
+    monkeypatch.setitem(utils.PDF_PARSE_CONFIG, "pages_per_task", 2)
+    shared_names = []
+    share_pdf_content_in_memory = utils.share_pdf_content
+
+    def share_pdf_content(pdf_content):
+        shared_content = share_pdf_content_in_memory(pdf_content)
+        shared_names.append(shared_content.name)
+        return shared_content
+
+    monkeypatch.setattr(utils, "share_pdf_content", share_pdf_content)
+    page_texts = [f"Article {number} of the regulation" for number in range(5)]
+    try:
+        assert list(iter_pdf_pages("annex.pdf", make_pdf(page_texts))) == page_texts
+    finally:
+        shutdown_pdf_process_pool()
+    # The shared memory block is removed once the pages are parsed
+    with pytest.raises(FileNotFoundError):
+        utils.shared_memory.SharedMemory(name=shared_names[0])
+
+
+def test_a_pdf_that_cannot_be_parsed_raises(monkeypatch):
+    monkeypatch.setitem(utils.PDF_PARSE_CONFIG, "workers", 1)
+    with pytest.raises(RuntimeError, match="broken.pdf"):
+        list(iter_pdf_pages("broken.pdf", b"%PDF-1.4 not a PDF file"))
+
+
+def test_parse_pdf_with_path(monkeypatch, tmp_path):
+    monkeypatch.setitem(utils.PDF_PARSE_CONFIG, "workers", 1)
+    pdf_path = tmp_path / "annex.pdf"
+    pdf_path.write_bytes(make_pdf(["First page", "Second page"]))
+    pdf_dict = parse_pdf_with_path(str(pdf_path))
+    assert pdf_dict["page_count"] == 2
+    assert pdf_dict["page_contents"] == ["First page", "Second page"]
+    assert pdf_dict["full_content"] == "First pageSecond page"
+
+
+def test_queries_bypass_the_embedding_cache_of_the_ingestion(monkeypatch):
+    calls = []
+
+    async def embed_async(input_strings, verbose_token=False, use_cache=True):
+        calls.append((list(input_strings), use_cache))
+        return [[float(len(input_string))] * 4 for input_string in input_strings]
+
+    monkeypatch.setattr(utils, "embedding_engine", SimpleNamespace(embed_async=embed_async))
+    monkeypatch.setattr(utils, "query_embedding_cache", QueryEmbeddingCache(10, 1024, 60))
+    assert asyncio.run(utils.get_query_embeddings_async(["limit", "annex"])) == [[5.0] * 4, [5.0] * 4]
+    assert asyncio.run(utils.get_query_embeddings_async(["Limit", "scope"])) == [[5.0] * 4, [5.0] * 4]
+    assert calls == [(["limit", "annex"], False), (["scope"], False)]
+
+    monkeypatch.setattr(utils, "query_embedding_cache", None)
+    asyncio.run(utils.get_query_embeddings_async(["limit"]))
+    assert calls[-1] == (["limit"], False)
+
+
+def test_the_tokens_of_a_batch_are_counted_off_the_event_loop(monkeypatch):
+    counting_threads = []
+    token_counts = []
+
+    def count_tokens(text):
+        counting_threads.append(threading.current_thread())
+        return len(text.split())
+
+    async def call_async(token_count, request):
+        token_counts.append(token_count)
+        return SimpleNamespace(data=[SimpleNamespace(index=index, embedding=[1.0]) for index in range(2)])
+
+    async def embed_batch():
+        engine = utils.AsyncEmbeddingEngine(utils.ADA_CONFIG, 1, 16, SimpleNamespace(call_async=call_async))
+        engine._semaphore = asyncio.Semaphore(1)
+        embeddings = [None, None]
+        await engine._embed_batch(["two words", "three more words"], [0, 1], embeddings)
+        return embeddings
+
+    monkeypatch.setattr(utils, "count_tokens", count_tokens)
+    assert asyncio.run(embed_batch()) == [[1.0], [1.0]]
+    assert token_counts == [5]
+    assert threading.current_thread() not in counting_threads
+
+
+def test_rerank_contexts_fuses_the_rankings():
+    first = [{"parent_id": "a", "ranking": 1}, {"parent_id": "b", "ranking": 2}, {"parent_id": "c", "ranking": 3}]
+    second = [{"parent_id": "b", "ranking": 1}, {"parent_id": "d", "ranking": 2}, {"parent_id": "a", "ranking": 3}]
+    assert [item["parent_id"] for item in rerank_contexts([first, second])] == ["b", "a", "d", "c"]
+
+
+def test_rerank_contexts_keeps_the_first_item_of_a_parent():
+    first = [{"parent_id": "a", "ranking": 1, "chunk": "from first"}]
+    second = [{"parent_id": "a", "ranking": 1, "chunk": "from second"}]
+    assert rerank_contexts([first, second]) == first